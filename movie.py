@@ -28,11 +28,18 @@ for line in sequence_file:
         for letter in line:
             sequence_string += letter
 
+nucleotide_final, post_tata_sequence, \
+    pre_tata_distance, nucleotide_distance = nucleotide(sequence_string)
+# The DNA up until the promoter is the same in every frame, it is written once
+# to an include file when the first frame is created
+static_dna = None
+
 def frame(step):
     """" Main function that renders a frame.
     Calls upon multiple other functions and imported objects."""
-    nucleotide_final, post_tata_sequence, \
-        pre_tata_distance, nucleotide_distance = nucleotide(sequence_string)
+    global static_dna
+    if static_dna is None:
+        static_dna = pypovray.static_include('dna', [nucleotide_final])
     # Show some information about how far we are with rendering
     curr_time = step / eval(SETTINGS.NumberFrames) * eval(SETTINGS.FrameTime)
     logger.info(" @Time: %.3fs, Step: %d", curr_time, step)
@@ -87,10 +94,11 @@ def frame(step):
         light_x = post_tata_x
 
     return Scene(camera,
-                 objects=[LightSource([light_x, 8, -20], 0.8), polymerase, nucleotide_final,
+                 objects=[LightSource([light_x, 8, -20], 0.8), polymerase,
                           transition_bot, transition_top, stretch_bot,
                           stretch_top, nucleotide_top_stretched,
-                          nucleotide_bot_stretched, new_all])
+                          nucleotide_bot_stretched, new_all],
+                 included=[static_dna])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,251 @@
+"""
+End-to-end rendering benchmark using the scenes of this project.
+
+Each workload is rendered through the pypovray pipeline (scene optimization,
+render planning, the worker pool and render cache, as configured) at a number
+of quality profiles in a separate process, reporting frames per second, CPU
+time (including the workers and POV-Ray) and the peak memory use. Results are stored as JSON so that two runs (i.e. before
+and after a change to pypovray or vapory) can be compared:
+
+    python -m pypovray.benchmark run --output before.json
+    python -m pypovray.benchmark run --output after.json
+    python -m pypovray.benchmark compare before.json after.json
+"""
+
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import time
+from tempfile import TemporaryDirectory
+import numpy as np
+from vapory import Scene, Camera, Sphere, LightSource, Texture, Pigment, Finish
+from pypovray import SETTINGS, logger, models, pypovray
+from pypovray.drop import membrane
+from pypovray.pdb import PDBMolecule
+from pypovray.profiling import RenderProfile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Render settings, matching the draft (prototype.ini) and final (default.ini) configurations
+PROFILES = {
+    'draft': {'width': 320, 'height': 240, 'quality': 3, 'antialiasing': None},
+    'medium': {'width': 800, 'height': 600, 'quality': 6, 'antialiasing': 0.3},
+    'final': {'width': 1600, 'height': 1200, 'quality': 9, 'antialiasing': 0.01},
+}
+
+
+def _movie_workload(nframes):
+    """ The RNA synthesis animation of movie.py, frames spread over all of its phases """
+    frame = pypovray.load_scene(os.path.join(PROJECT_DIR, 'movie.py'),
+                                [os.path.join(PROJECT_DIR, 'sequence.fasta')])
+    total = math.ceil(eval(SETTINGS.NumberFrames))
+    return frame, [int(step) for step in np.linspace(0, total - 1, nframes)]
+
+
+def _molecule_workload(pdb_file, sticks):
+    """ A PDB molecule as space-filling or ball-and-stick model, with the camera
+    circling around it """
+    def workload(nframes):
+        molecule = PDBMolecule(os.path.join(PROJECT_DIR, 'pdb', pdb_file))
+        if sticks:
+            molecule.scale_atom_distance(2)
+            molecule.show_stick_model()
+
+        def frame(step):
+            angle = 2 * math.pi * step / nframes
+            camera = Camera('location', [35 * math.sin(angle), 10, -35 * math.cos(angle)],
+                            'look_at', [0, 0, 0])
+            return Scene(camera, objects=[models.default_light] + molecule.povray_molecule)
+        return frame, list(range(nframes))
+    return workload
+
+
+def _membrane_workload(nframes):
+    """ A droplet (pinocytosis) membrane from `pypovray.drop.membrane`, drawn as
+    lipid head spheres in a number of slices """
+    lipid_model = Texture(Pigment('color', [0.9, 0.8, 0.2]), Finish('phong', 0.5))
+
+    def frame(step):
+        lipids = []
+        for depth in range(-5, 6):
+            coordinates = membrane(step, 3, 1, -5, 5, nframes, [0, 0, depth * 0.5], 15, 0.5)
+            lipids += [Sphere(coordinate[:3], 0.25, lipid_model) for coordinate in coordinates]
+        return Scene(Camera('location', [0, 10, -25], 'look_at', [0, 0, 0]),
+                     objects=[models.default_light] + lipids)
+    return frame, list(range(nframes))
+
+
+def _spiral_workload(nframes):
+    """ The 200 sphere Fibonacci spiral of vapory's examples/spiral.py """
+    n_spheres = 200
+    angles = [math.pi * (math.sqrt(5) - 1) * i for i in range(n_spheres)]
+    distances = [0.5 * i for i in range(n_spheres)]
+    radii = [0.7 * math.sqrt(i) for i in range(n_spheres)]
+    light_sources = [LightSource(location, color) for location, color in
+                     [((100, 100, -100), (1, 1, 1)),
+                      ((150, 150, -100), (0, 0, 0.3)),
+                      ((-150, 150, -100), (0, 0.3, 0)),
+                      ((150, -150, -100), (0.3, 0, 0))]]
+    spheres = [Sphere([d * math.sin(a), d * math.cos(a), 0], r,
+                      Texture(Finish('ambient', 0, 'diffuse', 0, 'reflection', 0, 'specular', 1),
+                              Pigment('color', [1, 1, 1])))
+               for d, r, a in zip(distances, radii, angles)]
+
+    def frame(step):
+        return Scene(Camera('location', [0, 0, -128 + step], 'look_at', [0, 0, 0]),
+                     objects=light_sources + spheres)
+    return frame, list(range(nframes))
+
+
+WORKLOADS = {
+    'movie': _movie_workload,
+    'viagra-balls': _molecule_workload('viagra.pdb', sticks=False),
+    'viagra-sticks': _molecule_workload('viagra.pdb', sticks=True),
+    'atp-balls': _molecule_workload('ATP_ideal.pdb', sticks=False),
+    'atp-sticks': _molecule_workload('ATP_ideal.pdb', sticks=True),
+    'membrane': _membrane_workload,
+    'spiral': _spiral_workload,
+}
+
+
+def measure(workload, profile, nframes):
+    """ Renders `nframes` frames of a workload at a quality profile with
+    `pypovray._render_scene` (in the current process, which changes its
+    settings) and returns the measurements """
+    start = time.time()
+    frame, steps = WORKLOADS[workload](nframes)
+    setup = time.time() - start
+
+    cwd = os.getcwd()
+    with TemporaryDirectory() as folder:
+        # The images, job files and render cache of a measurement are not reused
+        image_dir = os.path.join(folder, 'images')
+        os.makedirs(image_dir)
+        settings = PROFILES[profile]
+        _override_settings({'ImageWidth': settings['width'], 'ImageHeight': settings['height'],
+                            'Quality': settings['quality'], 'AntiAlias': settings['antialiasing'],
+                            'OutputImageDir': image_dir,
+                            'OutputPrefix': 'benchmark', 'Resume': False,
+                            'RenderCacheDir': os.path.join(folder, 'cache')})
+        os.chdir(folder)
+        try:
+            render_profile = RenderProfile()
+            pypovray._render_scene(frame, profile=render_profile, frame_ids=steps)
+            render_profile.finish()
+        finally:
+            os.chdir(cwd)
+
+    summary = render_profile.summary()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {'workload': workload, 'profile': profile, 'frames': len(steps),
+            'setup': setup,
+            'elapsed': summary['elapsed'],
+            'frames_per_second': summary['frames_per_second'],
+            'cpu_time': usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime,
+            # ru_maxrss is in kilobytes on Linux; for the children (the pool's
+            # worker processes and POV-Ray) it is the peak of the largest child,
+            # not of all children together
+            'peak_rss_mb': usage.ru_maxrss / 1024,
+            'largest_child_rss_mb': children.ru_maxrss / 1024,
+            'phases': {phase: stats['total'] for phase, stats in summary['phases'].items()}}
+
+
+def _override_settings(settings):
+    """ Replaces settings of the loaded configuration file; None clears a setting """
+    for key, value in settings.items():
+        sections = [section for section in SETTINGS.config.sections()
+                    if SETTINGS.config.has_option(section, key)] or ['GENERAL']
+        for section in sections:
+            SETTINGS.config.set(section, key, '' if value is None else str(value))
+
+
+def run(workloads, profiles, nframes):
+    """ Measures every workload at every profile, each in a fresh process so that
+    CPU time and peak memory use are not shared between measurements """
+    results = []
+    for workload in workloads:
+        for profile in profiles:
+            logger.info('["%s"] - benchmarking %s (%s, %d frames)',
+                        sys._getframe().f_code.co_name, workload, profile, nframes)
+            output = subprocess.run([sys.executable, '-m', 'pypovray.benchmark', 'measure',
+                                     workload, profile, str(nframes)],
+                                    stdout=subprocess.PIPE, check=True).stdout
+            results.append(json.loads(output.decode('utf-8').splitlines()[-1]))
+            _print_results(results[-1:])
+    return results
+
+
+def compare(before, after, threshold=0.05):
+    """ Prints the change between two benchmark runs; frames per second that drop
+    by more than `threshold` are marked as regressions """
+    previous = {(result['workload'], result['profile']): result for result in before}
+    print('{:<16}{:<8}{:>12}{:>12}{:>9}{:>12}{:>12}'.format(
+        'workload', 'profile', 'fps before', 'fps after', 'change', 'cpu change', 'rss change'))
+    for result in after:
+        old = previous.get((result['workload'], result['profile']))
+        if old is None:
+            continue
+        change = result['frames_per_second'] / old['frames_per_second'] - 1
+        print('{:<16}{:<8}{:>12.3f}{:>12.3f}{:>+8.1%}{:>+12.1%}{:>+12.1%}{}'.format(
+            result['workload'], result['profile'], old['frames_per_second'],
+            result['frames_per_second'], change,
+            result['cpu_time'] / old['cpu_time'] - 1,
+            result['peak_rss_mb'] / old['peak_rss_mb'] - 1,
+            '  REGRESSION' if change < -threshold else ''))
+
+
+def _print_results(results):
+    for result in results:
+        print('{workload:<16}{profile:<8}{frames:>4} frames {frames_per_second:>8.3f} fps '
+              '{cpu_time:>8.2f}s cpu {peak_rss_mb:>8.1f}MB rss '
+              '({largest_child_rss_mb:.1f}MB largest child peak rss)'.format(**result))
+
+
+def main(args):
+    """ Runs or compares benchmarks """
+    parser = argparse.ArgumentParser(description='Benchmark rendering performance')
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='run the benchmark')
+    run_parser.add_argument('--workloads', default=','.join(WORKLOADS),
+                            help='comma separated workloads (default: all)')
+    run_parser.add_argument('--profiles', default='draft,medium',
+                            help='comma separated profiles out of {}'.format(', '.join(PROFILES)))
+    run_parser.add_argument('--frames', type=int, default=5, help='frames per workload')
+    run_parser.add_argument('--output', help='JSON file to store the results in')
+    compare_parser = commands.add_parser('compare', help='compare two benchmark results')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=0.05)
+    measure_parser = commands.add_parser('measure')
+    measure_parser.add_argument('workload', choices=list(WORKLOADS))
+    measure_parser.add_argument('profile', choices=list(PROFILES))
+    measure_parser.add_argument('frames', type=int)
+    options = parser.parse_args(args[1:])
+
+    if options.command == 'run':
+        results = run(options.workloads.split(','), options.profiles.split(','), options.frames)
+        if options.output:
+            with open(options.output, 'w') as output:
+                json.dump({'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                           'results': results}, output, indent=1)
+    elif options.command == 'compare':
+        with open(options.before) as before, open(options.after) as after:
+            compare(json.load(before)['results'], json.load(after)['results'],
+                    options.threshold)
+    elif options.command == 'measure':
+        # Used by 'run'; the result is printed as the last line of output
+        print(json.dumps(measure(options.workload, options.profile, options.frames)))
+    else:
+        parser.print_help()
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,207 @@
+"""
+Content-addressed cache of rendered images shared between jobs.
+
+Rendered images are stored under the digest of their scene and render
+settings (see `manifest.scene_digest`), so identical frames are rendered
+only once and copied (or hard-linked) into place afterwards. The cache is
+bounded in size; the least recently used images are removed first.
+
+A frame being rendered is claimed (see `RenderCache.claim`), so identical
+frames rendered at the same time wait for its image instead of rendering it
+again.
+"""
+
+import os
+import shutil
+import socket
+import threading
+import time
+from tempfile import mkstemp
+
+
+class RenderCache(object):
+    """ A folder of rendered images named by their digest, limited to `max_size` bytes.
+
+    The size of the cache is counted from the images stored through this object and
+    only measured again (walking the whole cache) when it exceeds `max_size` or
+    after every `rescan` stores, as other jobs may store images as well.
+
+    Claims and temporary files left by jobs that were killed are removed when
+    the cache is walked, the latter once they are `stale_age` seconds old. """
+
+    def __init__(self, cache_dir, max_size, rescan=100, stale_age=24 * 3600):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size
+        self.rescan = rescan
+        self.stale_age = stale_age
+        # Unknown until the cache is first walked
+        self.size = None
+        self.stores = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path(self, digest):
+        """ Location of the cached image for a digest """
+        return os.path.join(self.cache_dir, digest[:2], digest + '.png')
+
+    def claim(self, digest, owner):
+        """ Claims rendering the image for `digest` for `owner` (i.e. a frame id)
+        until it is stored or `release`d. Returns the owner of the claim, as a
+        string; another owner means an identical image is being rendered.
+
+        The claim records the host and process, so that a claim left by a process
+        of this host that ended (or a claim older than `stale_age`) is taken over. """
+        claim_file = self._claim_file(digest)
+        os.makedirs(os.path.dirname(claim_file), exist_ok=True)
+        # The claim is linked into place with its owner already written
+        fd, temp_file = mkstemp(dir=os.path.dirname(claim_file), suffix='.tmp')
+        with os.fdopen(fd, 'w') as claim:
+            claim.write('{}\n{}\n{}\n'.format(owner, socket.gethostname(), os.getpid()))
+        try:
+            os.link(temp_file, claim_file)
+        except FileExistsError:
+            try:
+                claimed = self._claim_owner(claim_file)
+                if claimed is not None:
+                    return claimed
+                self._remove_stale_claim(claim_file)
+            except FileNotFoundError:
+                # Released in the meantime
+                pass
+            return self.claim(digest, owner)
+        except OSError:
+            # No hard links on this file system, identical frames are not detected
+            pass
+        finally:
+            os.remove(temp_file)
+        return str(owner)
+
+    def release(self, digest):
+        """ Removes the claim on rendering the image for `digest` """
+        try:
+            os.remove(self._claim_file(digest))
+        except FileNotFoundError:
+            pass
+
+    def _claim_file(self, digest):
+        return self.path(digest)[:-len('.png')] + '.claim'
+
+    def _claim_owner(self, claim_file):
+        """ Returns the owner of a claim, or None if the claim is stale: made by a
+        process of this host that is no longer running, or older than `stale_age` """
+        with open(claim_file) as claim:
+            owner, host, pid = (claim.read().split('\n') + ['', ''])[:3]
+        age = time.time() - os.stat(claim_file).st_mtime
+        if age > self.stale_age or (host == socket.gethostname() and not _running(pid)):
+            return None
+        return owner
+
+    def _remove_stale_claim(self, claim_file):
+        """ Removes a stale claim, unless another process claimed the image again
+        since the claim was found to be stale """
+        stale_file = '{}.{}-{}.tmp'.format(claim_file, os.getpid(), threading.get_ident())
+        os.rename(claim_file, stale_file)
+        try:
+            if self._claim_owner(stale_file) is not None:
+                try:
+                    os.link(stale_file, claim_file)
+                except FileExistsError:
+                    pass
+        finally:
+            os.remove(stale_file)
+
+    def fetch(self, digest, output_file):
+        """ Places the cached image for `digest` at `output_file`.
+        Returns False if the image is not cached. """
+        cached_file = self.path(digest)
+        try:
+            _link_or_copy(cached_file, output_file)
+        except FileNotFoundError:
+            return False
+
+        # Mark as recently used for the eviction policy
+        os.utime(cached_file)
+        return True
+
+    def store(self, digest, output_file):
+        """ Adds a rendered image to the cache and evicts old images if needed """
+        cached_file = self.path(digest)
+        if os.path.exists(cached_file):
+            os.utime(cached_file)
+            return
+
+        os.makedirs(os.path.dirname(cached_file), exist_ok=True)
+        # Link or copy under a temporary name first so that other workers
+        # never see a partially written image
+        fd, temp_file = mkstemp(dir=os.path.dirname(cached_file), suffix='.tmp')
+        os.close(fd)
+        os.remove(temp_file)
+        _link_or_copy(output_file, temp_file)
+        os.replace(temp_file, cached_file)
+
+        self.stores += 1
+        if self.size is None or self.stores % self.rescan == 0:
+            self.evict()
+        else:
+            self.size += os.path.getsize(cached_file)
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """ Removes the least recently used images if the cache exceeds `max_size`,
+        down to 90% of it so that the next stores do not evict right away, and
+        updates the size of the cache. Stale claims and temporary files are removed. """
+        entries = []
+        now = time.time()
+        for folder, _, files in os.walk(self.cache_dir):
+            for name in files:
+                file_name = os.path.join(folder, name)
+                try:
+                    if name.endswith('.claim') and self._claim_owner(file_name) is None:
+                        self._remove_stale_claim(file_name)
+                    elif (name.endswith('.tmp') and
+                          now - os.stat(file_name).st_mtime > self.stale_age):
+                        os.remove(file_name)
+                    elif name.endswith('.png'):
+                        stat = os.stat(file_name)
+                        entries.append((stat.st_mtime, stat.st_size, file_name))
+                except FileNotFoundError:
+                    # Removed by another job
+                    continue
+
+        size = sum(entry[1] for entry in entries)
+        target = self.max_size if size <= self.max_size else 0.9 * self.max_size
+        for _, file_size, cached_file in sorted(entries):
+            if size <= target:
+                break
+            try:
+                os.remove(cached_file)
+            except FileNotFoundError:
+                # Already evicted by another worker
+                pass
+            size -= file_size
+        self.size = size
+
+
+def _running(pid):
+    """ Tests if the process `pid` of this host is running """
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (ValueError, PermissionError):
+        # Not a process id, or a process of another user
+        return True
+    return True
+
+
+def _link_or_copy(source, destination):
+    """ Hard-links `source` to `destination`, copying it when both are not on
+    the same file system. An existing `destination` is replaced. """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(source, destination)
@@ -19,6 +19,14 @@ class Config(object):
 
         return self._parse_setting_value(setting_value)
 
+    def get(self, key, default=None):
+        """ Returns the setting `key` or `default` if it is not listed in
+        the configuration file (i.e. for optional settings) """
+        value = getattr(self, key)
+        if value == []:
+            return default
+        return value
+
     def _parse_setting_value(self, setting_value):
         if self._is_boolean(setting_value):
             return True
@@ -0,0 +1,304 @@
+"""
+Distributes the frames of an animation over multiple render hosts.
+
+A coordinator hands out ranges of frames to workers connecting over TCP.
+Each worker loads the scene script (i.e. `movie.py sequence.fasta`) itself,
+renders its frames (using its own pool of `Workers` processes) and sends the
+PNG images back. Workers send heartbeats while rendering; the frames of a
+worker that disconnects or stops sending heartbeats are handed out again.
+
+Start a coordinator and any number of workers (on the same or other hosts)
+from the project folder:
+
+    python -m pypovray.farm coordinator movie.py sequence.fasta
+    python -m pypovray.farm worker --address render-host:5000
+
+The messages are pickled, so the connections are authenticated with
+FarmAuthKey: a secret shared by the farm hosts, without a default.
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from functools import partial
+from math import ceil
+from multiprocessing.connection import Client, Listener
+from tempfile import mkdtemp
+from distutils import util
+from pypovray import SETTINGS, logger, pypovray
+from pypovray.scheduler import FrameScheduler
+
+
+def _checked_authkey(authkey):
+    """ Returns the authentication key, refusing to connect without one: the
+    pickled messages would let anyone reaching the port run code """
+    if not authkey:
+        raise ValueError('FarmAuthKey must be set to a secret shared by the farm hosts')
+    return authkey
+
+
+def _parse_address(address):
+    """ Converts 'host:port' into a (host, port) tuple """
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+class Coordinator(object):
+    """ Hands out ranges of `range_size` frames of the scene `script` (called with the
+    arguments `argv`) to the workers and writes the returned images to the
+    SETTINGS.OutputImageDir folder. The job fails once a frame was handed out to
+    `max_failures` workers that failed or disconnected before rendering it. """
+
+    def __init__(self, script, argv, address, authkey, range_size=5, heartbeat_timeout=30,
+                 max_failures=3):
+        self.script = script
+        self.argv = argv
+        self.address = address
+        self.authkey = _checked_authkey(authkey)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_failures = int(max_failures)
+
+        nframes = ceil(eval(SETTINGS.NumberFrames))
+        self.frames = set(range(nframes))
+        self.pending = deque(list(range(start, min(start + int(range_size), nframes)))
+                             for start in range(0, nframes, int(range_size)))
+        self.done = set()
+        self.assigned = {}
+        self.workers = set()
+        self.failures = Counter()
+        self.error = None
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def run(self):
+        """ Accepts workers until all frames are rendered, or a frame failed
+        `max_failures` times (raises RuntimeError) """
+        listener = Listener(self.address, authkey=self.authkey)
+        logger.info('["%s"] - waiting for workers on %s:%d to render %d frames',
+                    sys._getframe().f_code.co_name, self.address[0], self.address[1],
+                    len(self.frames))
+        accepter = threading.Thread(target=self._accept, args=(listener,), daemon=True)
+        accepter.start()
+        self.finished.wait()
+        listener.close()
+
+        # Give the connected workers the chance to ask for work and be told to stop
+        deadline = time.time() + self.heartbeat_timeout
+        while self.workers and time.time() < deadline:
+            time.sleep(0.1)
+        if self.error:
+            raise RuntimeError(self.error)
+
+    def _accept(self, listener):
+        while not self.finished.is_set():
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError):
+                # Listener closed, or a client failed to authenticate
+                if self.finished.is_set():
+                    return
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        """ Handles the messages of a single worker """
+        name = None
+        try:
+            _, name = conn.recv()
+            with self.lock:
+                self.workers.add(name)
+            logger.info('["%s"] - worker "%s" connected', sys._getframe().f_code.co_name, name)
+            conn.send(('job', self.script, self.argv, pypovray._render_settings()))
+            while True:
+                if not conn.poll(self.heartbeat_timeout):
+                    logger.warning('["%s"] - no heartbeat from worker "%s"',
+                                   sys._getframe().f_code.co_name, name)
+                    break
+                message = conn.recv()
+                if message[0] == 'ready':
+                    reply = self._next_range(name)
+                    conn.send(reply)
+                    if reply[0] == 'stop':
+                        break
+                elif message[0] == 'frame':
+                    self._store_frame(name, message[1], message[2])
+                elif message[0] == 'error':
+                    logger.error('["%s"] - worker "%s" failed:\n%s',
+                                 sys._getframe().f_code.co_name, name, message[1])
+                    break
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+            self._release(name)
+
+    def _next_range(self, name):
+        """ Returns the next message for a worker asking for work """
+        with self.lock:
+            if self.finished.is_set():
+                return ('stop',)
+            if not self.pending:
+                # Frames of other workers might still be handed out again
+                return ('wait', 1)
+            frames = self.pending.popleft()
+            self.assigned.setdefault(name, set()).update(frames)
+            return ('frames', frames)
+
+    def _store_frame(self, name, frame_id, image):
+        """ Writes a rendered frame image and tests if the animation is complete """
+        with self.lock:
+            self.assigned.get(name, set()).discard(frame_id)
+            if frame_id in self.done:
+                return
+            # Written under a temporary name first, an interrupted coordinator
+            # never leaves a partial image behind
+            frame_file = pypovray._create_frame_file_name(frame_id)
+            os.replace(pypovray._write_part(frame_file, partial(_write_image, image)),
+                       frame_file)
+            self.done.add(frame_id)
+            if self.done == self.frames:
+                self.finished.set()
+
+    def _release(self, name):
+        """ Hands out the unfinished frames of a disconnected worker again, or stops
+        the job if one of them was handed out `max_failures` times """
+        with self.lock:
+            self.workers.discard(name)
+            frames = sorted(self.assigned.pop(name, set()) - self.done)
+            if frames and not self.finished.is_set():
+                self.failures.update(frames)
+                failed = [frame_id for frame_id in frames
+                          if self.failures[frame_id] >= self.max_failures]
+                if failed:
+                    self.error = 'Rendering frames {} failed on {} workers'.format(
+                        failed, self.max_failures)
+                    self.finished.set()
+                else:
+                    self.pending.appendleft(frames)
+        logger.info('["%s"] - worker "%s" disconnected (%d frames reassigned)',
+                    sys._getframe().f_code.co_name, name, len(frames))
+
+
+class Worker(object):
+    """ Connects to a coordinator, renders the frames it hands out and sends
+    the images back, sending a heartbeat every `heartbeat_interval` seconds """
+
+    def __init__(self, address, authkey, heartbeat_interval=5, name=None):
+        self.address = address
+        self.authkey = _checked_authkey(authkey)
+        self.heartbeat_interval = heartbeat_interval
+        self.name = name or '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.send_lock = threading.Lock()
+
+    def run(self):
+        """ Renders frames until the coordinator has no work left """
+        conn = Client(self.address, authkey=self.authkey)
+        self._send(conn, ('hello', self.name))
+        _, script, argv, settings = conn.recv()
+        scene = pypovray.load_scene(script, argv)
+        render = partial(pypovray._retry_render, partial(_render_frame_image, scene, settings))
+
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(conn, stop), daemon=True).start()
+        try:
+            while True:
+                self._send(conn, ('ready',))
+                message = conn.recv()
+                if message[0] == 'stop':
+                    break
+                if message[0] == 'wait':
+                    time.sleep(message[1])
+                    continue
+
+                send = lambda frame_id, image: self._send(conn, ('frame', frame_id, image))
+                if util.strtobool(SETTINGS.UsePool):
+                    workers = pypovray._render_plan(len(message[1]), scene)
+                    FrameScheduler(render, workers=workers,
+                                   backend=SETTINGS.get('PoolBackend', 'process'),
+                                   speculate=pypovray._speculate()).run(
+                                       message[1], callback=send)
+                else:
+                    pypovray._render_plan(len(message[1]), scene, pool=False)
+                    for frame_id in message[1]:
+                        send(frame_id, render(frame_id))
+        except (EOFError, OSError):
+            logger.warning('["%s"] - lost connection to the coordinator',
+                           sys._getframe().f_code.co_name)
+        except Exception:
+            # Let the coordinator hand out the frames again before failing
+            self._send(conn, ('error', traceback.format_exc()))
+            raise
+        finally:
+            stop.set()
+            conn.close()
+
+    def _send(self, conn, message):
+        with self.send_lock:
+            conn.send(message)
+
+    def _heartbeat(self, conn, stop):
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                self._send(conn, ('heartbeat',))
+            except OSError:
+                return
+
+
+def _render_frame_image(scene, settings, frame_id):
+    """ Renders a frame using the coordinator's render settings and returns the PNG image """
+    folder = mkdtemp()
+    frame_file = os.path.join(folder, 'frame.png')
+    try:
+        pypovray._frame_scene(scene, frame_id).render(frame_file,
+                                                      tempfile=os.path.join(folder, 'frame.pov'),
+                                                      **settings)
+        with open(frame_file, 'rb') as image:
+            return image.read()
+    finally:
+        shutil.rmtree(folder)
+
+
+def _write_image(image, file_name):
+    with open(file_name, 'wb') as frame_file:
+        frame_file.write(image)
+
+
+def main(args):
+    """ Starts a coordinator or a worker """
+    parser = argparse.ArgumentParser(description='Render an animation on multiple hosts')
+    parser.add_argument('role', choices=['coordinator', 'worker'])
+    parser.add_argument('script', nargs='?', help='scene script (coordinator only)')
+    parser.add_argument('script_args', nargs=argparse.REMAINDER,
+                        help='arguments for the scene script')
+    parser.add_argument('--address', default=SETTINGS.get('FarmAddress', 'localhost:5000'),
+                        help='host:port of the coordinator')
+    options = parser.parse_args(args[1:])
+
+    address = _parse_address(options.address)
+    if SETTINGS.get('FarmAuthKey') is None:
+        parser.error('FarmAuthKey is not set; set it to a secret shared by the farm hosts')
+    authkey = str(SETTINGS.FarmAuthKey).encode('utf-8')
+    if options.role == 'coordinator':
+        if not options.script:
+            parser.error('the coordinator requires a scene script')
+        Coordinator(options.script, options.script_args, address, authkey,
+                    range_size=SETTINGS.get('FarmRangeSize', 5),
+                    heartbeat_timeout=SETTINGS.get('FarmHeartbeatTimeout', 30),
+                    max_failures=SETTINGS.get('FarmMaxFailures', 3)).run()
+        # Combine the frames into a movie
+        pypovray._run_ffmpeg()
+    else:
+        Worker(address, authkey,
+               heartbeat_interval=SETTINGS.get('FarmHeartbeatInterval', 5)).run()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
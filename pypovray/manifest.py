@@ -0,0 +1,89 @@
+"""
+Keeps track of the rendered frames of an animation so that an interrupted
+or changed job only renders the frames that are missing or out of date.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+
+def scene_digest(scene, settings):
+    """ Returns a hash identifying the rendered output of a scene: the serialized
+    POV-Ray scene combined with the render settings (size, quality, etc.) """
+    digest = hashlib.sha1()
+    scene.write(_DigestWriter(digest))
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class _DigestWriter(object):
+    """ File-like object passing the written scene code on to a hash """
+
+    def __init__(self, digest):
+        self.digest = digest
+
+    def write(self, code):
+        self.digest.update(code.encode('utf-8'))
+
+
+class RenderManifest(object):
+    """ A JSON file listing, for each frame, the digest of the scene it was rendered
+    from and its output image. Recorded frames are written at most every
+    `save_interval` seconds and by `flush`, as the whole manifest is rewritten. """
+
+    def __init__(self, manifest_file, settings, save_interval=5):
+        self.manifest_file = manifest_file
+        self.settings = settings
+        self.save_interval = save_interval
+        self.saved = time.time()
+        self.unsaved = False
+        self.frames = {}
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as manifest:
+                self.frames = {int(frame_id): entry
+                               for frame_id, entry in json.load(manifest)['frames'].items()}
+
+    def digests(self):
+        """ Returns a {frame_id: digest} mapping of all frames with an existing output image """
+        return {frame_id: entry['digest'] for frame_id, entry in self.frames.items()
+                if os.path.exists(entry['output'])}
+
+    def record(self, frame_id, digest, output):
+        """ Registers a rendered frame, writing the manifest to disk if it was last
+        written `save_interval` seconds ago """
+        self.frames[frame_id] = {'digest': digest, 'output': output}
+        self.unsaved = True
+        if time.time() - self.saved >= self.save_interval:
+            self.save()
+
+    def flush(self):
+        """ Writes the frames recorded since the manifest was last written """
+        if self.unsaved:
+            self.save()
+
+    def remove_frames_from(self, nframes):
+        """ Forgets (and deletes) the output of frames that are no longer part of the
+        animation, i.e. after reducing its duration. Returns the removed frame numbers. """
+        removed = sorted(frame_id for frame_id in self.frames if frame_id >= nframes)
+        for frame_id in removed:
+            output = self.frames.pop(frame_id)['output']
+            if os.path.exists(output):
+                os.remove(output)
+        if removed:
+            self.save()
+        return removed
+
+    def save(self):
+        """ Writes the manifest, replacing the previous one in a single step so
+        that an interrupted job never leaves a corrupt manifest behind """
+        temp_file = self.manifest_file + '.tmp'
+        with open(temp_file, 'w') as manifest:
+            json.dump({'settings': self.settings,
+                       'frames': {str(frame_id): entry
+                                  for frame_id, entry in sorted(self.frames.items())}},
+                      manifest, indent=1)
+        os.replace(temp_file, self.manifest_file)
+        self.saved = time.time()
+        self.unsaved = False
@@ -0,0 +1,62 @@
+"""
+Planning the number of parallel renders (workers) and the render threads of
+each POV-Ray process from the CPUs this process may run on.
+
+POV-Ray renders with one thread per CPU by default, so running a pool of
+workers next to it oversubscribes the CPUs. The CPUs are split instead:
+`workers` POV-Ray processes with `threads` threads each. Which split is
+fastest depends on the scene (parsing is single-threaded, small images do not
+keep many threads busy), so it can be measured with a short calibration run.
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pypovray import logger
+
+
+def available_cpus():
+    """ The number of CPUs this process may run on (its affinity mask, i.e.
+    when limited by taskset or a batch scheduler) """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # Not available on macOS and Windows
+        return os.cpu_count() or 1
+
+
+def plan(cpus, workers=None, threads=None, tasks=None):
+    """ Returns (workers, threads) using `cpus` CPUs; either may be given, None
+    plans it. Without both, a single-threaded POV-Ray runs for each CPU. There
+    are no more workers than `tasks`; the CPUs left over are used as threads. """
+    cpus = max(1, int(cpus))
+    if workers is None:
+        workers = cpus if threads is None else cpus // int(threads)
+    workers = max(1, int(workers) if tasks is None else min(int(workers), tasks))
+    if threads is None:
+        threads = max(1, cpus // workers)
+    return workers, max(1, int(threads))
+
+
+def calibrate(render, cpus, candidates=None):
+    """ Measures the frames per second of each thread count in `candidates`
+    (default: the powers of two up to `cpus`), running `cpus // threads`
+    renders at once, and returns the fastest thread count.
+
+    `render(threads)` renders one frame using that many POV-Ray threads. """
+    cpus = max(1, int(cpus))
+    if candidates is None:
+        candidates = [2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus]
+    best, best_rate = None, 0.0
+    for threads in candidates:
+        workers = max(1, cpus // threads)
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(render, [threads] * workers))
+        rate = workers / max(time.time() - start, 1e-9)
+        logger.debug('["%s"] - %d workers x %d threads: %.2f frames/s',
+                     sys._getframe().f_code.co_name, workers, threads, rate)
+        if rate > best_rate:
+            best, best_rate = threads, rate
+    return best
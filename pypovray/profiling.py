@@ -0,0 +1,96 @@
+"""
+Collects the time spent in each phase of rendering an animation, per frame
+and per worker, and reports it as JSON/CSV with summary statistics.
+
+Frame phases are 'scene' (calling the scene function), 'digest' (hashing the
+scene for the manifest/render cache), 'serialize' (writing a Scene as POV-Ray
+code to the .pov file), 'write' (writing POV-Ray code given as a string to the
+.pov file) and 'povray' (the POV-Ray process). Job phases,
+such as 'ffmpeg', are recorded once for the whole animation.
+"""
+
+import csv
+import json
+import time
+from contextlib import contextmanager
+import numpy as np
+
+FRAME_PHASES = ['scene', 'digest', 'serialize', 'write', 'povray']
+
+
+class RenderProfile(object):
+    """ Timings of a single render job """
+
+    def __init__(self):
+        self.start = time.time()
+        self.end = None
+        self.frames = []
+        self.phases = {}
+
+    def add_frame(self, frame_id, status, timings):
+        """ Records the phase timings (seconds) of a frame, `timings` also
+        contains the id of the 'worker' process that rendered the frame """
+        self.frames.append(dict(timings, frame=frame_id, status=status))
+
+    @contextmanager
+    def timer(self, phase):
+        """ Measures a job phase, use as `with profile.timer('ffmpeg'): ...` """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases[phase] = self.phases.get(phase, 0.0) + time.time() - start
+
+    def finish(self):
+        self.end = time.time()
+
+    def summary(self):
+        """ Returns the total time, frames per second and per-phase statistics """
+        elapsed = (self.end or time.time()) - self.start
+        summary = {'frames': len(self.frames),
+                   'rendered': sum(1 for frame in self.frames if frame['status'] == 'rendered'),
+                   'elapsed': elapsed,
+                   'frames_per_second': len(self.frames) / elapsed if elapsed else 0.0,
+                   'job_phases': self.phases,
+                   'phases': {},
+                   'workers': {}}
+
+        for phase in FRAME_PHASES:
+            values = [frame[phase] for frame in self.frames if phase in frame]
+            if values:
+                summary['phases'][phase] = _statistics(values)
+
+        for frame in self.frames:
+            worker = summary['workers'].setdefault(str(frame.get('worker')),
+                                                   {'frames': 0, 'busy': 0.0})
+            worker['frames'] += 1
+            worker['busy'] += sum(frame.get(phase, 0.0) for phase in FRAME_PHASES)
+        return summary
+
+    def write_json(self, filename):
+        """ Writes the summary and all frame timings """
+        with open(filename, 'w') as report:
+            json.dump({'summary': self.summary(),
+                       'frames': sorted(self.frames, key=lambda frame: frame['frame'])},
+                      report, indent=1)
+
+    def write_csv(self, filename):
+        """ Writes the frame timings, one row per frame; timings of phases other
+        than FRAME_PHASES (i.e. recorded by other jobs) are added as extra columns """
+        columns = ['frame', 'worker', 'status'] + FRAME_PHASES
+        columns += sorted(set(key for frame in self.frames for key in frame) - set(columns))
+        with open(filename, 'w', newline='') as report:
+            writer = csv.DictWriter(report, columns, restval='')
+            writer.writeheader()
+            for frame in sorted(self.frames, key=lambda frame: frame['frame']):
+                writer.writerow(frame)
+
+
+def _statistics(values):
+    """ Total, mean and percentiles of a list of timings """
+    return {'total': float(np.sum(values)),
+            'mean': float(np.mean(values)),
+            'p50': float(np.percentile(values, 50)),
+            'p90': float(np.percentile(values, 90)),
+            'p99': float(np.percentile(values, 99)),
+            'max': float(np.max(values))}
@@ -3,26 +3,90 @@ This module offers functionality to render a frame or movie given a
 Vapory 'Scene' object.
 """
 
+import asyncio
 import ffmpy
+import json
+import runpy
 import shutil
 import sys
 import os
-from pathos.multiprocessing import ProcessingPool as Pool
+import threading
+import time
+from collections import Counter
+from functools import partial
+from itertools import count
 from moviepy.editor import ImageSequenceClip
-from tempfile import mkdtemp
+from tempfile import gettempdir, mkdtemp
 from glob import glob
 from pypovray import SETTINGS, logger
+from pypovray.cache import RenderCache
+from pypovray.manifest import RenderManifest, scene_digest
+from pypovray.planning import available_cpus, calibrate, plan
+from pypovray.profiling import RenderProfile
+from pypovray.scheduler import FrameScheduler
+from pypovray.stream import FrameStream, ReorderBuffer
+from pypovray.tiles import TileAssembler, split_frame, write_png
+from vapory.vapory import StaticInclude, config as vapory_config, render_povfile
+from vapory.vapory.io import POVRayError
+from vapory.vapory.bounds import bound_scene
+from vapory.vapory.optimize import optimize_scene
 from distutils import util
 from math import ceil
 
+# Hand the scenes to POV-Ray through a pipe or a scene file in SceneTempDir (or the
+# system's temporary folder); scene files have unique names, so jobs can run in threads
+vapory_config.SCENE_PIPE = util.strtobool(str(SETTINGS.get('ScenePipe', False)))
+vapory_config.TEMP_DIR = SETTINGS.get('SceneTempDir') or gettempdir()
+vapory_config.DECLARE_REPEATED = util.strtobool(str(SETTINGS.get('DeclareRepeated', False)))
+vapory_config.IMMUTABLE_ELEMENTS = util.strtobool(str(SETTINGS.get('ImmutableElements', False)))
+vapory_config.FLOAT_PRECISION = (int(SETTINGS.FloatPrecision) if SETTINGS.get('FloatPrecision')
+                                 else None)
+# POV-Ray processes running longer than RenderTimeout seconds are killed (and retried)
+vapory_config.RENDER_TIMEOUT = SETTINGS.get('RenderTimeout') or None
+
+# Numbers the part files of each process (see `_part_file_name`)
+_PART_NUMBERS = count()
+# The render caches by their folder and size (see `_load_render_cache`)
+_RENDER_CACHES = {}
+# Scenes are constructed one at a time by the threads of the thread backend, so
+# scene functions do not have to be thread-safe (see `_frame_scene`)
+_SCENE_LOCK = threading.Lock()
+
+
 def render_scene_to_png(scene, frame_id=0):
     """ Renders a single frame given the `scene` function object and  a
-    frame number which is passed to the `scene` function """
-    folder = _create_tmp_folder()
-    _render_frame(scene(frame_id), frame_id)
+    frame number which is passed to the `scene` function. The frame is split
+    into tiles rendered in parallel if TileRows or TileColumns is set. """
+    regions = _tile_regions()
+    if len(regions) > 1:
+        _render_tiled_frames(scene, [frame_id], regions,
+                             lambda frame_id, frame: write_png(_create_frame_file_name(frame_id),
+                                                                frame))
+        return
+
+    _render_frame(_frame_scene(scene, frame_id), frame_id)
 
-    if SETTINGS.LogLevel != "DEBUG":
-        shutil.rmtree(folder)
+
+def render_scene_to_arrays(scene, on_frame):
+    """ Renders all frames of the animation in memory, without writing PNG files,
+    and calls `on_frame(frame_id, frame)` in frame order for each frame where
+    `frame` is a numpy array of shape (ImageHeight, ImageWidth, 3) """
+    frames = ReorderBuffer(lambda frame: on_frame(frames.next_frame, frame))
+    _render_scene(scene, on_frame=frames.add, in_memory=True)
+
+
+def load_scene(script, argv=(), function='frame'):
+    """ Runs a scene script (i.e. 'movie.py') with the given command line arguments,
+    without running its main block, and returns its scene function """
+    saved_argv, saved_path = sys.argv, sys.path[:]
+    sys.argv = [script] + list(argv)
+    # Allow the script to import modules from its own folder
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    try:
+        return runpy.run_path(script, run_name='__pypovray_script__')[function]
+    finally:
+        sys.argv = saved_argv
+        sys.path[:] = saved_path
 
 
 def render_scene_to_gif(scene):
@@ -42,14 +106,17 @@ def render_scene_to_gif(scene):
 
 
     # Render the scenes (creates PNG images in the SETTINGS.OutputImageDir folder)
-    _render_scene(scene)
+    profile = RenderProfile()
+    _render_scene(scene, profile=profile)
 
     # Get a list of all rendered images (these are ordered by default)
     image_files = glob('{}/{}_*.png'.format(SETTINGS.OutputImageDir, SETTINGS.OutputPrefix))
     # Combine images into GIF file using moviepy
-    ImageSequenceClip(sorted(image_files),
-                      fps=SETTINGS.RenderFPS).write_gif('{}/{}.gif'.format(SETTINGS.OutputMovieDir,
-                                                                           SETTINGS.OutputPrefix))
+    with profile.timer('gif'):
+        ImageSequenceClip(sorted(image_files),
+                          fps=SETTINGS.RenderFPS).write_gif('{}/{}.gif'.format(SETTINGS.OutputMovieDir,
+                                                                               SETTINGS.OutputPrefix))
+    _report_profile(profile)
 
 
 def render_scene_to_mp4(scene):
@@ -65,34 +132,600 @@ def render_scene_to_mp4(scene):
                      sys._getframe().f_code.co_name)
         return
 
-    # Render the scenes (creates PNG images in the SETTINGS.OutputImageDir folder)
-    _render_scene(scene)
+    profile = RenderProfile()
+    if util.strtobool(str(SETTINGS.get('StreamEncode', False))):
+        # Encode the frames while rendering
+        _stream_scene_to_mp4(scene, profile)
+    else:
+        # Render the scenes (creates PNG images in the SETTINGS.OutputImageDir folder)
+        digests = _render_scene(scene, profile=profile)
+
+        # Combine the frames into a movie
+        with profile.timer('ffmpeg'):
+            _run_ffmpeg(digests)
+    _report_profile(profile)
+
+
+def render_scene_draft(scene):
+    """ First pass of a two-pass animation: renders all frames at the draft settings
+    (see the [DRAFT] section) into a '<OutputPrefix>_draft.mp4' preview movie. The
+    POV-Ray code of every frame is stored so that `render_scene_final` does not need
+    to construct the scenes again. """
+    nframes = ceil(eval(SETTINGS.NumberFrames))
+    scene_dir = _job_file_name('scenes')
+    draft_dir = _job_file_name('draft')
+    for folder in (scene_dir, draft_dir):
+        os.makedirs(folder, exist_ok=True)
+        _remove_folder_contents(folder, match=SETTINGS.OutputPrefix)
+
+    try:
+        _run_tasks(partial(_render_job_draft, scene, scene_dir, draft_dir), range(nframes),
+                   callback=_place_files, scene=scene)
+    finally:
+        _remove_part_files(scene_dir, draft_dir)
+
+    draft_movie = _movie_file_name('mp4', 'draft')
+    if os.path.exists(draft_movie):
+        os.remove(draft_movie)
+    _run_ffmpeg(image_dir=draft_dir, movie_file=draft_movie)
+
+
+def render_scene_final(frames=None):
+    """ Second pass of a two-pass animation: renders the frames stored by
+    `render_scene_draft` at the final settings. `frames` selects the (approved)
+    frames to render, i.e. '0-40,100-120' (default: all frames). The movie is
+    created once every frame has a final image. """
+    scene_dir = _job_file_name('scenes')
+    # Part files (starting with a dot) left by an interrupted draft pass are not frames
+    nframes = len([name for name in os.listdir(scene_dir)
+                   if name.startswith(SETTINGS.OutputPrefix + '_') and name.endswith('.pov')])
+    frame_ids = parse_frame_ranges(frames, nframes) if frames else range(nframes)
+
+    try:
+        _run_tasks(partial(_render_job_final, scene_dir), frame_ids, callback=_place_files)
+    finally:
+        _remove_part_files(SETTINGS.OutputImageDir)
+
+    missing = [frame_id for frame_id in range(nframes)
+               if not os.path.exists(_create_frame_file_name(frame_id))]
+    if missing:
+        logger.info('["%s"] - not creating the movie, %d frames are not rendered yet',
+                    sys._getframe().f_code.co_name, len(missing))
+    elif not _check_output_file_exists("mp4"):
+        _run_ffmpeg()
 
-    # Combine the frames into a movie
-    _run_ffmpeg()
 
+def static_include(name, objects, identifier=None):
+    """ Writes objects that are the same in every frame once, to an include file
+    in the '<OutputPrefix>_static' folder. Pass the result in the `included` list
+    of each frame's Scene; see `vapory.StaticInclude` (also for `identifier`). """
+    folder = _job_file_name('static')
+    os.makedirs(folder, exist_ok=True)
+    return StaticInclude(name, objects, folder, identifier)
 
-def _render_scene(scene):
-    """ Renders the scene to multiple output PNG files for use in animations """
+
+async def render_scene_async(scene, on_frame=None, frame_ids=None):
+    """ Renders the frames (default: all) of the animation to PNG images from an
+    asyncio event loop, running at most Workers POV-Ray processes at once (see
+    `_render_plan`), and
+    calls the optional `on_frame(frame_id, frame_file)` as each frame finishes.
+    The render_scene_to_* functions render this way if AsyncRender is set. """
+    if frame_ids is None:
+        frame_ids = range(ceil(eval(SETTINGS.NumberFrames)))
+
+    def frame_done(frame_id, result):
+        if on_frame:
+            on_frame(frame_id, result[1])
+
+    job_done, waiting_frames = _frame_placer(frame_done)
+    try:
+        await _run_tasks_async(partial(_render_job_frame_async, scene, None, None), frame_ids,
+                               callback=job_done, scene=scene)
+        for frame_id in waiting_frames():
+            job_done(frame_id, await _retry_render_async(
+                partial(_render_job_frame_async, scene, None, None, claim=False), frame_id))
+    finally:
+        _remove_part_files(SETTINGS.OutputImageDir)
+
+
+def parse_frame_ranges(frames, nframes):
+    """ Converts a frame selection such as '0-40,100-120,150' (inclusive ranges)
+    into a sorted list of the selected frame numbers below `nframes` """
+    selected = set()
+    for part in str(frames).split(','):
+        start, _, end = part.strip().partition('-')
+        selected.update(range(int(start), int(end or start) + 1))
+    return sorted(frame_id for frame_id in selected if 0 <= frame_id < nframes)
+
+
+def _stream_scene_to_mp4(scene, profile):
+    """ Renders the scene and pipes each finished frame, in order, into a single
+    ffmpeg process. Unless KeepImages (or Resume) is set, the rendered images are
+    written to a temporary folder and removed once they are encoded. With
+    InMemoryFrames the workers return raw frames and no images are written at all. """
+    in_memory = util.strtobool(str(SETTINGS.get('InMemoryFrames', False)))
+    keep_images = not in_memory and (_resume_enabled() or
+                                      util.strtobool(str(SETTINGS.get('KeepImages', True))))
+    image_dir = None if keep_images or in_memory else mkdtemp()
+
+    if in_memory:
+        input_options = '-f rawvideo -pix_fmt rgb24 -s {}x{} -framerate {}'.format(
+            int(SETTINGS.ImageWidth), int(SETTINGS.ImageHeight), SETTINGS.RenderFPS)
+    else:
+        input_options = '-f image2pipe -framerate {}'.format(SETTINGS.RenderFPS)
+    stream = FrameStream(_movie_file_name('mp4'), input_options, _mp4_output_options())
+    logger.info('["%s"] - ffmpeg command: "%s"', sys._getframe().f_code.co_name, stream.ff.cmd)
+
+    def encode(frame_id, frame_file):
+        with profile.timer('ffmpeg'):
+            if keep_images or in_memory:
+                stream.add(frame_id, frame_file)
+            else:
+                with open(frame_file, 'rb') as image:
+                    stream.add(frame_id, image.read())
+                os.remove(frame_file)
+
+    try:
+        _render_scene(scene, on_frame=encode, image_dir=image_dir, in_memory=in_memory,
+                      profile=profile)
+    except BaseException:
+        stream.abort()
+        raise
+    finally:
+        if image_dir:
+            shutil.rmtree(image_dir)
+    with profile.timer('ffmpeg'):
+        stream.close()
+
+
+def _render_scene(scene, on_frame=None, image_dir=None, in_memory=False, profile=None,
+                  frame_ids=None):
+    """ Renders the scene to multiple output PNG files for use in animations.
+    Returns the scene digest of each frame if these were calculated (i.e. when
+    resuming or using the render cache).
+
+    The optional `on_frame(frame_id, frame_file)` is called for each finished frame
+    and `image_dir` replaces the SETTINGS.OutputImageDir folder (without resuming).
+    With `in_memory` no images are written and `on_frame` receives numpy arrays.
+    The timings of each frame are added to the `profile`, if given, and `frame_ids`
+    selects the frames to render (default: all). """
 
     # Clear 'images' folder containing previously rendered frames
     #_remove_folder_contents(SETTINGS.OutputImageDir)
 
     # Calculate the time per frame (i.e. evaluate expression from config file)
     nframes = ceil(eval(SETTINGS.NumberFrames))
+    frame_ids = range(nframes) if frame_ids is None else list(frame_ids)
 
-    # Render each scene using a thread pool or single-threaded
-    if util.strtobool(SETTINGS.UsePool):
-        scene_flist = [scene] * nframes
-        id_list = range(nframes)
+    # When resuming, frames listed in the manifest with an unchanged scene are skipped
+    manifest = None
+    if in_memory:
+        render = partial(_render_job_array, scene)
+        render_async = partial(_render_job_array_async, scene)
+    else:
+        manifest = _load_manifest() if _resume_enabled() and not image_dir else None
+        render = partial(_render_job_frame, scene, manifest.digests() if manifest else None,
+                         image_dir)
+        render_async = partial(_render_job_frame_async, scene,
+                               manifest.digests() if manifest else None, image_dir)
+    render = partial(_retry_render, render)
+    rendered = set()
+    statuses = Counter()
+    digests = {}
 
-        # Render each scene, using a thread pool
-        with Pool(int(SETTINGS.workers)) as p:
-            p.map(render_scene_to_png, scene_flist, id_list)
+    def frame_done(frame_id, result):
+        digest, frame_file, status, timings = result
+        if profile and timings:
+            profile.add_frame(frame_id, status, timings)
+        statuses[status] += 1
+        if status == 'rendered':
+            rendered.add(frame_id)
+        if digest:
+            digests[frame_id] = digest
+        if manifest:
+            manifest.record(frame_id, digest, frame_file)
+        if on_frame:
+            on_frame(frame_id, frame_file)
 
+    if in_memory:
+        job_done, waiting_frames = frame_done, lambda: []
     else:
-        for frame_id in range(nframes):
-            render_scene_to_png(scene, frame_id)
+        job_done, waiting_frames = _frame_placer(frame_done, image_dir)
+
+    # Render each scene using a pool of workers or single-threaded
+    regions = _tile_regions()
+    try:
+        if len(regions) > 1:
+            # Tiled frames are always rendered (the manifest and render cache are not used)
+            manifest = None
+
+            def tiled_frame_done(frame_id, frame):
+                if in_memory:
+                    frame_done(frame_id, (None, frame, 'rendered', None))
+                else:
+                    frame_file = _create_frame_file_name(frame_id, image_dir)
+                    write_png(frame_file, frame)
+                    frame_done(frame_id, (None, frame_file, 'rendered', None))
+
+            _render_tiled_frames(scene, frame_ids, regions, tiled_frame_done)
+
+        elif util.strtobool(str(SETTINGS.get('AsyncRender', False))):
+            # A single event loop runs up to Workers POV-Ray processes at once
+            asyncio.run(_run_tasks_async(render_async, frame_ids, callback=job_done,
+                                         scene=scene))
+
+        elif util.strtobool(SETTINGS.UsePool):
+            # Workers pull chunks of frames from a shared queue, optionally
+            # ordered by the frame render times of a previous run
+            costs = _load_frame_costs()
+            scheduler = FrameScheduler(render,
+                                       workers=_render_plan(len(frame_ids), scene),
+                                       chunk_size=SETTINGS.get('ChunkSize', 1),
+                                       longest_first=util.strtobool(str(SETTINGS.get('LongestFirst', False))),
+                                       costs=costs, backend=SETTINGS.get('PoolBackend', 'process'),
+                                       speculate=_speculate())
+            timings = scheduler.run(frame_ids, callback=job_done)
+            costs.update({frame_id: timings[frame_id] for frame_id in rendered})
+            _save_frame_costs(costs)
+
+        else:
+            _render_plan(len(frame_ids), scene, pool=False)
+            for frame_id in frame_ids:
+                job_done(frame_id, render(frame_id))
+
+        waiting = waiting_frames()
+        if waiting:
+            # The identical frames these waited for were not rendered by this job
+            render = partial(_retry_render, partial(
+                _render_job_frame, scene, manifest.digests() if manifest else None, image_dir,
+                claim=False))
+            for frame_id in waiting:
+                job_done(frame_id, render(frame_id))
+    finally:
+        # Left by the copies of a frame that did not finish first, or by failed jobs
+        if not in_memory:
+            _remove_part_files(image_dir or SETTINGS.OutputImageDir)
+        # Also when interrupted, so that the finished frames are not rendered again
+        if manifest:
+            manifest.flush()
+
+    removed = []
+    if manifest:
+        # Remove frames left over from a previous, longer, animation
+        removed = manifest.remove_frames_from(nframes)
+    logger.info('["%s"] - rendered %d of %d frames (%d up to date, %d from cache, %d removed)',
+                sys._getframe().f_code.co_name, statuses['rendered'], len(frame_ids),
+                statuses['current'], statuses['cached'], len(removed))
+
+    return digests
+
+
+def _run_tasks(render, tasks, callback=None, scene=None):
+    """ Runs `render(task)` for each task, using the pool of workers if UsePool
+    is set, and calls the optional `callback(task, result)` for each result.
+    The `scene` function is used for calibrating the render threads. """
+    tasks = list(tasks)
+    render = partial(_retry_render, render)
+    if util.strtobool(SETTINGS.UsePool):
+        FrameScheduler(render, workers=_render_plan(len(tasks), scene),
+                       backend=SETTINGS.get('PoolBackend', 'process'),
+                       speculate=_speculate()).run(tasks, callback=callback)
+        return
+
+    _render_plan(len(tasks), scene, pool=False)
+    for task in tasks:
+        result = render(task)
+        if callback:
+            callback(task, result)
+
+
+async def _run_tasks_async(render, tasks, callback=None, concurrency=None, scene=None):
+    """ Runs the coroutines `render(task)` for the tasks, at most `concurrency`
+    (default: the planned Workers) at a time, and calls the optional
+    `callback(task, result)` for each result as it finishes. After a task fails
+    no more tasks are started; the first error is raised once the running
+    tasks finished, as cancelling these could leave POV-Ray processes behind. """
+    tasks = list(tasks)
+    semaphore = asyncio.Semaphore(int(concurrency or _render_plan(len(tasks), scene)))
+    errors = []
+
+    async def run(task):
+        # The frame's scene is only constructed once a POV-Ray process may start
+        async with semaphore:
+            if errors:
+                return
+            try:
+                result = await _retry_render_async(render, task)
+                if callback:
+                    callback(task, result)
+            except Exception as error:
+                errors.append(error)
+
+    await asyncio.gather(*[run(task) for task in tasks])
+    if errors:
+        raise errors[0]
+
+
+def _render_tiled_frames(scene, frame_ids, regions, on_frame):
+    """ Renders the frames split into `regions` and calls `on_frame(frame_id, frame)`
+    with each stitched frame. The scene of each frame is constructed and written
+    to a .pov file once, then each region is a separate task for the workers. """
+    folder = mkdtemp(dir=vapory_config.TEMP_DIR)
+    scene_files = {}
+    try:
+        _run_tasks(partial(_write_job_scene, scene, folder), frame_ids,
+                   callback=scene_files.__setitem__, scene=scene)
+        tasks = [(frame_id, tile_id) for frame_id in frame_ids for tile_id in range(len(regions))]
+        assembler = TileAssembler(SETTINGS.ImageWidth, SETTINGS.ImageHeight, regions, on_frame)
+        _run_tasks(partial(_render_job_tile, scene_files, regions), tasks,
+                   callback=assembler.add, scene=scene)
+    finally:
+        if _remove_temp():
+            shutil.rmtree(folder)
+
+
+def _frame_scene(scene, frame_id):
+    """ Calls the `scene` function for a frame and, if set, optimizes the CSG
+    operations (OptimizeCSG), bounds the CSG intersections and differences
+    (BoundCSG) and removes the objects outside the view (CullObjects) """
+    with _SCENE_LOCK:
+        frame_scene = scene(frame_id)
+        report = {}
+        if util.strtobool(str(SETTINGS.get('OptimizeCSG', False))):
+            frame_scene, report = optimize_scene(frame_scene)
+        bound = util.strtobool(str(SETTINGS.get('BoundCSG', False)))
+        cull = util.strtobool(str(SETTINGS.get('CullObjects', False)))
+        if bound or cull:
+            frame_scene, bounds_report = bound_scene(
+                frame_scene, aspect_ratio=1.0 * SETTINGS.ImageWidth / SETTINGS.ImageHeight,
+                bound=bound, cull=cull, margin=SETTINGS.get('CullMargin', 0))
+            report.update(bounds_report)
+    if report:
+        logger.debug('["%s"] - frame %d: %s', sys._getframe().f_code.co_name, frame_id,
+                     ', '.join('{} {}'.format(count, change)
+                               for change, count in sorted(report.items())))
+    return frame_scene
+
+
+def _write_job_scene(scene, folder, frame_id):
+    """ Writes the scene of a frame to a .pov file in `folder`, returns the file """
+    scene_file = _create_frame_file_name(frame_id, folder, extension='pov')
+    with open(scene_file, 'w') as pov_file:
+        _frame_scene(scene, frame_id).write(pov_file)
+    return scene_file
+
+
+def _render_job_tile(scene_files, regions, task):
+    """ Renders a single region (tile) of a frame to a numpy array given a
+    (frame_id, tile index) task, from the frame's .pov file in `scene_files` """
+    frame_id, tile_id = task
+    tile = render_povfile(scene_files[frame_id], None, region=regions[tile_id],
+                          remove_temp=False, **_render_settings())
+
+    return _to_uint8(tile)
+
+
+def _render_job_frame(scene, digests, image_dir, frame_id, claim=True):
+    """ Renders a frame of an animation, unless `digests` (from the manifest) shows
+    that the existing output image was rendered from the very same scene or the
+    image is available in the render cache. Returns the scene digest, the output file
+    (a part file to be moved into place by `_place_frame` if the image was rendered or
+    fetched from the cache), the frame status ('current', 'cached', 'rendered' or
+    'waiting', see `_prepare_frame`) and the phase timings. """
+    frame_scene, result = _prepare_frame(scene, digests, image_dir, frame_id, claim)
+    digest, frame_file, status, timings = result
+    if status != 'rendered':
+        return result
+
+    try:
+        part_file = _write_part(frame_file, partial(frame_scene.render,
+                                                    remove_temp=_remove_temp(),
+                                                    timings=timings, **_render_settings()))
+    except BaseException:
+        _release_frame(digest)
+        raise
+    return digest, part_file, status, timings
+
+
+async def _render_job_frame_async(scene, digests, image_dir, frame_id, claim=True):
+    """ Coroutine version of `_render_job_frame` """
+    frame_scene, result = _prepare_frame(scene, digests, image_dir, frame_id, claim)
+    digest, frame_file, status, timings = result
+    if status != 'rendered':
+        return result
+
+    part_file = _part_file_name(frame_file)
+    try:
+        await frame_scene.render_async(part_file, remove_temp=_remove_temp(), timings=timings,
+                                       **_render_settings())
+    except BaseException:
+        _release_frame(digest)
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        raise
+    return digest, part_file, status, timings
+
+
+def _prepare_frame(scene, digests, image_dir, frame_id, claim=True):
+    """ Constructs the scene of a frame and tests if it has to be rendered. Returns
+    the scene and the result of the job, with the status 'rendered' if the frame
+    still has to be rendered (see `_render_job_frame`).
+
+    With the render cache, the frame to render is claimed; when an identical frame
+    is being rendered already the status is 'waiting' (without an image), for the
+    parent to fetch the image once that frame is done (see `_frame_placer`). """
+    timings = {'worker': _worker_id()}
+    start = time.time()
+    frame_scene = _frame_scene(scene, frame_id)
+    timings['scene'] = time.time() - start
+
+    frame_file = _create_frame_file_name(frame_id, image_dir)
+    cache = _load_render_cache()
+    digest = None
+    if digests is not None or cache:
+        start = time.time()
+        digest = scene_digest(frame_scene, _render_settings())
+        timings['digest'] = time.time() - start
+    if digests is not None and digests.get(frame_id) == digest:
+        return frame_scene, (digest, frame_file, 'current', timings)
+    if cache:
+        part_file = _part_file_name(frame_file)
+        if cache.fetch(digest, part_file):
+            return frame_scene, (digest, part_file, 'cached', timings)
+        if claim and cache.claim(digest, frame_id) != str(frame_id):
+            # Unless the identical frame was stored since the cache was checked
+            if cache.fetch(digest, part_file):
+                return frame_scene, (digest, part_file, 'cached', timings)
+            return frame_scene, (digest, frame_file, 'waiting', timings)
+
+    return frame_scene, (digest, frame_file, 'rendered', timings)
+
+
+def _release_frame(digest):
+    """ Releases the claim on rendering a frame (see `_prepare_frame`) """
+    cache = _load_render_cache()
+    if cache and digest:
+        cache.release(digest)
+
+
+def _place_frame(frame_id, result, image_dir=None):
+    """ Moves the image of a frame job (see `_render_job_frame`) into place and adds
+    a rendered image to the render cache; returns the result with the frame file.
+    Called in the parent process for the first finished copy of a frame only. """
+    digest, part_file, status, timings = result
+    if status not in ('rendered', 'cached'):
+        return result
+    frame_file = _create_frame_file_name(frame_id, image_dir)
+    # An existing image (hard-linked to a cached image) is replaced, not changed
+    os.replace(part_file, frame_file)
+    cache = _load_render_cache()
+    if cache and status == 'rendered':
+        cache.store(digest, frame_file)
+        cache.release(digest)
+    return digest, frame_file, status, timings
+
+
+def _frame_placer(frame_done, image_dir=None):
+    """ Returns `job_done(frame_id, result)`, which places the image of a frame job
+    (see `_place_frame`) and calls `frame_done(frame_id, result)`, and a function
+    returning (and forgetting) the frames still waiting for an identical frame (see
+    `_prepare_frame`) that this job did not render; these are rendered again
+    without claiming, which fetches the image if it was stored in the meantime.
+
+    The image of a waiting frame is fetched from the render cache as soon as the
+    identical frame is placed. Only the first finished copy of a frame is placed. """
+    waiting = {}
+
+    def job_done(frame_id, result):
+        result = _place_frame(frame_id, result, image_dir)
+        digest, frame_file, status, timings = result
+        if status == 'waiting':
+            waiting.setdefault(digest, []).append((frame_id, frame_file, timings))
+            return
+        frame_done(frame_id, result)
+        if status != 'rendered' or digest not in waiting:
+            return
+
+        cache = _load_render_cache()
+        left = []
+        for waiting_id, waiting_file, waiting_timings in waiting.pop(digest):
+            part_file = _part_file_name(waiting_file)
+            if cache.fetch(digest, part_file):
+                job_done(waiting_id, (digest, part_file, 'cached', waiting_timings))
+            else:
+                # Evicted right away (a very small cache)
+                left.append((waiting_id, waiting_file, waiting_timings))
+        if left:
+            waiting[digest] = left
+
+    def waiting_frames():
+        frame_ids = sorted(frame_id for frames in waiting.values() for frame_id, _, _ in frames)
+        waiting.clear()
+        return frame_ids
+
+    return job_done, waiting_frames
+
+
+def _place_files(task, moves):
+    """ Moves the files written by a job, `moves` being (part file, output file)
+    pairs, into place; called in the parent process once per task """
+    for part_file, output_file in moves:
+        os.replace(part_file, output_file)
+
+
+def _render_job_array(scene, frame_id):
+    """ Renders a frame of an animation to an RGB numpy array (8 bits per channel)
+    instead of a PNG file. Returns the same tuple as `_render_job_frame`. """
+    timings = {'worker': _worker_id()}
+    start = time.time()
+    frame_scene = _frame_scene(scene, frame_id)
+    timings['scene'] = time.time() - start
+
+    frame = frame_scene.render(None, remove_temp=_remove_temp(), timings=timings,
+                               **_render_settings())
+
+    return None, _to_uint8(frame), 'rendered', timings
+
+
+async def _render_job_array_async(scene, frame_id):
+    """ Coroutine version of `_render_job_array` """
+    timings = {'worker': _worker_id()}
+    start = time.time()
+    frame_scene = _frame_scene(scene, frame_id)
+    timings['scene'] = time.time() - start
+
+    frame = await frame_scene.render_async(None, remove_temp=_remove_temp(), timings=timings,
+                                           **_render_settings())
+    return None, _to_uint8(frame), 'rendered', timings
+
+
+def _render_job_draft(scene, scene_dir, draft_dir, frame_id):
+    """ Constructs the scene of a frame, stores its POV-Ray code for the final
+    pass and renders it at the draft settings """
+    frame_scene = _frame_scene(scene, frame_id)
+    # The stored scene uses the aspect ratio of the final image
+    frame_scene.camera = frame_scene.camera.add_args(
+        ['right', [1.0 * SETTINGS.ImageWidth / SETTINGS.ImageHeight, 0, 0]])
+    scene_file = _create_frame_file_name(frame_id, scene_dir, extension='pov')
+
+    def write(file_name):
+        with open(file_name, 'w') as pov_file:
+            frame_scene.write(pov_file)
+    scene_part = _write_part(scene_file, write)
+
+    scale = SETTINGS.get('DraftScale', 0.25)
+    draft_file = _create_frame_file_name(frame_id, draft_dir)
+    try:
+        draft_part = _write_part(draft_file,
+                                 partial(render_povfile, scene_part,
+                                         height=max(1, int(SETTINGS.ImageHeight * scale)),
+                                         width=max(1, int(SETTINGS.ImageWidth * scale)),
+                                         quality=SETTINGS.get('DraftQuality', 3),
+                                         remove_temp=False))
+    except BaseException:
+        os.remove(scene_part)
+        raise
+    return [(scene_part, scene_file), (draft_part, draft_file)]
+
+
+def _render_job_final(scene_dir, frame_id):
+    """ Renders the POV-Ray code stored by the draft pass at the final settings """
+    settings = _render_settings()
+    frame_file = _create_frame_file_name(frame_id)
+    return [(_write_part(frame_file,
+                         partial(render_povfile,
+                                 _create_frame_file_name(frame_id, scene_dir, extension='pov'),
+                                 height=settings['height'], width=settings['width'],
+                                 quality=settings['quality'],
+                                 antialiasing=settings['antialiasing'], remove_temp=False)),
+             frame_file)]
+
+
+def _to_uint8(frame):
+    """ Converts a rendered image with 16 bits per channel to 8 bits per channel """
+    if frame.dtype != 'uint8':
+        frame = (frame >> 8).astype('uint8')
+    return frame
 
 
 def _remove_folder_contents(folder, match=None):
@@ -110,37 +743,274 @@ def _remove_folder_contents(folder, match=None):
             print(e)
 
 
-def _render_frame(scene, frame_id):
+def _render_frame(scene, frame_id, frame_file=None, timings=None):
     """ Renders a single frame """
-    frame_file = _create_frame_file_name(frame_id)
-    scene.render(frame_file,
-                 width=SETTINGS.ImageWidth,
-                 height=SETTINGS.ImageHeight,
-                 antialiasing=SETTINGS.AntiAlias,
-                 quality=SETTINGS.Quality, remove_temp=False)
+    frame_file = frame_file or _create_frame_file_name(frame_id)
+    os.replace(_write_part(frame_file, partial(scene.render, remove_temp=_remove_temp(),
+                                               timings=timings, **_render_settings())),
+               frame_file)
+
+
+def _remove_part_files(*folders):
+    """ Removes the part files of the jobs (see `_write_part`) left in the folders """
+    for folder in folders:
+        for part_file in glob('{}/.{}_*'.format(folder, SETTINGS.OutputPrefix)):
+            try:
+                os.remove(part_file)
+            except FileNotFoundError:
+                pass
+
+
+def _write_part(output_file, write):
+    """ Calls `write(file_name)` with a new temporary name next to `output_file` and
+    returns that name (see `_part_file_name`). Jobs write their output files this way
+    and the parent process moves them into place, once per task, so that output files
+    are never partially written, i.e. by a render that timed out, and never written
+    twice, i.e. by two copies of a speculatively rendered frame. """
+    part_file = _part_file_name(output_file)
+    try:
+        write(part_file)
+    except BaseException:
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        raise
+    return part_file
+
+
+def _part_file_name(output_file):
+    """ A new hidden file name next to `output_file`, unique for each attempt of the
+    processes and threads writing it; the extension is kept for POV-Ray """
+    folder, name = os.path.split(output_file)
+    root, extension = os.path.splitext(name)
+    return os.path.join(folder, '.{}.{}-{}-{}{}'.format(root, os.getpid(), threading.get_ident(),
+                                                        next(_PART_NUMBERS), extension))
+
+
+def _retry_render(render, task):
+    """ Calls `render(task)`, again up to RenderRetries times if POV-Ray fails
+    (crashes, exits with an error or is killed after RenderTimeout seconds);
+    other errors (in the scene functions, cancelled renders) are not retried """
+    retries = int(SETTINGS.get('RenderRetries', 0))
+    for attempt in range(retries + 1):
+        try:
+            return render(task)
+        except (POVRayError, TimeoutError) as error:
+            if attempt == retries:
+                raise
+            logger.warning('["%s"] - rendering %s failed (%s), retry %d of %d',
+                           sys._getframe().f_code.co_name, task, error, attempt + 1, retries)
+
+
+async def _retry_render_async(render, task):
+    """ Coroutine version of `_retry_render` """
+    retries = int(SETTINGS.get('RenderRetries', 0))
+    for attempt in range(retries + 1):
+        try:
+            return await render(task)
+        except (POVRayError, TimeoutError) as error:
+            if attempt == retries:
+                raise
+            logger.warning('["%s"] - rendering %s failed (%s), retry %d of %d',
+                           sys._getframe().f_code.co_name, task, error, attempt + 1, retries)
+
+
+def _speculate():
+    """ Idle workers render copies of the straggling frames at the end of a job """
+    return util.strtobool(str(SETTINGS.get('Speculate', False)))
+
+
+def _report_profile(profile):
+    """ Logs the rendering throughput and, if Profile is set, writes the frame
+    timings to '<OutputPrefix>_profile.json' and '<OutputPrefix>_profile.csv' """
+    profile.finish()
+    summary = profile.summary()
+    logger.info('["%s"] - %d frames in %.2fs (%.2f frames/s)', sys._getframe().f_code.co_name,
+                summary['frames'], summary['elapsed'], summary['frames_per_second'])
+    for phase, stats in summary['phases'].items():
+        logger.info('["%s"] - %s: total %.2fs, p50 %.3fs, p90 %.3fs, p99 %.3fs',
+                    sys._getframe().f_code.co_name, phase, stats['total'],
+                    stats['p50'], stats['p90'], stats['p99'])
+    for phase, total in summary['job_phases'].items():
+        logger.info('["%s"] - %s: total %.2fs', sys._getframe().f_code.co_name, phase, total)
+
+    if util.strtobool(str(SETTINGS.get('Profile', False))):
+        profile.write_json(_job_file_name('profile.json'))
+        profile.write_csv(_job_file_name('profile.csv'))
+
+
+def _remove_temp():
+    """ Scene files (in SceneTempDir or the system's temporary folder) are kept
+    for debugging (LogLevel DEBUG) """
+    return SETTINGS.LogLevel != "DEBUG"
 
 
-def _create_tmp_folder():
-    tmp_folder = mkdtemp()
-    os.chdir(tmp_folder)
-    logger.debug('["%s"] - tmp_folder: %s', sys._getframe().f_code.co_name, tmp_folder)
-    return tmp_folder
+def _render_settings():
+    """ Returns the settings influencing the rendered output of a frame
+    (as keyword arguments for `Scene.render`) """
+    return {'width': SETTINGS.ImageWidth, 'height': SETTINGS.ImageHeight,
+            'quality': SETTINGS.Quality, 'antialiasing': SETTINGS.get('AntiAlias')}
 
 
-def _create_frame_file_name(frame):
-    output_file = '{}/{}_{}.png'.format(SETTINGS.OutputImageDir,
-                                        SETTINGS.OutputPrefix, str(round(frame, 2)).zfill(3))
+def _render_plan(tasks=None, scene=None, pool=True):
+    """ Plans the POV-Ray processes rendering at once (returned) and the render
+    threads of each (set as vapory's RENDER_THREADS) from the available CPUs.
+
+    Workers and RenderThreads may be 'auto'; an empty RenderThreads leaves the
+    threads to POV-Ray and 'calibrate' measures the fastest split on frame 0 of
+    the `scene` function once (stored in '<OutputPrefix>_threads.json'). Without
+    a pool (`pool` False) a single POV-Ray process uses all CPUs. """
+    cpus = available_cpus()
+    workers = _planned_setting(SETTINGS.Workers) if pool else 1
+    threads = SETTINGS.get('RenderThreads')
+    if threads is None:
+        workers, _ = plan(cpus, workers, tasks=tasks)
+        vapory_config.RENDER_THREADS = None
+    else:
+        if threads == 'calibrate':
+            threads = _calibrated_threads(cpus, scene) if pool else None
+        else:
+            threads = _planned_setting(threads)
+        workers, vapory_config.RENDER_THREADS = plan(cpus, workers, threads, tasks)
+    logger.info('["%s"] - %d CPUs: %d POV-Ray processes, %s render threads each',
+                sys._getframe().f_code.co_name, cpus, workers,
+                vapory_config.RENDER_THREADS or 'default')
+    return workers
+
+
+def _planned_setting(value):
+    """ A Workers or RenderThreads setting as number, None if it is 'auto' """
+    if value is None or str(value).lower() == 'auto':
+        return None
+    return int(value)
+
+
+def _calibrated_threads(cpus, scene):
+    """ The fastest render threads per POV-Ray process for frame 0 of the
+    `scene` function, measured once for the CPUs and render settings """
+    threads_file = _job_file_name('threads.json')
+    if os.path.exists(threads_file):
+        with open(threads_file) as calibration:
+            calibration = json.load(calibration)
+        if calibration['cpus'] == cpus and calibration['settings'] == _calibration_settings():
+            return calibration['threads']
+    if scene is None:
+        logger.warning('["%s"] - no scene to calibrate the render threads with',
+                       sys._getframe().f_code.co_name)
+        return None
+
+    folder = mkdtemp(dir=vapory_config.TEMP_DIR)
+    frame_scene = _frame_scene(scene, 0)
+    renders = count()
+
+    def render(threads):
+        frame_file = os.path.join(folder, 'calibrate_{}.png'.format(next(renders)))
+        frame_scene.render(frame_file, tempfile=frame_file[:-3] + 'pov', threads=threads,
+                           **_calibration_settings())
+        os.remove(frame_file)
+
+    try:
+        threads = calibrate(render, cpus)
+    finally:
+        shutil.rmtree(folder)
+    logger.info('["%s"] - calibrated %d render threads per POV-Ray process',
+                sys._getframe().f_code.co_name, threads)
+    with open(threads_file, 'w') as calibration:
+        json.dump({'cpus': cpus, 'settings': _calibration_settings(), 'threads': threads},
+                  calibration)
+    return threads
+
+
+def _calibration_settings():
+    """ The render settings of the calibration renders: the final quality at an
+    image size scaled by CalibrationScale, as every thread count renders a frame
+    on each CPU """
+    settings = _render_settings()
+    scale = SETTINGS.get('CalibrationScale', 0.25)
+    settings.update(width=max(1, int(settings['width'] * scale)),
+                    height=max(1, int(settings['height'] * scale)))
+    return settings
+
+
+def _tile_regions():
+    """ Returns the regions a frame is split into (a single region when not tiling) """
+    return split_frame(SETTINGS.ImageWidth, SETTINGS.ImageHeight,
+                       SETTINGS.get('TileRows', 1), SETTINGS.get('TileColumns', 1))
+
+
+def _worker_id():
+    """ The id of the process running a job, with the thread for the thread backend """
+    thread = threading.current_thread()
+    if thread is threading.main_thread():
+        return os.getpid()
+    return '{}/{}'.format(os.getpid(), thread.name)
+
+
+def _job_file_name(name):
+    """ Returns the path of a job file (i.e. frame costs) stored next to the
+    OutputImageDir folder so that it survives cleaning the images """
+    return '{}/{}_{}'.format(os.path.dirname(os.path.abspath(SETTINGS.OutputImageDir)),
+                             SETTINGS.OutputPrefix, name)
+
+
+def _load_frame_costs():
+    """ Reads the frame render times (seconds) recorded by a previous run """
+    costs_file = _job_file_name('costs.json')
+    if not os.path.exists(costs_file):
+        return {}
+    with open(costs_file) as costs:
+        return {int(frame_id): cost for frame_id, cost in json.load(costs).items()}
+
+
+def _save_frame_costs(costs):
+    """ Stores the frame render times, used for longest-first ordering of the next run """
+    with open(_job_file_name('costs.json'), 'w') as costs_file:
+        json.dump({str(frame_id): cost for frame_id, cost in costs.items()}, costs_file)
+
+
+def _resume_enabled():
+    """ Resuming renders only missing or changed frames, without asking to overwrite """
+    return util.strtobool(str(SETTINGS.get('Resume', False)))
+
+
+def _load_manifest():
+    """ Loads the manifest of previously rendered frames for this job """
+    return RenderManifest(_job_file_name('manifest.json'), _render_settings())
+
+
+def _load_render_cache():
+    """ Returns the render cache shared between jobs, or None if it is disabled. The
+    same object is returned for the same settings, as it keeps track of the size. """
+    if not util.strtobool(str(SETTINGS.get('RenderCache', False))):
+        return None
+    key = (SETTINGS.get('RenderCacheDir', '~/.cache/pypovray'),
+           SETTINGS.get('RenderCacheSize', 2048) * 1024 ** 2)
+    if key not in _RENDER_CACHES:
+        _RENDER_CACHES[key] = RenderCache(*key)
+    return _RENDER_CACHES[key]
+
+
+def _create_frame_file_name(frame, image_dir=None, extension='png'):
+    output_file = '{}/{}_{}.{}'.format(image_dir or SETTINGS.OutputImageDir,
+                                       SETTINGS.OutputPrefix, str(round(frame, 2)).zfill(3),
+                                       extension)
     logger.debug('["%s"] - output file: %s', sys._getframe().f_code.co_name, output_file)
     return output_file
 
 
+def _movie_file_name(extension, suffix=None):
+    prefix = SETTINGS.OutputPrefix + ('_' + suffix if suffix else '')
+    return '{}/{}.{}'.format(SETTINGS.OutputMovieDir, prefix, extension)
+
+
 def _check_output_file_exists(extension):
     """ Informs about existing output file before creating a new one
     and offers to overwrite the existing file. """
-    output_file = '{}/{}.{}'.format(SETTINGS.OutputMovieDir,
-                                    SETTINGS.OutputPrefix, extension)
+    output_file = _movie_file_name(extension)
     remove_file = "n"
-    if os.path.exists(output_file):
+    if os.path.exists(output_file) and _resume_enabled():
+        # The movie is recreated from the (partly re-rendered) frames
+        remove_file = "y"
+    elif os.path.exists(output_file):
         remove_file = str(input("The file '%s' already exists, do you want to overwrite? (y/n): " % output_file))
     if remove_file.lower() == "y":
         os.remove(output_file)
@@ -151,6 +1021,10 @@ def _check_output_file_exists(extension):
 def _check_rendered_images():
     """ Informs about existing output image files before rendering
     and offers to overwrite the existing file. """
+    if _resume_enabled():
+        # Existing frames are checked against the manifest instead
+        return False
+
     remove_files = "n"
     if os.listdir(SETTINGS.OutputImageDir):
         if any(SETTINGS.OutputPrefix in fname for fname in os.listdir(SETTINGS.OutputImageDir)):
@@ -162,19 +1036,51 @@ def _check_rendered_images():
     return any(SETTINGS.OutputPrefix in fname for fname in os.listdir(SETTINGS.OutputImageDir))
 
 
-def _run_ffmpeg():
+def _run_ffmpeg(digests=None, image_dir=None, movie_file=None):
     """ Builds the ffmpeg command to render an MP4 movie file using the
-    h.x264 codex and yuv420p format """
-    ff = ffmpy.FFmpeg(
+    h.x264 codex and yuv420p format. Given the frame `digests`, runs of identical
+    frames can be encoded as a single longer frame (see CollapseDuplicates).
+    The frames are read from `image_dir` into `movie_file` if given. """
+    if digests and util.strtobool(str(SETTINGS.get('CollapseDuplicates', False))):
+        # Input is a list of the distinct frames and their durations
+        inputs = {_write_concat_list(digests): '-f concat -safe 0'}
+    else:
         # Input is a pattern for all image files ordered by number (padded)
-        inputs={'': '-framerate {} -pattern_type glob -i {}/{}_*.png'.format(
+        inputs = {'': '-framerate {} -pattern_type glob -i {}/{}_*.png'.format(
             SETTINGS.RenderFPS,
-            SETTINGS.OutputImageDir,
-            SETTINGS.OutputPrefix)},
-        outputs={'{}/{}.mp4'.format(SETTINGS.OutputMovieDir,
-                                    SETTINGS.OutputPrefix):
-                     '-c:v libx264 -r {} -crf 2 -pix_fmt yuv420p -loglevel warning'.format(SETTINGS.MovieFPS)}
+            image_dir or SETTINGS.OutputImageDir,
+            SETTINGS.OutputPrefix)}
+    ff = ffmpy.FFmpeg(
+        inputs=inputs,
+        outputs={movie_file or _movie_file_name('mp4'): _mp4_output_options()}
     )
     # Run ffmpeg and create output movie file
     logger.info('["%s"] - ffmpeg command: "%s"', sys._getframe().f_code.co_name, ff.cmd)
     ff.run()
+
+
+def _mp4_output_options():
+    """ ffmpeg output options for an h.264 encoded, yuv420p, MP4 movie """
+    return '-c:v libx264 -r {} -crf 2 -pix_fmt yuv420p -loglevel warning'.format(SETTINGS.MovieFPS)
+
+
+def _write_concat_list(digests):
+    """ Writes an ffmpeg 'concat' input file listing each run of identical
+    frames (equal digests) once, with the duration of the whole run """
+    runs = []
+    for frame_id in sorted(digests):
+        if runs and digests[runs[-1][0]] == digests[frame_id]:
+            runs[-1][1] += 1
+        else:
+            runs.append([frame_id, 1])
+
+    concat_file = _job_file_name('frames.txt')
+    with open(concat_file, 'w') as concat:
+        for frame_id, length in runs:
+            concat.write("file '{}'\nduration {}\n".format(_create_frame_file_name(frame_id),
+                                                           length / SETTINGS.RenderFPS))
+        # The duration of the last entry is only used when the file is repeated
+        concat.write("file '{}'\n".format(_create_frame_file_name(runs[-1][0])))
+    logger.info('["%s"] - encoding %d distinct frames out of %d',
+                sys._getframe().f_code.co_name, len(runs), len(digests))
+    return concat_file
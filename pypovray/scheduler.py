@@ -0,0 +1,341 @@
+"""
+Dynamic work-queue scheduler distributing the frames of an animation over
+a number of worker processes (or threads).
+
+Instead of splitting all frames into fixed chunks up front, idle workers
+request the next chunk of frames from a shared queue kept by the parent.
+Workers that happen to get cheap frames simply come back for more, which
+keeps all workers busy when frame costs vary a lot.
+
+Near the end of a run, workers without frames left can render a copy of the
+frames of the slowest (straggling) worker; whichever copy finishes first is used.
+"""
+
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from functools import partial
+from statistics import median
+from pathos.helpers import mp
+from pypovray import logger
+from vapory.vapory.io import cancel_renders
+
+
+class FrameScheduler(object):
+    """ Renders a list of tasks (usually frame numbers) by calling `render(task)`
+    in `workers` processes pulling chunks of `chunk_size` tasks from a shared queue.
+
+    Known task costs (seconds, i.e. from a previous run) can be given in `costs`
+    and are used to order the tasks longest-first if `longest_first` is set.
+
+    With the 'thread' `backend` the workers are threads of this process instead,
+    so neither `render` nor its results are pickled. This suits renders that are
+    mostly spent waiting on POV-Ray.
+
+    With `speculate`, idle workers render a copy of the unfinished tasks of a
+    chunk running longer than the median task, once no tasks are left to hand
+    out; the first result of a task is used. `render` must then be safe to run
+    twice at once for the same task (i.e. write its output atomically). """
+
+    def __init__(self, render, workers, chunk_size=1, longest_first=False, costs=None,
+                 backend='process', speculate=False):
+        if backend not in ('process', 'thread'):
+            raise ValueError("Unknown backend '{}', use 'process' or 'thread'".format(backend))
+        self.render = render
+        self.backend = backend
+        self.workers = max(1, int(workers))
+        self.chunk_size = max(1, int(chunk_size))
+        self.longest_first = longest_first
+        self.costs = costs or {}
+        self.speculate = speculate
+        # Filled in by run()
+        self.timings = {}
+        self.speculated = 0
+        self.utilisation = {}
+        self.makespan = 0.0
+
+    def order(self, tasks):
+        """ Returns the tasks in the order they are handed out. When ordering
+        longest-first, tasks without a known cost are assumed to take the
+        average time of the known tasks. """
+        tasks = list(tasks)
+        known = [self.costs[task] for task in tasks if task in self.costs]
+        if not self.longest_first or not known:
+            return tasks
+
+        average = sum(known) / len(known)
+        return sorted(tasks, key=lambda task: -self.costs.get(task, average))
+
+    def chunks(self, tasks):
+        """ Splits the ordered tasks into chunks of at most `chunk_size` tasks """
+        tasks = self.order(tasks)
+        return deque(tasks[i:i + self.chunk_size]
+                     for i in range(0, len(tasks), self.chunk_size))
+
+    def run(self, tasks, callback=None):
+        """ Renders all tasks and returns the per-task render times. The optional
+        `callback(task, result)` is called in the parent process for each finished task
+        with the value returned by `render`. """
+        pending = self.chunks(tasks)
+        remaining = sum(len(chunk) for chunk in pending)
+        nworkers = min(self.workers, len(pending)) or 1
+
+        self.timings = {}
+        self.speculated = 0
+        busy = {}
+        done = {}
+        # The tasks left of the chunk of each worker, with the start of the current task
+        current = {}
+        copies = Counter()
+        idle = deque()
+
+        if self.backend == 'thread':
+            Queue = queue.Queue
+            Worker = partial(threading.Thread, daemon=True)
+            outbox = Queue()
+        else:
+            Queue, Worker = mp.Queue, mp.Process
+        inboxes, processes = [], []
+        # Each worker process reports back through a pipe of its own: a worker that
+        # dies while sending can leave a shared queue locked or corrupted
+        outboxes = {}
+        # Workers that died without reporting back (or ended after an error), and
+        # the tasks they were rendering
+        lost = set()
+        crashes = Counter()
+        # Tasks that failed in a worker while a copy was being rendered; these
+        # are not copied again
+        failed = set()
+
+        def start_worker():
+            worker_id = len(processes)
+            inboxes.append(Queue())
+            if self.backend == 'thread':
+                send = outbox.put
+            else:
+                outboxes[worker_id], writer = mp.Pipe(duplex=False)
+                send = writer.send
+            processes.append(Worker(target=_work, args=(self.render, worker_id,
+                                                        inboxes[worker_id], send,
+                                                        self.backend == 'process'),
+                                    name='worker-{}'.format(worker_id)))
+            busy.setdefault(worker_id, 0.0)
+            done.setdefault(worker_id, 0)
+            processes[worker_id].start()
+            if self.backend == 'process':
+                # The worker holds the only sending end, so its pipe ends when it dies
+                writer.close()
+
+        def receive():
+            """ Returns the messages of the workers, waiting up to a second """
+            if self.backend == 'thread':
+                try:
+                    return [outbox.get(timeout=1)]
+                except queue.Empty:
+                    return []
+            messages = []
+            ready = mp.connection.wait(list(outboxes.values()), timeout=1)
+            for worker_id, reader in list(outboxes.items()):
+                if reader not in ready:
+                    continue
+                try:
+                    messages.append(reader.recv())
+                except EOFError:
+                    # The worker ended, it is handled by its exit code
+                    del outboxes[worker_id]
+                    reader.close()
+            return messages
+
+        def hand_out(worker_id, chunk):
+            inboxes[worker_id].put(chunk)
+            current[worker_id] = (deque(chunk), time.time())
+            copies.update(chunk)
+
+        def take_back(worker_id):
+            """ Returns the tasks left of a stopped worker's chunk, the first being
+            the task it was rendering """
+            left, _ = current.pop(worker_id, (deque(), None))
+            for task in left:
+                copies[task] -= 1
+            return list(left)
+
+        def requeue(tasks):
+            tasks = [task for task in tasks if task not in self.timings and not copies[task]]
+            if tasks:
+                pending.appendleft(tasks)
+
+        start = time.time()
+        for _ in range(nworkers):
+            start_worker()
+
+        try:
+            while remaining:
+                # Idle workers wait for a straggler to copy; the workers are
+                # checked every second
+                for kind, worker_id, task, payload in receive():
+                    if kind in ('ready', 'error') and worker_id in lost:
+                        # Sent by a worker before it died
+                        continue
+                    if kind == 'ready':
+                        current.pop(worker_id, None)
+                        # Hand out the next chunk, or tell the worker to stop
+                        if pending:
+                            hand_out(worker_id, pending.popleft())
+                        elif self.speculate:
+                            idle.append(worker_id)
+                        else:
+                            inboxes[worker_id].put(None)
+                    elif kind == 'error':
+                        # The worker stopped; its other tasks are handed out again
+                        # and the task fails unless a copy is still being rendered
+                        left = take_back(worker_id)
+                        if task not in self.timings and not copies[task]:
+                            raise RuntimeError('Rendering task {} failed in worker {}:\n{}'.format(
+                                task, worker_id, payload))
+                        failed.add(task)
+                        requeue(left[1:])
+                        # A new worker takes the place of the stopped one
+                        lost.add(worker_id)
+                        start_worker()
+                    elif kind == 'done':
+                        elapsed, result = payload
+                        busy[worker_id] += elapsed
+                        done[worker_id] += 1
+                        if worker_id not in lost:
+                            current[worker_id][0].popleft()
+                            current[worker_id] = (current[worker_id][0], time.time())
+                            copies[task] -= 1
+                        # Unless the other copy finished first
+                        if task not in self.timings:
+                            self.timings[task] = elapsed
+                            remaining -= 1
+                            if callback:
+                                callback(task, result)
+
+                # A worker process that was killed (i.e. by a segfault or the OOM
+                # killer) never reports back; its tasks are handed out again to a
+                # new worker, unless the task killed a worker before
+                for worker_id, process in enumerate(processes):
+                    if worker_id in lost or not getattr(process, 'exitcode', None):
+                        continue
+                    lost.add(worker_id)
+                    if worker_id in idle:
+                        idle.remove(worker_id)
+                    left = take_back(worker_id)
+                    logger.warning('["%s"] - worker %d died (exit code %d) rendering %s',
+                                   sys._getframe().f_code.co_name, worker_id,
+                                   process.exitcode, left[0] if left else 'nothing')
+                    if left and left[0] not in self.timings:
+                        crashes[left[0]] += 1
+                        if crashes[left[0]] > 1 and not copies[left[0]]:
+                            raise RuntimeError('Rendering task {} killed two workers'.format(
+                                left[0]))
+                    elif not left:
+                        # Between tasks, i.e. while starting
+                        crashes[None] += 1
+                        if crashes[None] > 1:
+                            raise RuntimeError('Two workers died without rendering a task')
+                    requeue(left)
+                    self._stop(process)
+                    start_worker()
+
+                while idle and pending:
+                    hand_out(idle.popleft(), pending.popleft())
+                while idle and remaining:
+                    straggler = self._straggler(current, copies, failed)
+                    if not straggler:
+                        break
+                    self.speculated += len(straggler)
+                    hand_out(idle.popleft(), straggler)
+        finally:
+            for inbox in inboxes:
+                inbox.put(None)
+            # Workers still rendering (the copies of a task that finished first,
+            # or after an error) are stopped right away, with their POV-Ray
+            for worker_id, process in enumerate(processes):
+                if current.get(worker_id, ((),))[0]:
+                    self._stop(process)
+            for process in processes:
+                process.join(1)
+                if process.is_alive():
+                    self._stop(process)
+            for reader in outboxes.values():
+                reader.close()
+
+        self.makespan = time.time() - start
+        self._report(busy, done)
+        return self.timings
+
+    def _stop(self, process):
+        """ Stops a worker and the POV-Ray process it runs: a worker process is
+        killed with its process group, the render of a worker thread is cancelled
+        (the thread ends after its current task) """
+        if self.backend == 'thread':
+            cancel_renders([process])
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            # The worker and its POV-Ray process already ended (or the worker
+            # did not start its process group yet)
+            pass
+        if process.is_alive():
+            process.kill()
+        process.join(1)
+
+    def _straggler(self, current, copies, failed=()):
+        """ Returns the unfinished tasks (without a copy, and not `failed` before)
+        of the chunk whose current task has been running the longest, if longer
+        than the median task """
+        if not self.timings:
+            return None
+        now = time.time()
+        typical = median(self.timings.values())
+        stragglers = [(start, [task for task in tasks
+                               if task not in self.timings and copies[task] < 2 and
+                               task not in failed])
+                      for tasks, start in current.values() if now - start > typical]
+        stragglers = [(start, tasks) for start, tasks in stragglers if tasks]
+        if not stragglers:
+            return None
+        return min(stragglers, key=lambda straggler: straggler[0])[1]
+
+    def _report(self, busy, done):
+        """ Logs the makespan and per-worker utilisation (busy time / makespan) """
+        self.utilisation = {worker_id: busy[worker_id] / self.makespan if self.makespan else 0.0
+                            for worker_id in busy}
+        logger.info('["%s"] - rendered %d tasks in %.2fs using %d %s workers (chunk size %d%s%s)',
+                    sys._getframe().f_code.co_name, len(self.timings), self.makespan,
+                    len(busy), self.backend, self.chunk_size,
+                    ', longest first' if self.longest_first else '',
+                    ', {} speculative copies'.format(self.speculated) if self.speculated else '')
+        for worker_id in sorted(busy):
+            logger.info('["%s"] - worker %d: %d tasks, busy %.2fs (%.0f%%)',
+                        sys._getframe().f_code.co_name, worker_id, done[worker_id],
+                        busy[worker_id], 100 * self.utilisation[worker_id])
+
+
+def _work(render, worker_id, inbox, send, process_group=False):
+    """ Worker loop; asks for a chunk of tasks, renders them and reports back
+    with `send(message)`. A worker process leads a `process_group` with its
+    POV-Ray processes, so that these are stopped together. """
+    if process_group:
+        os.setpgrp()
+    while True:
+        send(('ready', worker_id, None, None))
+        chunk = inbox.get()
+        if chunk is None:
+            return
+        for task in chunk:
+            start = time.time()
+            try:
+                result = render(task)
+            except Exception:
+                send(('error', worker_id, task, traceback.format_exc()))
+                return
+            send(('done', worker_id, task, (time.time() - start, result)))
@@ -0,0 +1,65 @@
+"""
+Encodes frames while they are being rendered by piping them into a single,
+long-lived, ffmpeg process.
+"""
+
+import shlex
+import subprocess
+from tempfile import TemporaryFile
+import ffmpy
+
+
+class ReorderBuffer(object):
+    """ Passes frames that finish rendering in any order to `write(frame)` in frame
+    order; frames that arrive early are kept until all frames before them are written. """
+
+    def __init__(self, write, first_frame=0):
+        self.write = write
+        self.next_frame = first_frame
+        self.buffer = {}
+
+    def add(self, frame_id, frame):
+        """ Adds a frame and writes all frames that are next in line """
+        self.buffer[frame_id] = frame
+        while self.next_frame in self.buffer:
+            self.write(self.buffer.pop(self.next_frame))
+            self.next_frame += 1
+
+
+class FrameStream(ReorderBuffer):
+    """ Writes frames to the stdin of an ffmpeg process in frame order. Frames are
+    encoded images (bytes), names of image files or raw (numpy) pixel arrays. """
+
+    def __init__(self, output_file, input_options, output_options, first_frame=0):
+        super(FrameStream, self).__init__(self._write, first_frame)
+        self.ff = ffmpy.FFmpeg(inputs={'-': input_options},
+                               outputs={output_file: output_options})
+        # ffmpeg messages go to a file; a full stderr pipe would block the encoder
+        self.log = TemporaryFile()
+        self.process = subprocess.Popen(shlex.split(self.ff.cmd), stdin=subprocess.PIPE,
+                                        stderr=self.log)
+
+    def _write(self, frame):
+        if isinstance(frame, str):
+            with open(frame, 'rb') as image:
+                frame = image.read()
+        self.process.stdin.write(frame)
+
+    def close(self):
+        """ Finishes encoding the movie; all frames must have been added """
+        if self.buffer:
+            self.abort()
+            raise IOError("Missing frame {} in the ffmpeg stream".format(self.next_frame))
+
+        self.process.stdin.close()
+        if self.process.wait():
+            self.log.seek(0)
+            raise IOError("ffmpeg encoding failed with the following error: " +
+                          self.log.read().decode('utf-8', 'replace'))
+        self.log.close()
+
+    def abort(self):
+        """ Stops ffmpeg without finishing the movie (i.e. when rendering failed) """
+        self.process.kill()
+        self.process.wait()
+        self.log.close()
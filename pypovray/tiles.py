@@ -0,0 +1,60 @@
+"""
+Splits a frame into regions (tiles) that are rendered in parallel using
+POV-Ray's partial render options (+SR/+ER/+SC/+EC) and stitches them back
+together into a single image.
+"""
+
+import numpy as np
+import imageio
+
+
+def split_frame(width, height, rows, columns):
+    """ Returns the regions (start_row, end_row, start_column, end_column) dividing a
+    `width` x `height` frame into `rows` x `columns` tiles. Pixels are counted from
+    1 and the end row/column is included, as used by POV-Ray. """
+    row_edges = np.linspace(0, height, int(rows) + 1).astype(int)
+    column_edges = np.linspace(0, width, int(columns) + 1).astype(int)
+    return [(row_edges[r] + 1, row_edges[r + 1], column_edges[c] + 1, column_edges[c + 1])
+            for r in range(int(rows)) for c in range(int(columns))]
+
+
+def stitch(width, height, tiles):
+    """ Combines a {region: image} dictionary of rendered tiles into a single frame.
+    Depending on the POV-Ray version a partial render is either the size of its region
+    or the size of the whole frame (with only the region rendered); both are handled. """
+    frame = None
+    for (start_row, end_row, start_column, end_column), tile in tiles.items():
+        if frame is None:
+            frame = np.zeros((int(height), int(width)) + tile.shape[2:], dtype=tile.dtype)
+        rows = slice(start_row - 1, end_row)
+        columns = slice(start_column - 1, end_column)
+        if tile.shape[:2] == frame.shape[:2]:
+            tile = tile[rows, columns]
+        frame[rows, columns] = tile
+    return frame
+
+
+def write_png(filename, frame):
+    """ Writes a stitched frame as PNG image """
+    imageio.imwrite(filename, frame, format='png')
+
+
+class TileAssembler(object):
+    """ Collects the rendered tiles of one or more frames and calls
+    `on_frame(frame_id, frame)` as soon as all tiles of a frame are rendered """
+
+    def __init__(self, width, height, regions, on_frame):
+        self.width = width
+        self.height = height
+        self.regions = regions
+        self.on_frame = on_frame
+        self.tiles = {}
+
+    def add(self, task, tile):
+        """ Adds a tile, `task` is the (frame_id, tile index) pair it was rendered for """
+        frame_id, tile_id = task
+        tiles = self.tiles.setdefault(frame_id, {})
+        tiles[self.regions[tile_id]] = tile
+        if len(tiles) == len(self.regions):
+            del self.tiles[frame_id]
+            self.on_frame(frame_id, stitch(self.width, self.height, tiles))
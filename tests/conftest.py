@@ -0,0 +1,140 @@
+"""
+pypovray reads default.ini from the current folder when it is imported, so the
+tests run from the project root (with the project root on the path).
+
+The `fake_povray` and `fake_ffmpeg` fixtures put stand-ins for POV-Ray and ffmpeg
+on the PATH; the `settings` fixture changes settings for a single test.
+"""
+
+import os
+import stat
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# Renders an image filled with a color derived from the scene, so identical scenes
+# give identical images. A scene containing 'FAIL' exits with an error. Each run
+# is logged to FAKE_POVRAY_LOG; FAKE_POVRAY_SLEEP slows every render down and the
+# first render after FAKE_POVRAY_HANG_ONCE (a file) is created hangs.
+FAKE_POVRAY = '''#!{python}
+import os, sys, time, zlib
+import imageio
+import numpy
+
+width, height, output, file_type, region = 8, 6, None, 'N', {{}}
+for arg in sys.argv[2:]:
+    if arg.startswith('+WT'):
+        continue
+    if arg[:3] in ('+SR', '+ER', '+SC', '+EC'):
+        region[arg[1:3]] = int(arg[3:])
+    elif arg.startswith('+W'):
+        width = int(arg[2:])
+    elif arg.startswith('+H'):
+        height = int(arg[2:])
+    elif arg.startswith('+O'):
+        output = arg[2:]
+    elif arg.startswith('Output_File_Type='):
+        file_type = arg.split('=')[1]
+scene = sys.stdin.read() if sys.argv[1] == '+I-' else open(sys.argv[1]).read()
+if os.environ.get('FAKE_POVRAY_LOG'):
+    with open(os.environ['FAKE_POVRAY_LOG'], 'a') as log:
+        log.write(' '.join(sys.argv[1:]) + '\\n')
+hang = os.environ.get('FAKE_POVRAY_HANG_ONCE')
+if hang and os.path.exists(hang):
+    os.remove(hang)
+    time.sleep(30)
+time.sleep(float(os.environ.get('FAKE_POVRAY_SLEEP', 0)))
+if 'FAIL' in scene:
+    sys.stderr.write('Parse Error: FAIL\\n')
+    sys.exit(1)
+
+image = numpy.full((height, width, 3), zlib.crc32(scene.encode()) % 256, dtype='uint8')
+if region:
+    image = image[region['SR'] - 1:region['ER'], region['SC'] - 1:region['EC']]
+if file_type == 'P':
+    sys.stdout.buffer.write(b'P6\\n%d %d\\n255\\n' % (image.shape[1], image.shape[0]) +
+                            image.tobytes())
+else:
+    imageio.imwrite(output, image, format='png')
+'''
+
+# Writes its input to the output file: the data read from stdin, or the names of
+# the input images
+FAKE_FFMPEG = '''#!{python}
+import glob, sys
+
+args = sys.argv[1:]
+source = args[args.index('-i') + 1]
+with open(args[-1], 'wb') as movie:
+    if source == '-':
+        movie.write(sys.stdin.buffer.read())
+    else:
+        movie.write('\\n'.join(sorted(glob.glob(source))).encode())
+'''
+
+
+def _write_program(folder, name, code):
+    program = folder / name
+    program.write_text(code.format(python=sys.executable))
+    program.chmod(program.stat().st_mode | stat.S_IXUSR)
+
+
+@pytest.fixture(scope='session')
+def fake_bin(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('bin')
+    _write_program(folder, 'povray', FAKE_POVRAY)
+    _write_program(folder, 'ffmpeg', FAKE_FFMPEG)
+    return folder
+
+
+@pytest.fixture
+def fake_povray(fake_bin, tmp_path, monkeypatch):
+    """ Puts the fake POV-Ray on the PATH; returns a function listing the command
+    lines (without the program) it ran with """
+    log = tmp_path / 'povray.log'
+    monkeypatch.setenv('PATH', '{}{}{}'.format(fake_bin, os.pathsep, os.environ['PATH']))
+    monkeypatch.setenv('FAKE_POVRAY_LOG', str(log))
+
+    def renders():
+        return log.read_text().splitlines() if log.exists() else []
+    return renders
+
+
+@pytest.fixture
+def fake_ffmpeg(fake_bin, monkeypatch):
+    monkeypatch.setenv('PATH', '{}{}{}'.format(fake_bin, os.pathsep, os.environ['PATH']))
+
+
+@pytest.fixture
+def settings(tmp_path):
+    """ Renders small animations to folders in `tmp_path`; returns a function
+    changing more settings. The settings are restored after the test. """
+    from pypovray import SETTINGS
+
+    parser = SETTINGS.config
+    changed = []
+
+    def change(**values):
+        for key, value in values.items():
+            section = next((section for section in parser.sections()
+                            if parser.has_option(section, key)), 'GENERAL')
+            changed.append((section, key, parser.get(section, key, raw=True, fallback=None)))
+            parser.set(section, key, str(value))
+
+    for folder in ('images', 'movies'):
+        (tmp_path / folder).mkdir()
+    change(OutputImageDir=tmp_path / 'images', OutputMovieDir=tmp_path / 'movies',
+           OutputPrefix='test', LogLevel='INFO', ImageWidth=8, ImageHeight=6, Quality=1,
+           Duration=1, RenderFPS=6, Workers=2, RenderThreads='', UsePool=True,
+           PoolBackend='thread', AsyncRender=False, RenderRetries=0, Resume=False,
+           RenderCache=False, RenderCacheDir=tmp_path / 'cache', TileRows=1, TileColumns=1)
+    yield change
+    for section, key, value in reversed(changed):
+        if value is None:
+            parser.remove_option(section, key)
+        else:
+            parser.set(section, key, value)
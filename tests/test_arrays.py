@@ -0,0 +1,99 @@
+""" Primitive batches and meshes stored in numpy arrays """
+
+import numpy
+import pytest
+
+from vapory.vapory import (CylinderBatch, Mesh2Arrays, Pigment, SphereBatch, Texture, arrays,
+                           config, repeated_elements)
+from vapory.vapory.arrays import PrimitiveBatch
+
+RED = Texture(Pigment('color', [1, 0, 0]))
+
+
+@pytest.fixture(autouse=True)
+def all_digits(monkeypatch):
+    monkeypatch.setattr(config, 'FLOAT_PRECISION', None)
+
+
+def test_sphere_batch():
+    batch = SphereBatch([[0, 0, 0], [1, 2, 3]], [1, 0.5], 'scale', 2)
+    assert len(batch) == 2
+    assert str(batch) == ('union {\nsphere {\n<0.0,0.0,0.0>\n1.0 \n}\n'
+                          'sphere {\n<1.0,2.0,3.0>\n0.5 \n}\nscale\n2 \n}')
+    assert batch.bounding_box() == ((-1.0, -1.0, -1.0), (1.5, 2.5, 3.5))
+
+
+def test_cylinder_batch_with_textures():
+    batch = CylinderBatch([[0, 0, 0], [1, 0, 0]], [[0, 1, 0], [1, 1, 0]], 0.5,
+                          textures=[RED, Texture(Pigment('color', [0, 0, 1]))],
+                          texture_ids=[1, 0])
+    code = str(batch)
+    assert code.count('#declare VaporyBatchTexture') == 2
+    assert ('cylinder {\n<0.0,0.0,0.0>\n<0.0,1.0,0.0>\n0.5\n'
+            'texture { VaporyBatchTexture1 } \n}') in code
+    assert batch.bounding_box() == ((-0.5, -0.5, -0.5), (1.5, 1.5, 0.5))
+
+
+def test_batches_are_formatted_in_chunks(monkeypatch):
+    centers = numpy.arange(15, dtype=float).reshape(5, 3)
+    code = str(SphereBatch(centers, 1, textures=[RED], texture_ids=0))
+    monkeypatch.setattr(arrays, 'CHUNK_SIZE', 2)
+    assert str(SphereBatch(centers, 1, textures=[RED], texture_ids=0)) == code
+    assert code.count('sphere {') == 5
+
+
+def test_empty_batch():
+    batch = SphereBatch(numpy.zeros((0, 3)), 1)
+    assert len(batch) == 0 and batch
+    assert batch.bounding_box() is None
+    assert str(batch) == 'union {\n \n}'
+
+
+def test_primitive_batch_is_abstract():
+    with pytest.raises(TypeError):
+        PrimitiveBatch()
+
+
+def test_mesh2_arrays():
+    mesh = Mesh2Arrays([[0, 0, 0], [1, 0, 0], [0, 1, 0]], [[0, 1, 2]], 'scale', 2,
+                       normals=[[0, 0, 1]] * 3, uv_vectors=[[0, 0], [1, 0], [0, 1]],
+                       textures=[RED], texture_ids=0)
+    assert str(mesh) == ('mesh2 {\nvertex_vectors {\n3,\n<0.0,0.0,0.0>,\n<1.0,0.0,0.0>,'
+                         '\n<0.0,1.0,0.0>\n}\n'
+                         'normal_vectors {\n3,\n<0.0,0.0,1.0>,\n<0.0,0.0,1.0>,'
+                         '\n<0.0,0.0,1.0>\n}\n'
+                         'uv_vectors {\n3,\n<0.0,0.0>,\n<1.0,0.0>,\n<0.0,1.0>\n}\n'
+                         'texture_list {\n1,\ntexture {\npigment {\ncolor\n<1,0,0> \n} \n}\n}\n'
+                         'face_indices {\n1,\n<0,1,2>,0\n}\nscale\n2 \n}')
+    assert mesh.transformed_name() == 'mesh2'
+    assert mesh.bounding_box() == ((0, 0, 0), (1, 1, 0))
+
+
+def test_mesh2_arrays_in_chunks(monkeypatch):
+    vertices = numpy.random.rand(7, 3)
+    faces = numpy.arange(15).reshape(5, 3) % 7
+    code = str(Mesh2Arrays(vertices, faces))
+    monkeypatch.setattr(arrays, 'CHUNK_SIZE', 2)
+    assert str(Mesh2Arrays(vertices, faces)) == code
+    assert code.count('<') == 12
+
+
+@pytest.mark.parametrize('arguments', [{'faces': [[0, 1, 3]]},
+                                       {'faces': [[-1, 0, 1]]},
+                                       {'normals': [[0, 0, 1]]},
+                                       {'uv_vectors': [[0, 0], [1, 0]]}])
+def test_invalid_mesh2_arrays(arguments):
+    arguments = dict({'vertices': numpy.eye(3), 'faces': [[0, 1, 2]]}, **arguments)
+    with pytest.raises(ValueError):
+        Mesh2Arrays(**arguments)
+
+
+def test_repeated_meshes_are_declared_once():
+    mesh = Mesh2Arrays(numpy.eye(3), [[0, 1, 2]])
+    references, declarations = repeated_elements([mesh, mesh])
+    assert len(declarations) == 1
+    assert references == {id(mesh): 'object { VaporyShared0 }'}
+    # The code of the arrays is only formatted when written, so identical
+    # meshes are not compared
+    references, declarations = repeated_elements([mesh, Mesh2Arrays(numpy.eye(3), [[0, 1, 2]])])
+    assert declarations == []
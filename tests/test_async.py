@@ -0,0 +1,53 @@
+""" Rendering from an asyncio event loop (AsyncRender, render_scene_async) """
+
+import asyncio
+import threading
+
+import pytest
+
+from pypovray import pypovray
+from vapory.vapory import Camera, LightSource, Scene, Sphere
+from vapory.vapory.io import POVRayError
+
+
+def scene(frame_id):
+    """ Frame 3 fails """
+    return Scene(Camera('location', [0, 0, -10], 'look_at', [0, 0, 0]),
+                 objects=[LightSource([2, 4, -3], 'color', [1, 1, 1]),
+                          Sphere([frame_id, 0, 0], 1, 'FAIL' if frame_id == 3 else '')])
+
+
+def run_in_thread(render, timeout=30):
+    """ Runs `render()`, failing the test (instead of hanging) if it does not finish """
+    errors = []
+
+    def run():
+        try:
+            render()
+        except Exception as error:
+            errors.append(error)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'the render did not finish'
+    if errors:
+        raise errors[0]
+
+
+def test_async_render(settings, fake_povray, tmp_path):
+    settings(AsyncRender=True, Workers=3)
+    frames = []
+    run_in_thread(lambda: asyncio.run(pypovray.render_scene_async(
+        scene, on_frame=lambda *frame: frames.append(frame), frame_ids=[0, 1, 2, 4, 5])))
+    assert sorted(frame_id for frame_id, _ in frames) == [0, 1, 2, 4, 5]
+    assert len(fake_povray()) == 5
+    assert len(list((tmp_path / 'images').iterdir())) == 5
+
+
+def test_failing_frame_fails_the_job(settings, fake_povray):
+    # The other frames are still starting and rendering when frame 3 fails
+    settings(AsyncRender=True, Workers=8, Duration=5, RenderRetries=1)
+    with pytest.raises(POVRayError, match='FAIL'):
+        run_in_thread(lambda: pypovray._render_scene(scene))
+    # Frame 3 is rendered twice, frames that did not start yet are skipped
+    assert len(fake_povray()) < 31
@@ -0,0 +1,31 @@
+""" Loading the scene scripts of the benchmark workloads """
+
+import sys
+
+from pypovray import pypovray
+
+SCRIPT = '''
+import sys
+from scene_helper import offset
+
+arguments = sys.argv[1:]
+
+
+def frame(step):
+    return step + offset
+
+
+if __name__ == '__main__':
+    raise SystemExit('the main block runs')
+'''
+
+
+def test_load_scene_restores_argv_and_path(tmp_path):
+    (tmp_path / 'scene.py').write_text(SCRIPT)
+    (tmp_path / 'scene_helper.py').write_text('offset = 10\n')
+    argv, path = sys.argv[:], sys.path[:]
+    frame = pypovray.load_scene(str(tmp_path / 'scene.py'), ['sequence.fasta'])
+    assert frame(1) == 11
+    assert frame.__globals__['arguments'] == ['sequence.fasta']
+    assert sys.argv == argv
+    assert sys.path == path
@@ -0,0 +1,33 @@
+""" Bounding CSG operations and culling the objects outside the view """
+
+from vapory.vapory import (Box, Camera, Difference, Plane, Scene, Sphere, SphereBatch, Union,
+                           bound_scene, bounding_box)
+
+CAMERA = Camera('location', [0, 0, -10], 'look_at', [0, 0, 0])
+
+
+def test_bounding_box():
+    assert bounding_box(Sphere([1, 0, 0], 1)) == ((0, -1, -1), (2, 1, 1))
+    union = Union(Box([0, 0, 0], [1, 1, 1]), Sphere([3, 0, 0], 1), 'translate', [1, 0, 0])
+    assert bounding_box(union) == ((1, -1, -1), (5, 1, 1))
+    # A difference lies within its first object
+    assert bounding_box(Difference(Box([-1, -1, -1], [1, 1, 1]), Sphere([0, 0, 0], 5))) == \
+        ((-1, -1, -1), (1, 1, 1))
+    assert bounding_box(SphereBatch([[0, 0, 0]], 1, 'scale', 2)) == ((-2, -2, -2), (2, 2, 2))
+    # Infinite objects have no bounding box
+    assert bounding_box(Plane([0, 1, 0], 0)) is None
+
+
+def test_bound_scene():
+    difference = Difference(Box([-1, -1, -1], [1, 1, 1]), Sphere([0, 0, 0], 1.2))
+    behind_camera = Sphere([0, 0, -20], 1)
+    plane = Plane([0, 1, 0], -1)
+    scene = Scene(CAMERA, objects=[difference, behind_camera, plane])
+    bounded, report = bound_scene(scene, aspect_ratio=4 / 3.)
+    assert report == {'culled': 1, 'bounded': 1}
+    assert len(bounded.objects) == 2
+    assert 'bounded_by' in str(bounded.objects[0])
+    assert bounded.objects[1] is plane
+
+    _, report = bound_scene(scene, aspect_ratio=4 / 3., bound=False, margin=15)
+    assert report == {}
@@ -0,0 +1,116 @@
+""" The render cache and the claims on rendering identical frames """
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from pypovray import pypovray
+from pypovray.cache import RenderCache
+from vapory.vapory import Camera, LightSource, Scene, Sphere
+
+DIGESTS = ['aa' + str(number) * 38 for number in range(3)]
+
+
+def scene(frame_id):
+    """ Pairs of identical frames """
+    return Scene(Camera('location', [0, 0, -10], 'look_at', [0, 0, 0]),
+                 objects=[LightSource([2, 4, -3], 'color', [1, 1, 1]),
+                          Sphere([frame_id // 2, 0, 0], 1)])
+
+
+def write_image(path, size):
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    return process.pid
+
+
+def write_claim(cache, digest, owner, pid):
+    claim_file = cache.path(digest)[:-len('.png')] + '.claim'
+    os.makedirs(os.path.dirname(claim_file), exist_ok=True)
+    with open(claim_file, 'w') as claim:
+        claim.write('{}\n{}\n{}\n'.format(owner, socket.gethostname(), pid))
+    return claim_file
+
+
+def test_store_and_fetch(tmp_path):
+    cache = RenderCache(str(tmp_path / 'cache'), 1000)
+    assert not cache.fetch(DIGESTS[0], str(tmp_path / 'frame.png'))
+    cache.store(DIGESTS[0], write_image(tmp_path / 'image.png', 10))
+    assert cache.fetch(DIGESTS[0], str(tmp_path / 'frame.png'))
+    assert (tmp_path / 'frame.png').read_bytes() == b'x' * 10
+    assert cache.size == 10
+
+
+def test_least_recently_used_images_are_evicted(tmp_path):
+    cache = RenderCache(str(tmp_path / 'cache'), 250)
+    for age, digest in enumerate(DIGESTS):
+        cache.store(digest, write_image(tmp_path / 'image.png', 100))
+        os.utime(cache.path(digest), (age, age))
+    assert not os.path.exists(cache.path(DIGESTS[0]))
+    assert os.path.exists(cache.path(DIGESTS[2]))
+    assert cache.size <= 250
+
+
+def test_claims(tmp_path):
+    cache = RenderCache(str(tmp_path / 'cache'), 1000)
+    assert cache.claim(DIGESTS[0], 1) == '1'
+    assert cache.claim(DIGESTS[0], 2) == '1'
+    cache.release(DIGESTS[0])
+    assert cache.claim(DIGESTS[0], 2) == '2'
+    assert not [name for name in os.listdir(os.path.dirname(cache.path(DIGESTS[0])))
+                if name.endswith('.tmp')]
+
+
+def test_claims_of_ended_processes_are_taken_over(tmp_path):
+    cache = RenderCache(str(tmp_path / 'cache'), 1000)
+    write_claim(cache, DIGESTS[0], 1, dead_pid())
+    assert cache.claim(DIGESTS[0], 2) == '2'
+
+    cache = RenderCache(str(tmp_path / 'cache'), 1000, stale_age=60)
+    claim_file = write_claim(cache, DIGESTS[1], 1, os.getpid())
+    assert cache.claim(DIGESTS[1], 2) == '1'
+    os.utime(claim_file, (time.time() - 120,) * 2)
+    assert cache.claim(DIGESTS[1], 2) == '2'
+
+
+def test_evict_removes_stale_claims_and_temporary_files(tmp_path):
+    cache = RenderCache(str(tmp_path / 'cache'), 1000, stale_age=60)
+    dead_claim = write_claim(cache, DIGESTS[0], 1, dead_pid())
+    live_claim = write_claim(cache, DIGESTS[1], 1, os.getpid())
+    folder = os.path.dirname(dead_claim)
+    old_file = write_image(tmp_path / 'cache' / 'aa' / 'old.tmp', 10)
+    os.utime(old_file, (time.time() - 120,) * 2)
+    new_file = write_image(tmp_path / 'cache' / 'aa' / 'new.tmp', 10)
+
+    cache.evict()
+    assert sorted(os.listdir(folder)) == sorted(os.path.basename(name)
+                                                for name in (live_claim, new_file))
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_identical_frames_are_rendered_once(settings, fake_povray, tmp_path, backend):
+    settings(RenderCache=True, PoolBackend=backend, Workers=3)
+    digests = pypovray._render_scene(scene)
+    assert len(fake_povray()) == 3
+    assert len(set(digests.values())) == 3
+    images = sorted((tmp_path / 'images').iterdir())
+    assert [image.name for image in images] == ['test_00{}.png'.format(frame_id)
+                                               for frame_id in range(6)]
+    assert images[0].read_bytes() == images[1].read_bytes()
+
+    # Another job fetches all frames from the cache
+    settings(OutputImageDir=tmp_path / 'movies')
+    pypovray._render_scene(scene)
+    assert len(fake_povray()) == 3
+    assert len(list((tmp_path / 'movies').iterdir())) == 6
+    assert not [name for _, _, files in os.walk(str(tmp_path / 'cache')) for name in files
+                if name.endswith(('.claim', '.tmp'))]
@@ -0,0 +1,42 @@
+""" Declaring repeated scene elements once (DECLARE_REPEATED) """
+
+from vapory.vapory import (Blob, Box, Camera, Pigment, Scene, Sphere, Texture, config,
+                           repeated_elements)
+
+CAMERA = Camera('location', [0, 0, -10], 'look_at', [0, 0, 0])
+
+
+def red():
+    return Texture(Pigment('color', [1, 0, 0]))
+
+
+def test_scene_without_declarations(monkeypatch):
+    monkeypatch.setattr(config, 'DECLARE_REPEATED', False)
+    code = str(Scene(CAMERA, objects=[Sphere([0, 0, 0], 1, red()), Sphere([1, 0, 0], 1, red())]))
+    assert '#declare' not in code
+    assert code.count('texture {') == 2
+
+
+def test_identical_elements_are_declared_once(monkeypatch):
+    monkeypatch.setattr(config, 'DECLARE_REPEATED', True)
+    texture = red()
+    box = Box([0, 0, 0], [1, 1, 1])
+    code = str(Scene(CAMERA, objects=[Sphere([0, 0, 0], 1, texture),
+                                      Sphere([1, 0, 0], 1, texture),
+                                      Sphere([2, 0, 0], 1, red()),
+                                      box, Box([0, 0, 0], [1, 1, 1])]))
+    assert code.count('#declare') == 3
+    assert code.count('texture { VaporyShared1 }') == 3
+    assert code.count('object { VaporyShared2 }') == 2
+    # Declared before use
+    assert code.index('#declare VaporyShared1') < code.index('texture { VaporyShared1 }')
+    # Elements occurring once are written in place
+    assert code.count('sphere {') == 3
+
+
+def test_objects_of_blobs_stay_inline():
+    component = Sphere([0, 0, 0], 1, 1)
+    references, declarations = repeated_elements([Blob(component, Sphere([0, 0, 0], 1, 1),
+                                                       'threshold', 0.5)])
+    assert references == {}
+    assert declarations == []
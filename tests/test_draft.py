@@ -0,0 +1,38 @@
+""" Two-pass animations: a draft movie first, then the final frames """
+
+from pypovray import pypovray
+from vapory.vapory import Camera, LightSource, Scene, Sphere
+
+
+def scene(frame_id):
+    return Scene(Camera('location', [0, 0, -10], 'look_at', [0, 0, 0]),
+                 objects=[LightSource([2, 4, -3], 'color', [1, 1, 1]),
+                          Sphere([frame_id, 0, 0], 1)])
+
+
+def test_parse_frame_ranges():
+    assert pypovray.parse_frame_ranges('0-2, 5,4-5,9', 8) == [0, 1, 2, 4, 5]
+
+
+def test_draft_then_final(settings, fake_povray, fake_ffmpeg, tmp_path):
+    settings(DraftScale=0.5, DraftQuality=2)
+    pypovray.render_scene_draft(scene)
+    assert len(fake_povray()) == 6
+    assert all('+W4' in render and '+H3' in render and '+Q2' in render
+               for render in fake_povray())
+    assert len(list((tmp_path / 'test_scenes').iterdir())) == 6
+    # The fake ffmpeg lists the images of the movie
+    assert len((tmp_path / 'movies' / 'test_draft.mp4').read_text().splitlines()) == 6
+    assert list((tmp_path / 'images').iterdir()) == []
+
+    # The approved frames are rendered from the stored scenes, the movie is
+    # created once all frames are rendered
+    pypovray.render_scene_final('0-2')
+    assert len(fake_povray()) == 9
+    assert all('+W8' in render and '+H6' in render for render in fake_povray()[6:])
+    assert len(list((tmp_path / 'images').iterdir())) == 3
+    assert not (tmp_path / 'movies' / 'test.mp4').exists()
+
+    pypovray.render_scene_final('3-5')
+    assert len(fake_povray()) == 12
+    assert len((tmp_path / 'movies' / 'test.mp4').read_text().splitlines()) == 6
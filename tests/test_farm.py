@@ -0,0 +1,128 @@
+""" A render farm of a coordinator and worker processes on localhost """
+
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+
+import pytest
+
+from pypovray import farm, pypovray
+from vapory.vapory import Camera, Scene, Sphere
+from vapory.vapory.io import POVRayError
+
+AUTHKEY = b'test secret'
+
+SCRIPT = '''
+from vapory.vapory import Camera, LightSource, Scene, Sphere
+
+
+def frame(step):
+    return Scene(Camera('location', [0, 0, -10], 'look_at', [0, 0, 0]),
+                 objects=[LightSource([2, 4, -3], 'color', [1, 1, 1]),
+                          Sphere([step, 0, 0], 1, *(['FAIL'] if step == {fail} else []))])
+'''
+
+
+def free_address():
+    with socket.socket() as free:
+        free.bind(('localhost', 0))
+        return 'localhost', free.getsockname()[1]
+
+
+def run_worker(address, name):
+    # The coordinator might not be listening yet
+    for _ in range(50):
+        try:
+            farm.Worker(address, AUTHKEY, heartbeat_interval=1, name=name).run()
+            return
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+
+
+class Farm(object):
+    """ Runs a coordinator in a thread and the workers in processes """
+
+    def __init__(self, tmp_path, fail=None, workers=3, **options):
+        script = tmp_path / 'scene.py'
+        script.write_text(SCRIPT.format(fail=fail))
+        address = free_address()
+        self.coordinator = farm.Coordinator(str(script), [], address, AUTHKEY, **options)
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.start()
+        context = multiprocessing.get_context('fork')
+        self.workers = [context.Process(target=run_worker,
+                                        args=(address, 'worker-{}'.format(number)))
+                        for number in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def _run(self):
+        try:
+            self.coordinator.run()
+        except RuntimeError as error:
+            self.error = error
+
+    def join(self):
+        self.thread.join(60)
+        for worker in self.workers:
+            worker.join(10)
+            if worker.is_alive():
+                worker.kill()
+        assert not self.thread.is_alive()
+
+
+def test_frames_of_a_killed_worker_are_reassigned(settings, fake_povray, monkeypatch, tmp_path):
+    settings(UsePool=False, Duration=2)
+    monkeypatch.setenv('FAKE_POVRAY_SLEEP', '0.2')
+    render_farm = Farm(tmp_path, range_size=3, heartbeat_timeout=5)
+    coordinator = render_farm.coordinator
+
+    # Kill the first worker while it renders a range of frames
+    deadline = time.time() + 30
+    while not coordinator.assigned.get('worker-0') and time.time() < deadline:
+        time.sleep(0.01)
+    with coordinator.lock:
+        lost = set(coordinator.assigned['worker-0']) - coordinator.done
+    os.kill(render_farm.workers[0].pid, signal.SIGKILL)
+    render_farm.join()
+
+    assert render_farm.error is None
+    assert lost and lost <= coordinator.done
+    assert coordinator.done == set(range(12))
+    assert sorted(image.name for image in (tmp_path / 'images').iterdir()) == [
+        'test_{:03d}.png'.format(frame_id) for frame_id in range(12)]
+
+
+def test_failing_frame_stops_the_job(settings, fake_povray, tmp_path):
+    settings(UsePool=False)
+    render_farm = Farm(tmp_path, fail=4, workers=2, range_size=3, heartbeat_timeout=5,
+                       max_failures=2)
+    render_farm.join()
+    assert 'frames [4, 5] failed on 2 workers' in str(render_farm.error)
+    assert 4 not in render_farm.coordinator.done
+
+
+def test_render_frame_image_removes_its_folder(settings, fake_povray, monkeypatch, tmp_path):
+    folder = tmp_path / 'frame'
+
+    def mkdtemp():
+        folder.mkdir()
+        return str(folder)
+
+    def scene(step):
+        """ Frame 1 fails """
+        return Scene(Camera('location', [0, 0, -10], 'look_at', [0, 0, 0]),
+                     objects=[Sphere([0, 0, 0], 1, 'FAIL' if step else '')])
+
+    monkeypatch.setattr(farm, 'mkdtemp', mkdtemp)
+
+    image = farm._render_frame_image(scene, pypovray._render_settings(), 0)
+    assert image.startswith(b'\x89PNG')
+    assert not folder.exists()
+    with pytest.raises(POVRayError):
+        farm._render_frame_image(scene, pypovray._render_settings(), 1)
+    assert not folder.exists()
@@ -0,0 +1,13 @@
+""" Formatting numbers in the scene files """
+
+from vapory.vapory import config
+from vapory.vapory.helpers import format_number
+
+
+def test_format_number(monkeypatch):
+    monkeypatch.setattr(config, 'FLOAT_PRECISION', None)
+    assert format_number(0.1 + 0.2) == str(0.1 + 0.2)
+    monkeypatch.setattr(config, 'FLOAT_PRECISION', 3)
+    assert format_number(0.1 + 0.2) == '0.3'
+    assert format_number(1234.5678) == '1.23e+03'
+    assert format_number(123456789) == '123456789'
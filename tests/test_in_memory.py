@@ -0,0 +1,39 @@
+""" Rendering frames to numpy arrays instead of PNG files """
+
+import numpy
+import pytest
+
+from pypovray import pypovray
+from vapory.vapory import Camera, LightSource, Scene, Sphere
+
+
+def scene(frame_id):
+    return Scene(Camera('location', [0, 0, -10], 'look_at', [0, 0, 0]),
+                 objects=[LightSource([2, 4, -3], 'color', [1, 1, 1]),
+                          Sphere([frame_id, 0, 0], 1)])
+
+
+@pytest.mark.parametrize('pool', [{'PoolBackend': 'thread'}, {'PoolBackend': 'process'},
+                                  {'AsyncRender': True}, {'UsePool': False}])
+def test_render_scene_to_arrays(settings, fake_povray, tmp_path, pool):
+    settings(**pool)
+    frames = []
+    pypovray.render_scene_to_arrays(scene, lambda *frame: frames.append(frame))
+    assert [frame_id for frame_id, _ in frames] == list(range(6))
+    for _, frame in frames:
+        assert frame.shape == (6, 8, 3)
+        assert frame.dtype == numpy.uint8
+    # Every frame has a different scene
+    assert len({frame[0, 0, 0] for _, frame in frames}) == 6
+    assert list((tmp_path / 'images').iterdir()) == []
+
+
+def test_stream_raw_frames(settings, fake_povray, fake_ffmpeg, tmp_path):
+    settings(StreamEncode=True, InMemoryFrames=True)
+    frames = []
+    pypovray.render_scene_to_arrays(scene, lambda frame_id, frame: frames.append(frame))
+    pypovray.render_scene_to_mp4(scene)
+    # The fake ffmpeg writes the raw rgb24 video it receives
+    assert (tmp_path / 'movies' / 'test.mp4').read_bytes() == b''.join(frame.tobytes()
+                                                                       for frame in frames)
+    assert list((tmp_path / 'images').iterdir()) == []
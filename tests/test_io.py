@@ -0,0 +1,54 @@
+""" Reading the PPM/PGM images written by POV-Ray """
+
+import io
+
+import numpy
+import pytest
+
+from vapory.vapory.io import ppm_frames, ppm_to_numpy
+
+
+def test_ppm_to_numpy_color():
+    pixels = numpy.arange(2 * 3 * 3, dtype='uint8').reshape(2, 3, 3)
+    image = ppm_to_numpy(buffer=b'P6\n3 2\n255\n' + pixels.tobytes())
+    assert image.dtype == numpy.uint8
+    numpy.testing.assert_array_equal(image, pixels)
+
+
+def test_ppm_to_numpy_greyscale_with_comment(tmp_path):
+    pixels = numpy.arange(4 * 2, dtype='uint8').reshape(2, 4)
+    ppm_file = tmp_path / 'grey.pgm'
+    ppm_file.write_bytes(b'P5\n# rendered by POV-Ray\n4 2\n255\n' + pixels.tobytes())
+    numpy.testing.assert_array_equal(ppm_to_numpy(str(ppm_file)), pixels)
+
+
+def test_ppm_to_numpy_16_bit():
+    pixels = numpy.array([[[0, 256, 65535], [1, 2, 3]]], dtype='>u2')
+    image = ppm_to_numpy(buffer=b'P6 2 1 65535\n' + pixels.tobytes())
+    assert image.shape == (1, 2, 3)
+    assert image.dtype.itemsize == 2
+    numpy.testing.assert_array_equal(image, pixels)
+
+
+@pytest.mark.parametrize('data', [b'P3\n1 1\n255\n0 0 0', b'P6\n2 2\n255\n\x00\x00\x00'])
+def test_ppm_to_numpy_invalid(data):
+    with pytest.raises(ValueError):
+        ppm_to_numpy(buffer=data)
+
+
+def test_ppm_frames():
+    first = numpy.zeros((2, 3, 3), dtype='uint8')
+    second = numpy.full((2, 3), 7, dtype='uint8')
+    stream = io.BytesIO(b'P6\n3 2\n255\n' + first.tobytes() +
+                        b'P5 3 2 255\n' + second.tobytes())
+    frames = list(ppm_frames(stream))
+    assert len(frames) == 2
+    numpy.testing.assert_array_equal(frames[0], first)
+    numpy.testing.assert_array_equal(frames[1], second)
+    # The arrays own their (writable) memory
+    frames[1][0, 0] = 1
+
+
+def test_ppm_frames_truncated():
+    with pytest.raises(ValueError):
+        list(ppm_frames(io.BytesIO(b'P6\n3 2\n255\n\x00\x00')))
@@ -0,0 +1,56 @@
+""" Resuming animations from the frame manifest """
+
+from pypovray import pypovray
+from pypovray.manifest import RenderManifest
+from vapory.vapory import Camera, LightSource, Scene, Sphere
+
+# Frames render a sphere at this x position
+POSITIONS = {}
+
+
+def scene(frame_id):
+    return Scene(Camera('location', [0, 0, -10], 'look_at', [0, 0, 0]),
+                 objects=[LightSource([2, 4, -3], 'color', [1, 1, 1]),
+                          Sphere([POSITIONS.get(frame_id, 0), 0, 0], 1)])
+
+
+def test_record_saves_in_batches(tmp_path):
+    manifest_file = str(tmp_path / 'manifest.json')
+    manifest = RenderManifest(manifest_file, {}, save_interval=60)
+    manifest.record(0, 'digest', 'frame_000.png')
+    assert not (tmp_path / 'manifest.json').exists()
+    manifest.flush()
+    assert RenderManifest(manifest_file, {}).frames == {
+        0: {'digest': 'digest', 'output': 'frame_000.png'}}
+
+    manifest.save_interval = 0
+    manifest.record(1, 'digest', 'frame_001.png')
+    assert len(RenderManifest(manifest_file, {}).frames) == 2
+
+
+def test_resume_renders_changed_and_missing_frames(settings, fake_povray, tmp_path):
+    settings(Resume=True)
+    pypovray._render_scene(scene)
+    assert len(fake_povray()) == 6
+    assert (tmp_path / 'test_manifest.json').exists()
+
+    pypovray._render_scene(scene)
+    assert len(fake_povray()) == 6
+
+    POSITIONS[2] = 1
+    (tmp_path / 'images' / 'test_004.png').unlink()
+    try:
+        pypovray._render_scene(scene)
+    finally:
+        POSITIONS.clear()
+    assert len(fake_povray()) == 8
+
+
+def test_resume_removes_frames_beyond_the_animation(settings, fake_povray, tmp_path):
+    settings(Resume=True)
+    pypovray._render_scene(scene)
+    settings(Duration=0.5)
+    pypovray._render_scene(scene)
+    assert sorted(image.name for image in (tmp_path / 'images').iterdir()) == [
+        'test_000.png', 'test_001.png', 'test_002.png']
+    assert len(fake_povray()) == 6
@@ -0,0 +1,21 @@
+""" Optimizing the CSG operations of a scene """
+
+from vapory.vapory import Camera, Merge, Pigment, Scene, Sphere, Texture, Union, optimize_scene
+
+CAMERA = Camera('location', [0, 0, -10], 'look_at', [0, 0, 0])
+
+
+def test_optimize_scene():
+    first, second, third = Sphere([0, 0, 0], 1), Sphere([1, 0, 0], 1), Sphere([2, 0, 0], 1)
+    transparent = Texture(Pigment('color', [1, 0, 0], 'filter', 0.5))
+    scene = Scene(CAMERA, objects=[Union(Union(first, second), third), Merge(first),
+                                   Merge(first, second), Merge(first, second, transparent)])
+    optimized, report = optimize_scene(scene)
+    assert report == {'flattened': 1, 'unwrapped': 1, 'merge_to_union': 1}
+    union, sphere, merged, transparent_merge = optimized.objects
+    assert type(union) is Union and union.args == [first, second, third]
+    assert sphere is first
+    assert type(merged) is Union
+    assert type(transparent_merge) is Merge
+    # The scene itself is not changed
+    assert len(scene.objects[0].args) == 2
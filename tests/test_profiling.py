@@ -0,0 +1,38 @@
+""" Per-frame render timings """
+
+import csv
+import json
+
+from pypovray.profiling import RenderProfile
+
+
+def test_summary():
+    profile = RenderProfile()
+    profile.add_frame(1, 'rendered', {'worker': 10, 'scene': 0.5, 'povray': 2.0})
+    profile.add_frame(0, 'cached', {'worker': 11, 'scene': 0.5, 'digest': 0.1})
+    with profile.timer('ffmpeg'):
+        pass
+    profile.finish()
+    summary = profile.summary()
+    assert summary['frames'] == 2 and summary['rendered'] == 1
+    assert summary['phases']['scene']['total'] == 1.0
+    assert summary['phases']['povray']['max'] == 2.0
+    assert 'write' not in summary['phases']
+    assert summary['workers']['10'] == {'frames': 1, 'busy': 2.5}
+    assert 'ffmpeg' in summary['job_phases']
+
+
+def test_write_csv_and_json(tmp_path):
+    profile = RenderProfile()
+    profile.add_frame(1, 'rendered', {'worker': 10, 'povray': 2.0, 'upload': 0.25})
+    profile.add_frame(0, 'current', {'worker': 10})
+    profile.write_csv(str(tmp_path / 'profile.csv'))
+    with open(str(tmp_path / 'profile.csv')) as report:
+        rows = list(csv.DictReader(report))
+    assert [row['frame'] for row in rows] == ['0', '1']
+    assert rows[1]['povray'] == '2.0' and rows[1]['upload'] == '0.25'
+    assert rows[0]['upload'] == ''
+
+    profile.write_json(str(tmp_path / 'profile.json'))
+    with open(str(tmp_path / 'profile.json')) as report:
+        assert [frame['frame'] for frame in json.load(report)['frames']] == [0, 1]
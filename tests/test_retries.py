@@ -0,0 +1,118 @@
+""" Render timeouts, retries and speculative copies of straggling frames """
+
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from pypovray import pypovray
+from pypovray.scheduler import FrameScheduler
+from vapory.vapory import Camera, LightSource, Scene, Sphere, config
+
+SCENE_CALLS = Counter()
+
+
+def scene(frame_id):
+    """ Frame 3 fails in POV-Ray, frame 4 in the scene function """
+    SCENE_CALLS[frame_id] += 1
+    if frame_id == 4:
+        raise ValueError('no scene for frame 4')
+    return Scene(Camera('location', [0, 0, -10], 'look_at', [0, 0, 0]),
+                 objects=[LightSource([2, 4, -3], 'color', [1, 1, 1]),
+                          Sphere([frame_id, 0, 0], 1, 'FAIL' if frame_id == 3 else '')])
+
+
+class Tasks(object):
+    """ Render function for the thread backend that counts the calls of each task;
+    the calls of a task sleep and succeed or fail as given in `calls` (the last
+    entry for any further calls) """
+
+    def __init__(self, calls):
+        self.calls = calls
+        self.started = Counter()
+        self.lock = threading.Lock()
+
+    def __call__(self, task):
+        with self.lock:
+            self.started[task] += 1
+            calls = self.calls.get(task, [(0, False)])
+            sleep, fails = calls[min(self.started[task], len(calls)) - 1]
+        time.sleep(sleep)
+        if fails:
+            raise ValueError('task {} failed'.format(task))
+        return task
+
+
+@pytest.mark.parametrize('frame_ids, renders', [([0, 1, 2], 3), ([3], 3)])
+def test_povray_failures_are_retried(settings, fake_povray, frame_ids, renders):
+    settings(RenderRetries=2)
+    if frame_ids == [3]:
+        with pytest.raises(RuntimeError, match='FAIL'):
+            pypovray._render_scene(scene, frame_ids=frame_ids)
+    else:
+        pypovray._render_scene(scene, frame_ids=frame_ids)
+    assert len(fake_povray()) == renders
+
+
+def test_scene_errors_are_not_retried(settings, fake_povray):
+    settings(RenderRetries=2, UsePool=False)
+    SCENE_CALLS.clear()
+    with pytest.raises(ValueError, match='no scene'):
+        pypovray._render_scene(scene, frame_ids=[4])
+    assert SCENE_CALLS[4] == 1
+
+
+@pytest.mark.parametrize('pool', [{'PoolBackend': 'thread'}, {'PoolBackend': 'process'},
+                                  {'AsyncRender': True}])
+def test_timed_out_render_is_retried(settings, fake_povray, monkeypatch, tmp_path, pool):
+    settings(RenderRetries=1, **pool)
+    monkeypatch.setattr(config, 'RENDER_TIMEOUT', 1)
+    hang = tmp_path / 'hang'
+    hang.touch()
+    monkeypatch.setenv('FAKE_POVRAY_HANG_ONCE', str(hang))
+    start = time.time()
+    pypovray._render_scene(scene, frame_ids=[0, 1, 2])
+    assert time.time() - start < 20
+    assert len(fake_povray()) == 4
+    assert sorted(image.name for image in (tmp_path / 'images').iterdir()) == [
+        'test_000.png', 'test_001.png', 'test_002.png']
+
+
+def test_timeout_without_retries(settings, fake_povray, monkeypatch, tmp_path):
+    settings(UsePool=False)
+    monkeypatch.setattr(config, 'RENDER_TIMEOUT', 1)
+    hang = tmp_path / 'hang'
+    hang.touch()
+    monkeypatch.setenv('FAKE_POVRAY_HANG_ONCE', str(hang))
+    with pytest.raises(TimeoutError):
+        pypovray._render_scene(scene, frame_ids=[0])
+    assert list((tmp_path / 'images').iterdir()) == []
+
+
+def test_straggler_is_copied():
+    # Task 0 takes long the first time, its copy is used
+    render = Tasks({0: [(3, False), (0, False)]})
+    results = {}
+    scheduler = FrameScheduler(render, workers=2, backend='thread', speculate=True)
+    start = time.time()
+    scheduler.run(range(4), callback=results.__setitem__)
+    assert time.time() - start < 3
+    assert results == {task: task for task in range(4)}
+    assert scheduler.speculated == 1
+    assert render.started[0] == 2
+
+
+def test_failed_worker_is_replaced_while_a_copy_renders():
+    # One worker gets tasks 0-2 and the other task 3, then a copy of tasks 0-2.
+    # Task 0 fails in the first worker while its copy is still rendering.
+    render = Tasks({0: [(0.5, True), (1, False)]})
+    results = {}
+    scheduler = FrameScheduler(render, workers=2, chunk_size=3, backend='thread',
+                               speculate=True)
+    scheduler.run(range(4), callback=results.__setitem__)
+    assert results == {task: task for task in range(4)}
+    # A third worker was started in place of the failed worker
+    assert sorted(scheduler.utilisation) == [0, 1, 2]
+    # The failed task is not copied again
+    assert render.started[0] == 2
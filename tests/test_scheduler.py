@@ -0,0 +1,78 @@
+""" FrameScheduler with dummy tasks (no POV-Ray) """
+
+import os
+from functools import partial
+
+import pytest
+
+from pypovray.scheduler import FrameScheduler
+
+BACKENDS = ['process', 'thread']
+
+
+def square(task):
+    return task * task
+
+
+def fail_on_three(task):
+    if task == 3:
+        raise ValueError('task three')
+    return task
+
+
+def crash_once(flag_file, task):
+    """ Kills the worker the first time task 2 is rendered """
+    if task == 2 and not os.path.exists(flag_file):
+        open(flag_file, 'w').close()
+        os._exit(1)
+    return task
+
+
+def crash_always(task):
+    if task == 2:
+        os._exit(1)
+    return task
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('chunk_size', [1, 3])
+def test_run_calls_back_once_per_task(backend, chunk_size):
+    results = {}
+    scheduler = FrameScheduler(square, workers=3, chunk_size=chunk_size, backend=backend)
+    timings = scheduler.run(range(10), callback=results.__setitem__)
+    assert results == {task: task * task for task in range(10)}
+    assert sorted(timings) == list(range(10))
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_run_raises_on_failed_task(backend):
+    scheduler = FrameScheduler(fail_on_three, workers=2, backend=backend)
+    with pytest.raises(RuntimeError, match='task three'):
+        scheduler.run(range(6))
+
+
+def test_killed_worker_is_replaced(tmp_path):
+    results = {}
+    scheduler = FrameScheduler(partial(crash_once, str(tmp_path / 'crashed')), workers=2)
+    scheduler.run(range(5), callback=results.__setitem__)
+    assert results == {task: task for task in range(5)}
+
+
+def test_task_killing_two_workers_fails():
+    scheduler = FrameScheduler(crash_always, workers=2)
+    with pytest.raises(RuntimeError, match='killed two workers'):
+        scheduler.run(range(5))
+
+
+def test_longest_first_order():
+    scheduler = FrameScheduler(square, workers=1, chunk_size=2, longest_first=True,
+                               costs={0: 1.0, 1: 5.0, 2: 3.0})
+    # Task 3 has no known cost and is assumed to take the average (3 seconds)
+    assert scheduler.order([0, 1, 2, 3])[:2] == [1, 2]
+    assert scheduler.order([0, 1, 2, 3])[-1] == 0
+    assert list(scheduler.chunks([0, 1, 2])) == [[1, 2], [0]]
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        FrameScheduler(square, workers=1, backend='cluster')
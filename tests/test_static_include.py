@@ -0,0 +1,53 @@
+""" Writing the static part of an animation once (StaticInclude) """
+
+import os
+
+from vapory.vapory import Box, Camera, Scene, Sphere, StaticInclude, config
+from pypovray import pypovray
+
+CAMERA = Camera('location', [0, 0, -10], 'look_at', [0, 0, 0])
+
+
+def test_include_file_is_written_once(tmp_path):
+    objects = [Sphere([0, 0, 0], 1), Box([0, 0, 0], [1, 1, 1])]
+    include = StaticInclude('static', objects, str(tmp_path))
+    assert os.path.dirname(include.filename) == str(tmp_path)
+    with open(include.filename) as code:
+        assert code.read().count('sphere {') == 1
+    os.utime(include.filename, (0, 0))
+
+    # The same objects reuse the file, identical objects give the same file
+    assert StaticInclude('static', objects, str(tmp_path)).filename == include.filename
+    assert StaticInclude('static', [Sphere([0, 0, 0], 1), Box([0, 0, 0], [1, 1, 1])],
+                         str(tmp_path)).filename == include.filename
+    assert os.stat(include.filename).st_mtime == 0
+    assert StaticInclude('static', [Sphere([1, 0, 0], 1)],
+                         str(tmp_path)).filename != include.filename
+    assert [name for name in os.listdir(str(tmp_path)) if not name.endswith('.inc')] == []
+
+    scene = str(Scene(CAMERA, objects=[Sphere([2, 0, 0], 1)], included=[include]))
+    assert '#include "{}"'.format(include.filename) in scene
+    assert scene.count('sphere {') == 1
+
+
+def test_identifier_declares_the_objects(tmp_path):
+    include = StaticInclude('static', [Sphere([0, 0, 0], 1), Sphere([1, 0, 0], 1)],
+                            str(tmp_path), identifier='Static')
+    with open(include.filename) as code:
+        assert code.read().startswith('#declare Static = union {')
+
+
+def test_repeated_elements_of_includes(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DECLARE_REPEATED', True)
+    include = StaticInclude('static', [Box([0, 0, 0], [1, 1, 1]), Box([0, 0, 0], [1, 1, 1])],
+                            str(tmp_path))
+    with open(include.filename) as code:
+        code = code.read()
+    # Not to be confused with the declarations of the scenes
+    assert code.count('#declare VaporyInclude0 = box') == 1
+    assert code.count('object { VaporyInclude0 }') == 2
+
+
+def test_static_include_folder(settings, tmp_path):
+    include = pypovray.static_include('dna', [Sphere([0, 0, 0], 1)])
+    assert os.path.dirname(include.filename) == str(tmp_path / 'test_static')
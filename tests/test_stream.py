@@ -0,0 +1,64 @@
+""" Streaming the rendered frames into ffmpeg, in frame order """
+
+import pytest
+
+from pypovray import pypovray
+from pypovray.stream import FrameStream, ReorderBuffer
+from vapory.vapory import Camera, LightSource, Scene, Sphere
+
+
+def scene(frame_id):
+    return Scene(Camera('location', [0, 0, -10], 'look_at', [0, 0, 0]),
+                 objects=[LightSource([2, 4, -3], 'color', [1, 1, 1]),
+                          Sphere([frame_id, 0, 0], 1)])
+
+
+def test_frames_are_written_in_order():
+    written = []
+    frames = ReorderBuffer(written.append)
+    for frame_id in [2, 0, 3, 1]:
+        frames.add(frame_id, 'frame {}'.format(frame_id))
+        if frame_id == 0:
+            assert written == ['frame 0']
+    assert written == ['frame 0', 'frame 1', 'frame 2', 'frame 3']
+    assert frames.next_frame == 4
+    assert not frames.buffer
+
+
+def test_first_frame():
+    written = []
+    frames = ReorderBuffer(written.append, first_frame=10)
+    frames.add(11, 'b')
+    assert written == []
+    frames.add(10, 'a')
+    assert written == ['a', 'b']
+
+
+def test_frame_stream_writes_in_frame_order(fake_ffmpeg, tmp_path):
+    movie = tmp_path / 'movie.mp4'
+    stream = FrameStream(str(movie), '-f image2pipe', '')
+    for frame_id in [1, 2, 0]:
+        stream.add(frame_id, 'frame {}\n'.format(frame_id).encode())
+    stream.close()
+    assert movie.read_bytes() == b'frame 0\nframe 1\nframe 2\n'
+
+
+def test_frame_stream_missing_frame(fake_ffmpeg, tmp_path):
+    stream = FrameStream(str(tmp_path / 'movie.mp4'), '-f image2pipe', '')
+    stream.add(1, b'frame 1')
+    with pytest.raises(IOError, match='Missing frame 0'):
+        stream.close()
+
+
+@pytest.mark.parametrize('keep_images', [True, False])
+def test_stream_encode(settings, fake_povray, fake_ffmpeg, tmp_path, keep_images):
+    settings(StreamEncode=True, KeepImages=keep_images)
+    pypovray.render_scene_to_mp4(scene)
+    movie = (tmp_path / 'movies' / 'test.mp4').read_bytes()
+    # The fake ffmpeg writes the PNG images it receives one after the other
+    assert movie.count(b'\x89PNG') == 6
+    images = sorted((tmp_path / 'images').iterdir())
+    if keep_images:
+        assert movie == b''.join(image.read_bytes() for image in images)
+    else:
+        assert images == []
@@ -0,0 +1,66 @@
+""" Splitting frames into tiles rendered in parallel """
+
+import imageio
+import numpy
+import pytest
+
+from pypovray import pypovray
+from pypovray.tiles import TileAssembler, split_frame, stitch
+from vapory.vapory import Camera, LightSource, Scene, Sphere
+
+
+def scene(frame_id):
+    return Scene(Camera('location', [0, 0, -10], 'look_at', [0, 0, 0]),
+                 objects=[LightSource([2, 4, -3], 'color', [1, 1, 1]),
+                          Sphere([frame_id, 0, 0], 1)])
+
+
+def test_split_frame():
+    assert split_frame(8, 6, 2, 3) == [(1, 3, 1, 2), (1, 3, 3, 5), (1, 3, 6, 8),
+                                       (4, 6, 1, 2), (4, 6, 3, 5), (4, 6, 6, 8)]
+    assert split_frame(8, 6, 1, 1) == [(1, 6, 1, 8)]
+
+
+@pytest.mark.parametrize('full_size', [False, True])
+def test_stitch(full_size):
+    frame = numpy.arange(6 * 8 * 3, dtype='uint8').reshape(6, 8, 3)
+    tiles = {}
+    for start_row, end_row, start_column, end_column in split_frame(8, 6, 2, 2):
+        tile = frame[start_row - 1:end_row, start_column - 1:end_column]
+        if full_size:
+            # Only the region of a full-size partial render is used
+            tile = numpy.zeros_like(frame)
+            tile[start_row - 1:end_row, start_column - 1:end_column] = \
+                frame[start_row - 1:end_row, start_column - 1:end_column]
+        tiles[(start_row, end_row, start_column, end_column)] = tile
+    numpy.testing.assert_array_equal(stitch(8, 6, tiles), frame)
+
+
+def test_tile_assembler_calls_back_with_complete_frames():
+    regions = split_frame(8, 6, 1, 2)
+    frames = []
+    assembler = TileAssembler(8, 6, regions, lambda *frame: frames.append(frame))
+    assembler.add((1, 0), numpy.zeros((6, 4, 3)))
+    assembler.add((0, 1), numpy.ones((6, 4, 3)))
+    assert frames == []
+    assembler.add((1, 1), numpy.ones((6, 4, 3)))
+    assert len(frames) == 1 and frames[0][0] == 1
+    assert frames[0][1].shape == (6, 8, 3)
+    assert not assembler.tiles.get(1)
+
+
+def test_tiled_frame(settings, fake_povray, tmp_path):
+    settings(TileRows=2, TileColumns=2)
+    pypovray.render_scene_to_png(scene, 3)
+    assert len(fake_povray()) == 4
+    # All tiles are rendered from the same scene file
+    image = imageio.imread(str(tmp_path / 'images' / 'test_003.png'))
+    assert image.shape == (6, 8, 3)
+    assert (image == image[0, 0]).all()
+
+
+def test_tiled_animation(settings, fake_povray, tmp_path):
+    settings(TileRows=2, TileColumns=1, PoolBackend='process')
+    pypovray._render_scene(scene)
+    assert len(fake_povray()) == 12
+    assert len(list((tmp_path / 'images').iterdir())) == 6
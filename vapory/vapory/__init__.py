@@ -2,3 +2,11 @@
 
 from .version import __version__
 from .vapory import *
+from .optimize import optimize_scene, optimize_objects
+from .bounds import bound_scene, bounding_box
+
+try:
+    from .arrays import SphereBatch, CylinderBatch, Mesh2Arrays
+except ImportError:
+    # The primitive batches and Mesh2Arrays require numpy
+    pass
@@ -0,0 +1,217 @@
+"""
+Batches of primitives (spheres, cylinders) and meshes stored in numpy arrays
+instead of one Python object per primitive (or vector), for scenes with
+10^5 - 10^6 primitives or triangles (i.e. the atoms or the surface of a molecule).
+"""
+
+from abc import ABCMeta, abstractmethod
+import numpy
+
+from .helpers import number_format
+from .vapory import Mesh2, POVRayElement, _joined
+
+# Number of primitives formatted at once
+CHUNK_SIZE = 10000
+
+
+class PrimitiveBatch(POVRayElement, metaclass=ABCMeta):
+    """ Base class of the batches; a batch is written as a union of its primitives.
+
+    `textures` is a list of Texture elements and `texture_ids` the index in that
+    list for each primitive (or a single index for all). Extra arguments (i.e.
+    'scale', 2) modify the union.
+    """
+
+    # POV-Ray code of one primitive, '%s' for each number of `_columns()`
+    template = None
+
+    def __init__(self, *args, textures=None, texture_ids=None):
+        super().__init__(*args)
+        self.textures = list(textures or [])
+        self.texture_ids = (None if texture_ids is None else
+                            numpy.broadcast_to(numpy.asarray(texture_ids, dtype=int),
+                                               (len(self),)))
+
+    @abstractmethod
+    def __len__(self):
+        """ The number of primitives """
+
+    def __bool__(self):
+        # An (empty) batch is an element like any other, not an empty container
+        return True
+
+    @abstractmethod
+    def bounding_box(self):
+        """ Returns the ((min x, min y, min z), (max x, max y, max z)) box of the
+        primitives, before the modifiers of the union """
+
+    @abstractmethod
+    def _columns(self):
+        """ Returns a list of (n, k) arrays, the k values of each primitive that
+        are formatted into the template """
+
+    def povray_parts(self):
+        # The textures are declared once and referred to by each primitive
+        parts = ['union {\n']
+        for i, texture in enumerate(self.textures):
+            parts += ['#declare VaporyBatchTexture%d = ' % i, texture, '\n']
+        parts.append(self._chunks())
+        return parts + _joined(self.args, '\n', '', ' \n}')
+
+    def _chunks(self):
+        """ Formats the primitives, CHUNK_SIZE at a time """
+        template = self.template.replace('%s', number_format())
+        columns = self._columns()
+        if self.texture_ids is not None:
+            names = numpy.array(['texture { VaporyBatchTexture%d }' % i
+                                 for i in range(len(self.textures))], dtype=object)
+            columns.append(names[self.texture_ids][:, None])
+            template = template.replace(' \n}', '\n%s \n}')
+
+        return _format_rows(template, columns)
+
+
+class SphereBatch(PrimitiveBatch):
+    """ SphereBatch(centers, radii, *[UNION_MODIFIERS...], textures=[...], texture_ids=[...])
+
+    `centers` is an (n, 3) array and `radii` an (n,) array or a single radius.
+
+    >>> SphereBatch(numpy.random.rand(1000, 3) * 10, 0.1,
+                    textures=[Texture(Pigment('color', [1, 0, 0]))], texture_ids=0)
+    """
+
+    template = 'sphere {\n<%s,%s,%s>\n%s \n}\n'
+
+    def __init__(self, centers, radii, *args, textures=None, texture_ids=None):
+        self.centers = numpy.asarray(centers, dtype=float).reshape(-1, 3)
+        self.radii = numpy.broadcast_to(numpy.asarray(radii, dtype=float), (len(self.centers),))
+        super().__init__(*args, textures=textures, texture_ids=texture_ids)
+
+    def __len__(self):
+        return len(self.centers)
+
+    def bounding_box(self):
+        if not len(self):
+            return None
+        radii = numpy.abs(self.radii)[:, None]
+        return (tuple((self.centers - radii).min(axis=0).tolist()),
+                tuple((self.centers + radii).max(axis=0).tolist()))
+
+    def _columns(self):
+        return [self.centers, self.radii[:, None]]
+
+
+class CylinderBatch(PrimitiveBatch):
+    """ CylinderBatch(bases, caps, radii, *[UNION_MODIFIERS...], textures=[...], texture_ids=[...])
+
+    `bases` and `caps` are (n, 3) arrays with the end points of the cylinders
+    and `radii` an (n,) array or a single radius.
+    """
+
+    template = 'cylinder {\n<%s,%s,%s>\n<%s,%s,%s>\n%s \n}\n'
+
+    def __init__(self, bases, caps, radii, *args, textures=None, texture_ids=None):
+        self.bases = numpy.asarray(bases, dtype=float).reshape(-1, 3)
+        self.caps = numpy.asarray(caps, dtype=float).reshape(-1, 3)
+        self.radii = numpy.broadcast_to(numpy.asarray(radii, dtype=float), (len(self.bases),))
+        super().__init__(*args, textures=textures, texture_ids=texture_ids)
+
+    def __len__(self):
+        return len(self.bases)
+
+    def bounding_box(self):
+        # The boxes of the spheres around the ends hold the cylinders
+        if not len(self):
+            return None
+        radii = numpy.abs(self.radii)[:, None]
+        ends = numpy.vstack([self.bases, self.caps])
+        return (tuple((ends - numpy.vstack([radii, radii])).min(axis=0).tolist()),
+                tuple((ends + numpy.vstack([radii, radii])).max(axis=0).tolist()))
+
+    def _columns(self):
+        return [self.bases, self.caps, self.radii[:, None]]
+
+
+class Mesh2Arrays(Mesh2):
+    """ Mesh2Arrays(vertices, faces, *[MESH_MODIFIERS...], normals=None, uv_vectors=None,
+                    textures=None, texture_ids=None)
+
+    A mesh2 given as numpy arrays: `vertices` (n, 3), `faces` (m, 3) with the
+    vertex indices of each triangle, `normals` (n, 3) and `uv_vectors` (n, 2)
+    for each vertex, and `textures` (a list of Texture elements) with the index
+    in that list for each face in `texture_ids` (or a single index for all).
+
+    A mesh that is the same in every frame is best declared once in an include
+    file, and used in each frame as an Object:
+
+    >>> surface = Mesh2Arrays(vertices, faces, normals=normals)
+    >>> include = StaticInclude('surface', [surface], identifier='Surface')
+    >>> scene = Scene(camera, objects=[Object('Surface', 'rotate', [0, step, 0])],
+                      included=[include])
+    """
+
+    def __init__(self, vertices, faces, *args, normals=None, uv_vectors=None,
+                 textures=None, texture_ids=None):
+        super().__init__(*args)
+        self.vertices = numpy.asarray(vertices, dtype=float).reshape(-1, 3)
+        self.faces = numpy.asarray(faces, dtype=int).reshape(-1, 3)
+        if len(self.faces) and not 0 <= self.faces.min() <= self.faces.max() < len(self.vertices):
+            raise ValueError('face indices must refer to one of the %d vertices'
+                             % len(self.vertices))
+        self.normals = (None if normals is None else
+                        numpy.asarray(normals, dtype=float).reshape(-1, 3))
+        self.uv_vectors = (None if uv_vectors is None else
+                           numpy.asarray(uv_vectors, dtype=float).reshape(-1, 2))
+        for values in (self.normals, self.uv_vectors):
+            if values is not None and len(values) != len(self.vertices):
+                raise ValueError('normals and uv_vectors are given for each vertex')
+        self.textures = list(textures or [])
+        self.texture_ids = (None if texture_ids is None else
+                            numpy.broadcast_to(numpy.asarray(texture_ids, dtype=int),
+                                               (len(self.faces),)))
+
+    @classmethod
+    def transformed_name(cls):
+        return 'mesh2'
+
+    def bounding_box(self):
+        if not len(self.vertices):
+            return None
+        return (tuple(self.vertices.min(axis=0).tolist()),
+                tuple(self.vertices.max(axis=0).tolist()))
+
+    def povray_parts(self):
+        number = number_format()
+        vector = ',\n<%s,%s,%s>'.replace('%s', number)
+        parts = ['mesh2 {\nvertex_vectors {\n%d' % len(self.vertices),
+                 _format_rows(vector, [self.vertices]), '\n}\n']
+        if self.normals is not None:
+            parts += ['normal_vectors {\n%d' % len(self.normals),
+                      _format_rows(vector, [self.normals]), '\n}\n']
+        if self.uv_vectors is not None:
+            parts += ['uv_vectors {\n%d' % len(self.uv_vectors),
+                      _format_rows(',\n<%s,%s>'.replace('%s', number), [self.uv_vectors]),
+                      '\n}\n']
+        if self.textures:
+            parts.append('texture_list {\n%d' % len(self.textures))
+            for texture in self.textures:
+                parts += [',\n', texture]
+            parts.append('\n}\n')
+
+        # The normals and uv vectors use the indices of the vertices
+        if self.texture_ids is None:
+            faces = _format_rows(',\n<%d,%d,%d>', [self.faces])
+        else:
+            faces = _format_rows(',\n<%d,%d,%d>,%d', [self.faces, self.texture_ids[:, None]])
+        parts += ['face_indices {\n%d' % len(self.faces), faces, '\n}\n']
+        return parts + _joined(self.args, '\n', '', ' \n}')
+
+
+def _format_rows(template, columns):
+    """ Formats each row of the (n, k) arrays `columns` with `template` (with a
+    '%' field for each of their values), CHUNK_SIZE rows at a time with a single
+    '%' operation """
+    for start in range(0, len(columns[0]), CHUNK_SIZE):
+        values = numpy.hstack([column[start:start + CHUNK_SIZE].astype(object)
+                               for column in columns])
+        yield (template * len(values)) % tuple(values.ravel().tolist())
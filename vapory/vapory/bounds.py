@@ -0,0 +1,375 @@
+"""
+Axis-aligned bounding boxes of the common objects (spheres, cylinders, cones,
+boxes, text and CSG operations), used to add `bounded_by` to CSG intersections
+and differences, which POV-Ray's automatic bounding handles poorly, and to
+remove the objects outside the view of the camera (view-frustum culling).
+
+A bounding box is a ((min x, min y, min z), (max x, max y, max z)) tuple.
+Objects without a known, finite bounding box (planes, meshes, declared
+objects, unknown transformations, ...) are never changed or removed.
+"""
+
+import math
+import re
+from collections import Counter
+from copy import copy as shallowcopy
+
+from .helpers import _is_number
+from .optimize import _is_object, _is_optimized
+from .vapory import Box, BoundedBy
+
+# Number of leading arguments that define the shape of the primitives
+SHAPE_ARGS = {'sphere': 2, 'cylinder': 3, 'cone': 4, 'box': 2, 'text': 5}
+CSG_NAMES = {'union', 'merge', 'intersection', 'difference'}
+# CSG operations that get a `bounded_by`
+BOUNDED_CSG = {'intersection', 'difference'}
+# Largest width of a letter and the room around the letters (for descenders,
+# accents, ...) of Text objects, relative to the font size (1 unit)
+TEXT_LETTER_WIDTH = 1.25
+TEXT_MARGIN = 0.5
+# Transformations written as a string (i.e. 'scale 2') or not supported
+UNKNOWN_TRANSFORMS = re.compile(r'\b(translate|rotate|scale|matrix|transform|inverse)\b')
+# Camera keywords of a perspective camera, with the POV-Ray defaults
+CAMERA_VECTORS = {'location': (0.0, 0.0, 0.0), 'look_at': None, 'right': (1.33, 0.0, 0.0),
+                  'up': (0.0, 1.0, 0.0), 'direction': (0.0, 0.0, 1.0), 'sky': (0.0, 1.0, 0.0)}
+
+
+def bound_scene(scene, aspect_ratio=None, bound=True, cull=True, margin=0.0):
+    """ Returns a copy of the scene with `bounded_by` added to the CSG intersections
+    and differences (`bound`) and without the objects outside the view of the camera
+    (`cull`), and a report ({'bounded': count, 'culled': count}).
+
+    `aspect_ratio` overrides the 'right' vector of the camera, as `Scene.render`
+    does for the width and height of the image. Objects outside the view can still
+    cast shadows into it or show up in reflections; `margin` (in scene units) keeps
+    the objects close to the view.
+    """
+    boxes = bounding_boxes(scene.objects)
+    objects, report = scene.objects, Counter()
+    if cull:
+        objects, report['culled'] = cull_objects(objects, scene.camera, aspect_ratio,
+                                                 margin, boxes)
+    if bound:
+        objects, report['bounded'] = bound_objects(objects, boxes)
+    new = shallowcopy(scene)
+    new.objects = objects
+    return new, {change: count for change, count in report.items() if count}
+
+
+def bounding_box(e):
+    """ Returns the bounding box of an object, or None if it is not known """
+    return bounding_boxes([e])[id(e)][1]
+
+
+def bounding_boxes(objects, boxes=None):
+    """ Returns {id(object): (box of the shape, box)} for the objects and the objects
+    nested in their CSG operations, where 'box of the shape' is the box before the
+    object's own transformations. `boxes` (a previous result) is extended. """
+    boxes = {} if boxes is None else boxes
+    stack = [(e, False) for e in objects[::-1]]
+    while stack:
+        e, children_done = stack.pop()
+        if id(e) in boxes:
+            continue
+        children = [arg for arg in e.args if _is_object(arg)] if _is_csg(e) else []
+        if not children_done and children:
+            # Nested CSG operations are handled without recursion
+            stack.append((e, True))
+            stack += [(child, False) for child in children[::-1]]
+            continue
+        boxes[id(e)] = _shape_box(e, [boxes[id(child)][1] for child in children])
+    return boxes
+
+
+def bound_objects(objects, boxes=None):
+    """ Adds `bounded_by { box {...} }` to the CSG intersections and differences
+    (also nested ones) that have a finite bounding box and no `bounded_by` or
+    `clipped_by` yet. Returns the new objects and the number of operations bounded;
+    the given objects are not changed. """
+    boxes = bounding_boxes(objects, boxes)
+    bounded = 0
+    new = {}     # id(CSG operation) => bounded CSG operation
+    stack = [(e, False) for e in objects[::-1] if _is_csg(e)]
+    while stack:
+        e, children_done = stack.pop()
+        if id(e) in new:
+            continue
+        children = [arg for arg in e.args if _is_csg(arg)]
+        if not children_done and children:
+            stack.append((e, True))
+            stack += [(child, False) for child in children[::-1]]
+            continue
+
+        args = [new[id(arg)] if _is_csg(arg) else arg for arg in e.args]
+        shape_box = boxes[id(e)][0]
+        if (e.transformed_name().lower() in BOUNDED_CSG and shape_box is not None and
+                not _is_empty(shape_box) and
+                not any(_name(arg) in ('bounded_by', 'clipped_by') for arg in e.args)):
+            # Before the modifiers, so that the transformations apply to the box
+            position = next((i for i, arg in enumerate(args) if not _is_object(arg)),
+                            len(args))
+            args.insert(position, BoundedBy(Box(*shape_box)))
+            bounded += 1
+        if len(args) == len(e.args) and all(new_arg is arg for new_arg, arg in zip(args, e.args)):
+            new[id(e)] = e
+        else:
+            new[id(e)] = shallowcopy(e)
+            new[id(e)].args = args
+
+    return [new[id(e)] if _is_csg(e) else e for e in objects], bounded
+
+
+def cull_objects(objects, camera, aspect_ratio=None, margin=0.0, boxes=None):
+    """ Removes the objects whose bounding box is entirely outside the view of the
+    camera (expanded by `margin`). Returns the visible objects and the number of
+    objects removed; all objects are kept for unsupported cameras. """
+    frustum = camera_frustum(camera, aspect_ratio)
+    if frustum is None:
+        return objects, 0
+    boxes = bounding_boxes(objects, boxes)
+    location, normals = frustum
+    visible = [e for e in objects
+               if boxes[id(e)][1] is None or _is_empty(boxes[id(e)][1]) or
+               not _outside(boxes[id(e)][1], location, normals, margin)]
+    return visible, len(objects) - len(visible)
+
+
+def camera_frustum(camera, aspect_ratio=None):
+    """ Returns the location of a perspective camera and the normals (pointing
+    inwards) of the planes that enclose its view, or None if the camera uses
+    keywords other than location, look_at, angle, right, up, direction and sky """
+    vectors = dict(CAMERA_VECTORS)
+    angle = None
+    args = list(camera.args)
+    i = 0
+    while i < len(args):
+        if _name(args[i]) == 'perspective':
+            i += 1
+            continue
+        if i + 1 >= len(args) or not (_name(args[i]) in vectors or _name(args[i]) == 'angle'):
+            return None
+        if args[i] == 'angle':
+            if not _is_number(args[i + 1]) or not 0 < args[i + 1] < 180:
+                return None
+            angle = float(args[i + 1])
+        else:
+            vectors[args[i]] = _vector(args[i + 1])
+            if vectors[args[i]] is None:
+                return None
+        i += 2
+
+    location, right, up = vectors['location'], vectors['right'], vectors['up']
+    if aspect_ratio is not None:
+        right = _scaled(right, aspect_ratio / _length(right))
+    if angle is not None:
+        distance = _length(right) / (2 * math.tan(math.radians(angle) / 2))
+    else:
+        distance = _length(vectors['direction'])
+    if vectors['look_at'] is not None:
+        direction = _subtract(vectors['look_at'], location)
+        side = _cross(vectors['sky'], direction)
+        axes = [direction, side, _cross(direction, side)]
+    else:
+        axes = [vectors['direction'], right, up]
+    if not distance or not all(_length(axis) for axis in axes):
+        return None
+
+    direction, side, upward = [_scaled(axis, 1 / _length(axis)) for axis in axes]
+    tan_horizontal = _length(right) / (2 * distance)
+    tan_vertical = _length(up) / (2 * distance)
+    normals = [direction]
+    for axis, tangent in ((side, tan_horizontal), (upward, tan_vertical)):
+        normals += [_subtract(_scaled(direction, tangent), axis),
+                    _subtract(_scaled(direction, tangent), _scaled(axis, -1))]
+    return location, normals
+
+
+def _is_csg(e):
+    return _is_optimized(e) and e.transformed_name().lower() in CSG_NAMES
+
+
+def _name(arg):
+    """ The keyword or POV-Ray name of an argument ('' for other arguments) """
+    if isinstance(arg, str):
+        return arg
+    return arg.transformed_name().lower() if hasattr(arg, 'transformed_name') else ''
+
+
+def _is_empty(box):
+    return any(low > high for low, high in zip(*box))
+
+
+def _outside(box, location, normals, margin):
+    """ Tests if a box is entirely on the outer side of one of the planes """
+    low, high = box
+    for normal in normals:
+        # The corner of the box that is furthest inside
+        corner = [high[k] + margin if normal[k] >= 0 else low[k] - margin for k in range(3)]
+        if _dot(normal, _subtract(corner, location)) < 0:
+            return True
+    return False
+
+
+def _shape_box(e, children):
+    """ Returns (box of the shape, box) of an object given the boxes of its objects """
+    if not _is_optimized(e) and not hasattr(e, 'bounding_box'):
+        return None, None
+    name = e.transformed_name().lower()
+    start = SHAPE_ARGS.get(name, 0)
+    try:
+        if hasattr(e, 'bounding_box'):
+            # i.e. the primitive batches
+            box = e.bounding_box()
+        elif name in SHAPE_ARGS:
+            box = globals()['_%s_box' % name](*e.args[:start])
+        elif name in ('union', 'merge'):
+            box = _union(children) if children and None not in children else None
+        elif name == 'intersection':
+            known = [child for child in children if child is not None]
+            box = _intersection(known) if known else None
+        elif name == 'difference':
+            box = children[0] if children else None
+        else:
+            box = None
+    except (TypeError, ValueError, IndexError, ZeroDivisionError):
+        # Arguments that are not numbers (i.e. declared identifiers)
+        box = None
+    if box is None or _is_empty(box):
+        return box, box
+    return box, _transformed(box, e.args[start:])
+
+
+def _sphere_box(center, radius):
+    center, radius = _vector(center), abs(float(radius))
+    return (tuple(c - radius for c in center), tuple(c + radius for c in center))
+
+
+def _cone_box(base, base_radius, cap, cap_radius):
+    """ The box of the two discs at the ends of the cone """
+    base, cap = _vector(base), _vector(cap)
+    axis = _subtract(cap, base)
+    axis = _scaled(axis, 1 / _length(axis))
+    discs = [(point, abs(float(radius))) for point, radius in
+             ((base, base_radius), (cap, cap_radius))]
+    extent = [math.sqrt(max(0.0, 1 - a * a)) for a in axis]
+    return (tuple(min(point[k] - radius * extent[k] for point, radius in discs) for k in range(3)),
+            tuple(max(point[k] + radius * extent[k] for point, radius in discs) for k in range(3)))
+
+
+def _cylinder_box(base, cap, radius):
+    return _cone_box(base, radius, cap, radius)
+
+
+def _box_box(corner, other_corner):
+    corner, other_corner = _vector(corner), _vector(other_corner)
+    return (tuple(map(min, corner, other_corner)), tuple(map(max, corner, other_corner)))
+
+
+def _text_box(font_type, font, string, thickness, offset):
+    """ A box with room for the widest letters, the letters are not measured """
+    if font_type not in ('ttf', 'internal') or not re.match(r'^".*"$', string):
+        return None
+    letters = len(string) - 2
+    offset = _vector(offset) if not _is_number(offset) else (float(offset), 0.0, 0.0)
+    shift = [(letters - 1) * o for o in offset]
+    size = (letters * TEXT_LETTER_WIDTH, 1.0, float(thickness))
+    return (tuple(min(0.0, s) + min(0.0, z) - TEXT_MARGIN for s, z in zip(shift, size)),
+            tuple(max(0.0, s) + max(0.0, z) + TEXT_MARGIN for s, z in zip(shift, size)))
+
+
+def _union(boxes):
+    return (tuple(min(box[0][k] for box in boxes) for k in range(3)),
+            tuple(max(box[1][k] for box in boxes) for k in range(3)))
+
+
+def _intersection(boxes):
+    return (tuple(max(box[0][k] for box in boxes) for k in range(3)),
+            tuple(min(box[1][k] for box in boxes) for k in range(3)))
+
+
+def _transformed(box, args):
+    """ Applies the transformations in the modifiers of an object to its box,
+    returns None for transformations that are not supported """
+    corners = [(x, y, z) for x in (box[0][0], box[1][0]) for y in (box[0][1], box[1][1])
+               for z in (box[0][2], box[1][2])]
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if _name(arg) in ('translate', 'scale', 'rotate', 'matrix') and i + 1 < len(args):
+            transform = globals()['_' + arg](args[i + 1])
+            if transform is None:
+                return None
+            corners = [transform(corner) for corner in corners]
+            i += 2
+            continue
+        if isinstance(arg, str) and UNKNOWN_TRANSFORMS.search(arg):
+            return None
+        if _name(arg) == 'transform':
+            return None
+        i += 1
+    return (tuple(min(corner[k] for corner in corners) for k in range(3)),
+            tuple(max(corner[k] for corner in corners) for k in range(3)))
+
+
+def _translate(value):
+    offset = _vector(value)
+    return offset and (lambda point: tuple(p + o for p, o in zip(point, offset)))
+
+
+def _scale(value):
+    factors = _vector(value, scalar=True)
+    return factors and (lambda point: tuple(p * f for p, f in zip(point, factors)))
+
+
+def _rotate(value):
+    """ Rotation around the x, y and then z axis (in degrees, left-handed as POV-Ray) """
+    angles = _vector(value)
+    if angles is None:
+        return None
+    cx, cy, cz = [math.cos(math.radians(a)) for a in angles]
+    sx, sy, sz = [math.sin(math.radians(a)) for a in angles]
+
+    def rotate(point):
+        x, y, z = point
+        y, z = y * cx - z * sx, y * sx + z * cx
+        x, z = x * cy + z * sy, z * cy - x * sy
+        x, y = x * cz - y * sz, x * sz + y * cz
+        return x, y, z
+    return rotate
+
+
+def _matrix(value):
+    m = _vector(value, length=12)
+    return m and (lambda point: tuple(point[0] * m[k] + point[1] * m[3 + k] +
+                                      point[2] * m[6 + k] + m[9 + k] for k in range(3)))
+
+
+def _vector(value, scalar=False, length=3):
+    """ Converts a vector argument to a tuple of floats (None if it is not numeric) """
+    if _is_number(value):
+        return (float(value),) * length if scalar else None
+    if isinstance(value, str) or not hasattr(value, '__len__') or len(value) != length:
+        return None
+    if not all(_is_number(v) for v in value):
+        return None
+    return tuple(float(v) for v in value)
+
+
+def _subtract(a, b):
+    return tuple(x - y for x, y in zip(a, b))
+
+
+def _scaled(a, factor):
+    return tuple(x * factor for x in a)
+
+
+def _dot(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+def _cross(a, b):
+    return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+
+
+def _length(a):
+    return math.sqrt(_dot(a, a))
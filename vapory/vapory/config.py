@@ -2,6 +2,35 @@ import os
 
 POVRAY_BINARY = ("povray.exe" if os.name=='nt' else "povray")
 
+# Pass scenes to POV-Ray through a pipe (+I-) instead of a scene file
+SCENE_PIPE = False
+
+# Folder for the temporary scene files (None: the current folder). A tmpfs
+# folder such as '/dev/shm' keeps them in memory; #include files are then
+# only found through the `includedirs` of the render functions.
+TEMP_DIR = None
+
+# Write elements that occur more than once in a scene (i.e. the same texture
+# for every atom) as a single #declare, referenced by its identifier
+DECLARE_REPEATED = False
+
+# Treat elements as immutable: copies (copy, add_args, Scene.add_objects, ...)
+# share their nested elements instead of copying them (deepcopy). Elements must
+# then not be changed in place once they are used in another element or scene.
+IMMUTABLE_ELEMENTS = False
+
+# Significant digits of the floats in the POV-Ray code (None: all digits, i.e.
+# up to 17 for coordinates computed with numpy)
+FLOAT_PRECISION = None
+
+# Render threads of each POV-Ray process (+WT); None: POV-Ray's default of one
+# thread per CPU, which oversubscribes the CPUs when rendering in parallel
+RENDER_THREADS = None
+
+# Seconds after which a POV-Ray process is killed and TimeoutError raised (i.e.
+# a hung render); None: no limit
+RENDER_TIMEOUT = None
+
 GLOBAL_SCENE_SETTINGS = {
     "charset"        : "ascii",
     "adc_bailout"    : "1/255",
@@ -1,15 +1,51 @@
+from numbers import Integral, Real
+from . import config
+
 WIKIREF = "http://wiki.povray.org/content/Reference:"
 
+def format_number(x):
+    """ Formats a number using config.FLOAT_PRECISION significant digits for
+    floats (all digits if it is None) """
+    if config.FLOAT_PRECISION is None or (type(x) is not float and isinstance(x, Integral)):
+        return str(x)
+    return "%.*g" % (config.FLOAT_PRECISION, x)
+
+def _is_number(e):
+    # The exact types first, the abstract Real (numpy scalars) is a slow test
+    return type(e) is float or type(e) is int or isinstance(e, Real)
+
+def number_format():
+    """ The '%' format of `format_number` for floats, i.e. for formatting many
+    numbers at once """
+    if config.FLOAT_PRECISION is None:
+        return "%s"
+    return "%%.%dg" % config.FLOAT_PRECISION
+
 def vectorize(arr):
     """ transforms [a, b, c] into string "<a, b, c>"" """
-    return "<%s>" % ",".join([str(e) for e in arr])
+    dtype = getattr(arr, 'dtype', None)
+    if dtype is not None and (dtype.itemsize == 8 or dtype.kind != 'f' or
+                              config.FLOAT_PRECISION is not None):
+        # numpy arrays: converts all values to Python numbers at once (which
+        # would add digits to a float32 that is not rounded)
+        arr = arr.tolist()
+    if config.FLOAT_PRECISION is None:
+        return "<%s>" % ",".join([str(e) for e in arr])
+    float_format = number_format()
+    return "<%s>" % ",".join([float_format % e if type(e) is float else
+                              format_number(e) if _is_number(e) else str(e)
+                              for e in arr])
 
 def format_if_necessary(e):
     """ If necessary, replaces -3 by (-3), and [a, b, c] by <a, b, c> """
 
-    if isinstance(e, (int, float)) and e<0:
-        # This format because POVray interprets -3 as a substraction
-        return "( %s )"%str(e)
+    if type(e) is str:
+        return e
+    if _is_number(e):
+        if e<0:
+            # This format because POVray interprets -3 as a substraction
+            return "( %s )"%format_number(e)
+        return format_number(e)
     if hasattr(e, '__iter__') and not isinstance(e, str):
         # lists, tuples, numpy arrays, become '<a,b,c,d >'
         return vectorize(e)
@@ -2,9 +2,16 @@
 All the advanced Input/Output operations for Vapory
 """
 
-import re
+import asyncio
+import mmap
 import os
 import subprocess
+import threading
+import time
+import weakref
+from io import TextIOWrapper
+from tempfile import mkstemp, TemporaryFile
+from . import config
 from .config import POVRAY_BINARY
 
 try:
@@ -19,11 +26,27 @@ try:
 except:
     ipython_found=False
 
+# The POV-Ray process run by each thread and the threads whose renders are
+# cancelled, see `cancel_renders`
+_RENDERS = {}
+_CANCELLED = weakref.WeakSet()
+_RENDERS_LOCK = threading.Lock()
+
+
+class POVRayError(IOError):
+    """ POV-Ray exited with an error or did not output an image """
+
 def ppm_to_numpy(filename=None, buffer=None, byteorder='>'):
     """Return image data from a raw PGM/PPM file as numpy array.
 
     Format specification: http://netpbm.sourceforge.net/doc/pgm.html
 
+    The image data is not copied: a file is memory-mapped and a `buffer`
+    (bytes, bytearray, memoryview, mmap, ...) is used as it is, so the array
+    is read-only unless the buffer is writable. P6 (color) images have the
+    shape (height, width, 3), P5 (greyscale) images (height, width); images
+    with a maxval above 255 have 16 bits per value.
+
     """
 
     if not numpy_found:
@@ -31,31 +54,110 @@ def ppm_to_numpy(filename=None, buffer=None, byteorder='>'):
 
     if buffer is None:
         with open(filename, 'rb') as f:
-            buffer = f.read()
-    try:
-        header, width, height, maxval = re.search(
-            b"(^P\d\s(?:\s*#.*[\r\n])*"
-            b"(\d+)\s(?:\s*#.*[\r\n])*"
-            b"(\d+)\s(?:\s*#.*[\r\n])*"
-            b"(\d+)\s(?:\s*#.*[\r\n]\s)*)", buffer).groups()
-    except AttributeError:
+            # The map stays open as long as the array refers to it
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(buffer).cast('B')
+    header = _ppm_header(lambda start, size: bytes(view[start:start + size]))
+    if header is None:
         raise ValueError("Not a raw PPM/PGM file: '%s'" % filename)
+    offset, shape, dtype = _ppm_layout(header, byteorder)
 
-    cols_per_pixels = 1 if header.startswith(b"P5") else 3
+    count = int(numpy.prod(shape))
+    if len(view) < offset + count * dtype.itemsize:
+        raise ValueError("Truncated PPM/PGM file: '%s'" % filename)
+    return numpy.frombuffer(view, dtype=dtype, count=count,
+                            offset=offset).reshape(shape)
 
-    dtype = 'uint8' if int(maxval) < 256 else byteorder+'uint16'
-    arr = numpy.frombuffer(buffer, dtype=dtype,
-                           count=int(width)*int(height)*3,
-                           offset=len(header))
 
-    return arr.reshape((int(height), int(width), 3))
+def ppm_frames(stream, byteorder='>'):
+    """ Yields the images of consecutive raw PGM/PPM files in a binary stream
+    (i.e. the standard output of POV-Ray), as numpy arrays like `ppm_to_numpy`.
 
+    Each image is read straight into the memory of its (writable) array.
+    """
+
+    if not numpy_found:
+        raise IOError("Function ppm_frames requires numpy installed.")
+
+    while True:
+        data = bytearray()
+
+        def read(start, size):
+            # The header is read as far as it is parsed, the image data follows
+            while len(data) < start + size:
+                chunk = stream.read(start + size - len(data))
+                if not chunk:
+                    break
+                data.extend(chunk)
+            return bytes(data[start:start + size])
+
+        header = _ppm_header(read)
+        if header is None:
+            if data.strip():
+                raise ValueError("Not a raw PPM/PGM stream")
+            return
+        offset, shape, dtype = _ppm_layout(header, byteorder)
+
+        frame = numpy.empty(shape, dtype=dtype)
+        view = memoryview(frame).cast('B')
+        filled = len(data) - offset
+        view[:filled] = data[offset:]
+        while filled < len(view):
+            size = stream.readinto(view[filled:])
+            if not size:
+                raise ValueError("Truncated PPM/PGM stream")
+            filled += size
+        yield frame
+
+
+def _ppm_header(read):
+    """ Parses the header of a raw PGM/PPM file with `read(start, size)`, which
+    returns (up to) `size` bytes of the file. Returns (magic number, width, height,
+    maxval, offset of the image data), or None if it is not a PGM/PPM file. """
+
+    if read(0, 2) not in (b'P5', b'P6'):
+        return None
+    values = []
+    position = 2
+    while len(values) < 3:
+        byte = read(position, 1)
+        if not byte:
+            return None
+        if byte == b'#':
+            # A comment up to the end of the line
+            while byte not in (b'\n', b'\r', b''):
+                position += 1
+                byte = read(position, 1)
+        elif byte.isspace():
+            position += 1
+        elif byte.isdigit():
+            digits = b''
+            while byte.isdigit():
+                digits += byte
+                position += 1
+                byte = read(position, 1)
+            if not byte.isspace():
+                return None
+            values.append(int(digits))
+        else:
+            return None
+    # A single whitespace character separates maxval from the image data
+    return (read(0, 2), values[0], values[1], values[2], position + 1)
+
+
+def _ppm_layout(header, byteorder):
+    """ Returns the offset, shape and dtype of the image data of a parsed header """
+    magic, width, height, maxval, offset = header
+    shape = (height, width) if magic == b'P5' else (height, width, 3)
+    dtype = numpy.dtype('uint8' if maxval < 256 else byteorder + 'u2')
+    return offset, shape, dtype
 
 
 def render_povstring(string, outfile=None, height=None, width=None,
                      quality=None, antialiasing=None, remove_temp=True,
                      show_window=False, tempfile=None, includedirs=None,
-                     output_alpha=False):
+                     output_alpha=False, region=None, timings=None, threads=None):
 
     """ Renders the provided scene description with POV-Ray.
 
@@ -85,29 +187,156 @@ def render_povstring(string, outfile=None, height=None, width=None,
     numpy array, due to limitations of the intermediate
     ppm format.
 
+    region
+      (start_row, end_row, start_column, end_column) in pixels, starting
+      at 1 (inclusive), to only render part of the image.
+
+    timings
+      If a dictionary is given, the time (in seconds) spent writing the
+      scene file ('write') and running POV-Ray ('povray') is stored in it.
+
+    threads
+      Number of render threads of POV-Ray (+WT), RENDER_THREADS of config.py
+      if None (POV-Ray's default, one per CPU, if that is None as well).
+
     """
 
-    pov_file = tempfile or '__temp__.pov'
-    with open(pov_file, 'w+') as f:
+    def write(f):
+        start = time.time()
+        f.write(string)
+        if timings is not None:
+            timings['write'] = time.time() - start
+
+    return render_povstream(write, outfile, height, width, quality,
+                            antialiasing, remove_temp, show_window, tempfile,
+                            includedirs, output_alpha, region, timings, threads)
+
+
+def render_povstream(write, outfile=None, height=None, width=None,
+                     quality=None, antialiasing=None, remove_temp=True,
+                     show_window=False, tempfile=None, includedirs=None,
+                     output_alpha=False, region=None, timings=None, threads=None):
+
+    """ Renders the scene description written by `write(f)` to the file-like
+    object `f` (i.e. `Scene.write`). See `render_povstring` for the parameters.
+
+    The scene is handed to POV-Ray once: through a pipe if SCENE_PIPE is set
+    (see config.py), otherwise through `tempfile` or a temporary file with a
+    unique name in TEMP_DIR, so that concurrent renders never overwrite each
+    other's scene file.
+    """
+
+    if tempfile is None and config.SCENE_PIPE:
+        return _run_povray(None, outfile, height, width, quality, antialiasing,
+                           show_window, includedirs, output_alpha, region,
+                           timings, write, threads)
+
+    pov_file = tempfile or _temp_scene_file()
+    with open(pov_file, 'w') as f:
+        write(f)
+
+    return render_povfile(pov_file, outfile, height, width, quality,
+                          antialiasing, remove_temp, show_window, includedirs,
+                          output_alpha, region, timings, threads)
+
+
+def _temp_scene_file():
+    """ Creates an empty scene file with a unique name in TEMP_DIR """
+    fd, pov_file = mkstemp(prefix='__temp__', suffix='.pov',
+                           dir=config.TEMP_DIR or '.')
+    os.close(fd)
+    return pov_file
+
+
+def render_povfile(pov_file, outfile=None, height=None, width=None,
+                   quality=None, antialiasing=None, remove_temp=True,
+                   show_window=False, includedirs=None, output_alpha=False,
+                   region=None, timings=None, threads=None):
+
+    """ Renders a scene description file (.pov) with POV-Ray, i.e. as written by
+    `Scene.write`. See `render_povstring` for the parameters; `remove_temp`
+    removes `pov_file` after rendering. """
+
+    try:
+        return _run_povray(pov_file, outfile, height, width, quality,
+                           antialiasing, show_window, includedirs,
+                           output_alpha, region, timings, threads=threads)
+    finally:
+        if remove_temp:
+            os.remove(pov_file)
+
+
+async def render_povstring_async(string, outfile=None, height=None, width=None,
+                                 quality=None, antialiasing=None, remove_temp=True,
+                                 show_window=False, tempfile=None, includedirs=None,
+                                 output_alpha=False, region=None, timings=None, threads=None):
+
+    """ Coroutine version of `render_povstring` (same parameters). POV-Ray runs
+    as an asyncio subprocess, so a single event loop can wait on many renders. """
+
+    def write(f):
+        start = time.time()
         f.write(string)
+        if timings is not None:
+            timings['write'] = time.time() - start
 
-    return_np_array = (outfile is None)
-    display_in_ipython = (outfile=='ipython')
+    return await render_povstream_async(write, outfile, height, width, quality,
+                                        antialiasing, remove_temp, show_window,
+                                        tempfile, includedirs, output_alpha, region,
+                                        timings, threads)
 
-    format_type = "P" if return_np_array else "N"
 
-    if return_np_array:
+async def render_povstream_async(write, outfile=None, height=None, width=None,
+                                 quality=None, antialiasing=None, remove_temp=True,
+                                 show_window=False, tempfile=None, includedirs=None,
+                                 output_alpha=False, region=None, timings=None, threads=None):
+
+    """ Coroutine version of `render_povstream` (same parameters). Numpy arrays
+    returned for `outfile=None` are read-only. """
+
+    if tempfile is None and config.SCENE_PIPE:
+        return await _run_povray_async(None, outfile, height, width, quality,
+                                       antialiasing, show_window, includedirs,
+                                       output_alpha, region, timings, write, threads)
+
+    pov_file = tempfile or _temp_scene_file()
+    with open(pov_file, 'w') as f:
+        write(f)
+
+    try:
+        return await _run_povray_async(pov_file, outfile, height, width, quality,
+                                       antialiasing, show_window, includedirs,
+                                       output_alpha, region, timings, threads=threads)
+    finally:
+        if remove_temp:
+            os.remove(pov_file)
+
+
+def _povray_command(pov_file, outfile, height, width, quality, antialiasing,
+                    show_window, includedirs, output_alpha, region, threads=None):
+
+    """ Returns the POV-Ray command line rendering `pov_file` (standard input if it
+    is None) to `outfile`, written to standard output as a PPM image if it is None """
+
+    format_type = "P" if outfile is None else "N"
+
+    if outfile is None:
         outfile='-'
 
-    if display_in_ipython:
+    if outfile=='ipython':
         outfile = '__temp_ipython__.png'
 
-    cmd = [POVRAY_BINARY, pov_file]
+    cmd = [POVRAY_BINARY, '+I-' if pov_file is None else pov_file]
     if height is not None: cmd.append('+H%d'%height)
     if width is not None: cmd.append('+W%d'%width)
     if quality is not None: cmd.append('+Q%d'%quality)
     if antialiasing is not None: cmd.append('+A%f'%antialiasing)
+    threads = threads or config.RENDER_THREADS
+    if threads is not None: cmd.append('+WT%d'%threads)
     if output_alpha: cmd.append('Output_Alpha=on')
+    if region is not None:
+        cmd.extend(['+SR%d'%region[0], '+ER%d'%region[1],
+                    '+SC%d'%region[2], '+EC%d'%region[3]])
     if not show_window:
         cmd.append('-D')
     else:
@@ -117,23 +346,173 @@ def render_povstring(string, outfile=None, height=None, width=None,
             cmd.append('+L%s'%dir)
     cmd.append("Output_File_Type=%s"%format_type)
     cmd.append("+O%s"%outfile)
-    process = subprocess.Popen(cmd, stderr=subprocess.PIPE,
-                                    stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE)
+    return cmd
+
 
-    out, err = process.communicate(string.encode('ascii'))
+def _povray_result(outfile, returncode, err, frame):
 
-    if remove_temp:
-        os.remove(pov_file)
+    """ Returns the result of a render given the exit code and messages of
+    POV-Ray, and the decoded image if `outfile` is None """
 
-    if process.returncode:
+    if returncode:
         print(type(err), err)
-        raise IOError("POVRay rendering failed with the following error: "+err.decode('ascii'))
+        raise POVRayError("POVRay rendering failed with the following error: "+err.decode('ascii'))
 
-    if return_np_array:
-        return ppm_to_numpy(buffer=out)
+    if outfile is None:
+        if frame is None:
+            raise POVRayError("POVRay did not output an image")
+        return frame
 
-    if display_in_ipython:
+    if outfile=='ipython':
         if not ipython_found:
             raise("The 'ipython' option only works in the IPython Notebook.")
-        return Image(outfile)
+        return Image('__temp_ipython__.png')
+
+
+def cancel_renders(threads):
+    """ Kills the POV-Ray processes run by the given threads (i.e. renders whose
+    result is no longer needed) and makes their renders fail with InterruptedError,
+    also the renders they start later """
+    with _RENDERS_LOCK:
+        for thread in threads:
+            _CANCELLED.add(thread)
+            if thread in _RENDERS:
+                _RENDERS[thread].kill()
+
+
+def _run_povray(pov_file, outfile, height, width, quality, antialiasing,
+                show_window, includedirs, output_alpha, region, timings,
+                write=None, threads=None):
+
+    """ Runs POV-Ray on the scene file `pov_file`, or if it is None, on its
+    standard input with the scene written by `write(f)` """
+
+    cmd = _povray_command(pov_file, outfile, height, width, quality, antialiasing,
+                          show_window, includedirs, output_alpha, region, threads)
+    frame = None
+    timed_out = []
+    thread = threading.current_thread()
+    # POV-Ray messages go to a file; a full stderr pipe would block POV-Ray
+    # while the scene is written to its stdin
+    with TemporaryFile() as log:
+        start = time.time()
+        with _RENDERS_LOCK:
+            if thread in _CANCELLED:
+                raise InterruptedError("POVRay rendering was cancelled")
+            process = subprocess.Popen(cmd, stderr=log,
+                                            stdin=(subprocess.DEVNULL if write is None
+                                                   else subprocess.PIPE),
+                                            stdout=subprocess.PIPE)
+            _RENDERS[thread] = process
+
+        def kill():
+            timed_out.append(True)
+            process.kill()
+
+        # The pipes are read while POV-Ray runs, so it is killed from a timer
+        timer = threading.Timer(config.RENDER_TIMEOUT, kill) if config.RENDER_TIMEOUT else None
+        if timer is not None:
+            timer.start()
+        try:
+            if write is not None:
+                stdin = TextIOWrapper(process.stdin, encoding='utf-8')
+                try:
+                    write(stdin)
+                    stdin.close()
+                except BrokenPipeError:
+                    # POV-Ray stopped parsing, the error is reported below
+                    pass
+                # POV-Ray parses while the scene is being written
+                start = time.time()
+
+            if outfile is None:
+                # Decoded while POV-Ray writes it, without collecting the output first
+                try:
+                    frame = next(ppm_frames(process.stdout), None)
+                except ValueError:
+                    # POV-Ray stopped while writing the image, reported below
+                    frame = None
+            process.stdout.read()
+            process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            with _RENDERS_LOCK:
+                _RENDERS.pop(thread, None)
+        if timings is not None:
+            timings['povray'] = time.time() - start
+        log.seek(0)
+        err = log.read()
+
+    if thread in _CANCELLED:
+        raise InterruptedError("POVRay rendering was cancelled")
+    if timed_out:
+        raise TimeoutError("POVRay rendering timed out after %g seconds" % config.RENDER_TIMEOUT)
+    return _povray_result(outfile, process.returncode, err, frame)
+
+
+async def _run_povray_async(pov_file, outfile, height, width, quality, antialiasing,
+                            show_window, includedirs, output_alpha, region, timings,
+                            write=None, threads=None):
+
+    """ Coroutine version of `_run_povray` """
+
+    cmd = _povray_command(pov_file, outfile, height, width, quality, antialiasing,
+                          show_window, includedirs, output_alpha, region, threads)
+    frame = None
+    with TemporaryFile() as log:
+        start = time.time()
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stderr=log, stdout=subprocess.PIPE,
+            stdin=subprocess.DEVNULL if write is None else subprocess.PIPE)
+
+        async def communicate():
+            nonlocal start
+            if write is not None:
+                try:
+                    write(_StreamWriterText(process.stdin))
+                    await process.stdin.drain()
+                    process.stdin.close()
+                except (BrokenPipeError, ConnectionResetError):
+                    # POV-Ray stopped parsing, the error is reported below
+                    pass
+                start = time.time()
+
+            out = await process.stdout.read()
+            await process.wait()
+            return out
+
+        try:
+            out = await asyncio.wait_for(communicate(), config.RENDER_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise TimeoutError("POVRay rendering timed out after %g seconds"
+                               % config.RENDER_TIMEOUT)
+        except BaseException:
+            # i.e. the render was cancelled
+            if process.returncode is None:
+                process.kill()
+            raise
+        if timings is not None:
+            timings['povray'] = time.time() - start
+        log.seek(0)
+        err = log.read()
+
+    if outfile is None and out:
+        try:
+            frame = ppm_to_numpy(buffer=out)
+        except ValueError:
+            frame = None
+    return _povray_result(outfile, process.returncode, err, frame)
+
+
+class _StreamWriterText:
+    """ Text file-like object writing UTF-8 to an asyncio StreamWriter, which
+    buffers the data until it is drained """
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, text):
+        self.writer.write(text.encode('utf-8'))
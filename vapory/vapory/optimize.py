@@ -0,0 +1,173 @@
+"""
+Optimization pass over the objects of a scene, run before serialization:
+flattens nested CSG operations of the same kind, removes CSG operations with a
+single object and replaces Merge by (the faster) Union if nothing is
+transparent.
+"""
+
+from collections import Counter
+from copy import copy as shallowcopy
+from numbers import Real
+
+from .vapory import (POVRayElement, DECLARED_OBJECTS, Merge, Union,
+                     Intersection, Difference)
+
+# CSG operations whose nested operations of the same kind can be flattened
+ASSOCIATIVE_CSG = (Merge, Union, Intersection)
+CSG = ASSOCIATIVE_CSG + (Difference,)
+# Keywords followed by the amount of transparency
+TRANSPARENCY_KEYWORDS = {'filter', 'transmit'}
+# Color keywords with transparency components (starting at that index)
+TRANSPARENT_COLORS = {'rgbf': 3, 'rgbt': 3, 'rgbft': 3, 'color': 3, 'colour': 3}
+
+
+def optimize_scene(scene):
+    """ Returns a copy of the scene with optimized objects and a report
+    ({change: count}) of what was changed, see `optimize_objects` """
+    objects, report = optimize_objects(scene.objects)
+    new = shallowcopy(scene)
+    new.objects = objects
+    return new, report
+
+
+def optimize_objects(objects):
+    """ Optimizes a list of objects and returns the new list and a report with the
+    number of 'flattened' CSG operations, 'unwrapped' single object operations and
+    merges converted to unions ('merge_to_union'). The given objects are not changed;
+    unchanged elements are shared with the result. """
+    report = Counter()
+    modifiers = {}     # id(modifier) => transparent
+    # (id(object), inside a transparent object) => transparent
+    transparent = _transparent_objects(objects, modifiers)
+
+    def final_class(e, inherited):
+        if type(e) is Merge and not (inherited or transparent[id(e), inherited]):
+            return Union
+        return type(e)
+
+    optimized = {}     # (id(object), inside a transparent object) => optimized object
+    stack = [(e, False, None) for e in objects[::-1] if _is_optimized(e)]
+    while stack:
+        e, inherited, children = stack.pop()
+        if (id(e), inherited) in optimized:
+            continue
+        inside = inherited or _modifiers_transparent(e, modifiers)
+        cls = final_class(e, inherited)
+        if children is None:
+            # Nested operations of the same kind (without modifiers) are
+            # flattened, the remaining objects are optimized first
+            children = []
+            todo = [arg for arg in e.args[::-1] if _is_object(arg)]
+            while todo:
+                child = todo.pop()
+                if (issubclass(cls, ASSOCIATIVE_CSG) and _is_optimized(child) and
+                        final_class(child, inside) is cls and
+                        all(_is_object(arg) for arg in child.args)):
+                    report['flattened'] += 1
+                    todo += child.args[::-1]
+                else:
+                    children.append(child)
+            stack.append((e, inherited, children))
+            stack += [(child, inside, None) for child in children[::-1]
+                      if _is_optimized(child)]
+            continue
+
+        objects_ = [optimized[id(child), inside] if _is_optimized(child) else child
+                    for child in children]
+        other = [arg for arg in e.args if not _is_object(arg)]
+        if isinstance(e, CSG) and len(objects_) == 1 and not other:
+            report['unwrapped'] += 1
+            optimized[id(e), inherited] = objects_[0]
+            continue
+        if cls is not type(e):
+            report['merge_to_union'] += 1
+
+        # Objects keep their place among the modifiers, unless flattened
+        args = [arg for arg in e.args if not _is_object(arg)]
+        if len(objects_) == sum(1 for arg in e.args if _is_object(arg)):
+            objects_ = iter(objects_)
+            args = [next(objects_) if _is_object(arg) else arg for arg in e.args]
+        else:
+            args = objects_ + args
+        if cls is type(e) and all(new is old for new, old in zip(args, e.args)):
+            optimized[id(e), inherited] = e
+            continue
+        new = shallowcopy(e) if cls is type(e) else cls()
+        new.args = args
+        optimized[id(e), inherited] = new
+
+    return [optimized[id(e), False] if _is_optimized(e) else e for e in objects], dict(report)
+
+
+def _transparent_objects(objects, modifiers):
+    """ Returns {(id(object), inside a transparent object): transparent} for the
+    objects and their nested objects """
+    transparent = {}
+    stack = [(e, False, False) for e in objects[::-1] if _is_optimized(e)]
+    while stack:
+        e, inherited, children_done = stack.pop()
+        if (id(e), inherited) in transparent:
+            continue
+        inside = inherited or _modifiers_transparent(e, modifiers)
+        children = [arg for arg in e.args if _is_object(arg) and _is_optimized(arg)]
+        if not children_done and children:
+            stack.append((e, inherited, True))
+            stack += [(child, inside, False) for child in children[::-1]]
+            continue
+        # Objects that can not be optimized (custom __str__) might be transparent
+        transparent[id(e), inherited] = _modifiers_transparent(e, modifiers) or any(
+            transparent[id(arg), inside] if _is_optimized(arg) else True
+            for arg in e.args if _is_object(arg))
+    return transparent
+
+
+def _is_optimized(e):
+    return isinstance(e, POVRayElement) and type(e).__str__ is POVRayElement.__str__
+
+
+def _modifiers_transparent(e, modifiers):
+    """ Tests if the arguments of an element, other than objects, can make it
+    transparent; `modifiers` caches the result for the nested elements """
+    if not _may_be_transparent([arg for arg in e.args if not isinstance(arg, POVRayElement)]):
+        for arg in e.args:
+            if not isinstance(arg, POVRayElement) or _is_object(arg):
+                continue
+            if id(arg) not in modifiers:
+                # Textures, pigments, etc. are nested a few levels at most
+                modifiers[id(arg)] = (not _is_optimized(arg) or
+                                      _modifiers_transparent(arg, modifiers))
+            if modifiers[id(arg)]:
+                return True
+        return False
+    return True
+
+
+def _is_object(e):
+    return (isinstance(e, POVRayElement) and
+            (e.transformed_name().lower() in DECLARED_OBJECTS or
+             e.transformed_name().lower().endswith('_batch')))
+
+
+def _may_be_transparent(args):
+    """ Tests if the arguments of an element (not its nested elements) can make an
+    object transparent; unknown identifiers (i.e. 'T_Glass') might """
+    for i, arg in enumerate(args):
+        if isinstance(arg, (list, tuple)):
+            # The entries of a color map, texture map, etc.
+            if (any(isinstance(a, POVRayElement) for a in arg) or
+                    _may_be_transparent(list(arg))):
+                return True
+        if not isinstance(arg, str):
+            continue
+        following = args[i + 1] if i + 1 < len(args) else None
+        if arg in TRANSPARENCY_KEYWORDS:
+            if not (isinstance(following, Real) and following == 0):
+                return True
+        elif arg in TRANSPARENT_COLORS:
+            if hasattr(following, '__len__') and not isinstance(following, str):
+                if any(value != 0 for value in list(following)[TRANSPARENT_COLORS[arg]:]):
+                    return True
+        elif arg[:1].isupper() or any(keyword in arg for keyword in
+                                      TRANSPARENCY_KEYWORDS | {'rgbf', 'rgbt'}):
+            return True
+    return False
@@ -1,7 +1,15 @@
 import webbrowser # <= to open the POVRay help
-from copy import deepcopy
+from copy import copy as shallowcopy, deepcopy
+import hashlib
+import os
 import re
-from .io import render_povstring
+import threading
+import time
+from io import StringIO
+from types import GeneratorType
+from . import config
+from .io import (render_povstring, render_povstream, render_povfile,
+                 render_povstring_async, render_povstream_async)
 
 from .helpers import WIKIREF, vectorize, format_if_necessary
 
@@ -29,19 +37,41 @@ class Scene:
         self.global_settings = global_settings
 
     def __str__(self):
+        out = StringIO()
+        self.write(out)
+        return out.getvalue()
+
+    def write(self, out):
+        """ Writes the POV-Ray code of the scene to the file-like object `out`
+        (i.e. an open .pov file), without building the whole scene as one string. """
 
         included = ['#include "%s"'%e for e in self.included]
-        defaults = ['#default { %s }'%e for e in self.defaults]
         declares = ['#declare %s;'%e for e in self.declares]
 
-        global_settings = ["global_settings{\n%s\n}"%("\n".join(
-                           [str(e) for e in self.global_settings]))]
-        return '\n'.join([str(e)
-                          for l in  [included, declares, self.objects, [self.camera],
-                              self.atmospheric, global_settings]
-                          for e in l])
+        references = None
+        elements = self.objects + [self.camera] + self.atmospheric
+        if config.DECLARE_REPEATED:
+            references, repeated = repeated_elements(elements)
+            declares += repeated
+
+        parts = []
+        for e in included + declares + elements:
+            parts += [e if isinstance(e, (POVRayElement, list)) else str(e), '\n']
+        parts.append('global_settings{\n')
+        for i, e in enumerate(self.global_settings):
+            parts += ['\n'] if i else []
+            parts.append(e if isinstance(e, POVRayElement) else str(e))
+        parts.append('\n}')
+        write_povray(parts, out, references)
 
     def copy(self):
+        if config.IMMUTABLE_ELEMENTS:
+            # The elements are shared, only the lists are copied
+            new = shallowcopy(self)
+            for attr in ('objects', 'atmospheric', 'included', 'defaults',
+                         'declares', 'global_settings'):
+                setattr(new, attr, list(getattr(self, attr)))
+            return new
         return deepcopy(self)
 
     def set_camera(self, new_camera):
@@ -58,7 +88,8 @@ class Scene:
     def render(self, outfile=None, height=None, width=None,
                      quality=None, antialiasing=None, remove_temp=True,
                      auto_camera_angle=True, show_window=False, tempfile=None,
-                     includedirs=None, output_alpha=False):
+                     includedirs=None, output_alpha=False, region=None,
+                     timings=None, threads=None):
 
         """ Renders the scene to a PNG, a numpy array, or the IPython Notebook.
 
@@ -84,14 +115,62 @@ class Scene:
         numpy array, due to limitations of the intermediate
         ppm format.
 
+        region
+          (start_row, end_row, start_column, end_column) in pixels, starting
+          at 1 (inclusive), to only render part of the image.
+
+        timings
+          If a dictionary is given, the time (in seconds) spent writing the
+          scene to the scene file ('serialize') and running POV-Ray
+          ('povray') is stored in it.
+
+        threads
+          Number of render threads of POV-Ray (see `render_povstring`).
+
+        """
+
+        write = self._render_writer(height, width, auto_camera_angle, timings)
+        return render_povstream(write, outfile, height, width,
+                                quality, antialiasing, remove_temp, show_window,
+                                tempfile, includedirs, output_alpha, region,
+                                timings, threads)
+
+    async def render_async(self, outfile=None, height=None, width=None,
+                           quality=None, antialiasing=None, remove_temp=True,
+                           auto_camera_angle=True, show_window=False, tempfile=None,
+                           includedirs=None, output_alpha=False, region=None,
+                           timings=None, threads=None):
+
+        """ Coroutine version of `render` (same parameters), so that an asyncio
+        event loop can run many POV-Ray processes at once:
+
+        >>> await asyncio.gather(*[scene.render_async('frame%d.png' % i, width=320, height=240)
+                                   for i, scene in enumerate(scenes)])
         """
 
+        write = self._render_writer(height, width, auto_camera_angle, timings)
+        return await render_povstream_async(write, outfile, height, width,
+                                            quality, antialiasing, remove_temp,
+                                            show_window, tempfile, includedirs,
+                                            output_alpha, region, timings, threads)
+
+    def _render_writer(self, height, width, auto_camera_angle, timings):
+        """ Sets the aspect ratio of the camera and returns the `write(f)` function
+        of the renders, which stores the 'serialize' time in `timings` """
+
         if auto_camera_angle and width is not None:
             self.camera = self.camera.add_args(['right', [1.0*width/height, 0,0]])
 
-        return render_povstring(str(self), outfile, height, width,
-                                quality, antialiasing, remove_temp, show_window,
-                                tempfile, includedirs, output_alpha)
+        def write(f):
+            start = time.time()
+            self.write(f)
+            if timings is not None:
+                timings['serialize'] = time.time() - start
+        return write
+
+
+# Class name => POV-Ray name, looked up for every serialized element
+_TRANSFORMED_NAMES = {}
 
 
 class POVRayElement:
@@ -99,12 +178,19 @@ class POVRayElement:
         self.args = list(args)
 
     def copy(self):
+        if config.IMMUTABLE_ELEMENTS:
+            # The arguments (and nested elements) are shared with the copy
+            new = shallowcopy(self)
+            new.args = list(self.args)
+            return new
         return deepcopy(self)
 
     @classmethod
     def transformed_name(cls):
         """ Tranform Sphere=>sphere, and LightSource=>light_source """
-        return re.sub(r'(?!^)([A-Z])', r'_\1', cls.__name__)
+        if cls not in _TRANSFORMED_NAMES:
+            _TRANSFORMED_NAMES[cls] = re.sub(r'(?!^)([A-Z])', r'_\1', cls.__name__)
+        return _TRANSFORMED_NAMES[cls]
 
     @classmethod
     def help(cls):
@@ -116,20 +202,30 @@ class POVRayElement:
         return new
 
     def __str__(self):
+        out = StringIO()
+        self.write(out)
+        return out.getvalue()
+
+    def write(self, out):
+        """ Writes the POV-Ray code of the element to the file-like object `out` """
+        write_povray([self], out)
+
+    def povray_parts(self):
+        """ Returns the POV-Ray code of the element as a list of strings and
+        (nested) elements, which are serialized in turn by `write_povray` """
         # Tranforms Sphere=>sphere, and LightSource=>light_source
         name = self.transformed_name().lower()
 
-        return "%s {\n%s \n}" % (name, "\n".join([str(format_if_necessary(e))
-                                                  for e in self.args]))
+        return _joined(self.args, "\n", "%s {\n" % name, " \n}")
 
 
 class POVRayMap(POVRayElement):
-    def __str__(self):
+    def povray_parts(self):
         name = self.transformed_name().lower()
-        return "%s { %s }"%(name,
-                            "\n".join([ "[ %s ]"%(" ".join(
-                                [str(format_if_necessary(e)) for e in l]))
-                                        for l in self.args]))
+        parts = ["%s { " % name]
+        for i, l in enumerate(self.args):
+            parts += _joined(l, " ", "\n[ " if i else "[ ", " ]")
+        return parts + [" }"]
 
 class Macro(POVRayElement):
     """ This special class enables to use macros like
@@ -137,9 +233,208 @@ class Macro(POVRayElement):
     Macro('Tetrahedron_by_Corners', P,Q,R,S,R1,R2, filled)
     """
 
+    def povray_parts(self):
+        return _joined(self.args[1:], " , ", "%s( " % self.args[0], ")")
+
+
+def _joined(args, separator, prefix="", suffix=""):
+    """ Formats the arguments separated by `separator`. Elements are kept for
+    `write_povray`, the code between them is combined into single strings. """
+    parts = []
+    code = [prefix]
+    for i, e in enumerate(args):
+        if i:
+            code.append(separator)
+        if isinstance(e, POVRayElement):
+            parts += ["".join(code), e]
+            code = []
+        else:
+            code.append(str(format_if_necessary(e)))
+    code.append(suffix)
+    parts.append("".join(code))
+    return parts
+
+
+def write_povray(parts, out, references=None, buffer_size=4096):
+    """ Writes a list of strings and elements to the file-like object `out`.
+
+    The element tree is walked with a stack instead of recursive `str()` calls, so
+    deeply nested elements (i.e. long Merge chains) do not hit the recursion limit
+    and every piece of code is copied only once. Elements overriding `__str__`
+    are written using `str()`. Elements listed in `references` ({id(element):
+    code}, see `repeated_elements`) are written as that code; lists of parts
+    are written as if their parts were given and generators of code are written
+    one piece at a time.
+    """
+    stack = parts[::-1]
+    pieces = []
+    references = references or {}
+    while stack:
+        e = stack.pop()
+        if type(e) is str:
+            pieces.append(e)
+            if len(pieces) >= buffer_size:
+                out.write("".join(pieces))
+                pieces = []
+        elif type(e) is list:
+            stack += e[::-1]
+        elif type(e) is GeneratorType:
+            # Code produced in chunks, i.e. by the primitive batches
+            chunk = next(e, None)
+            if chunk is not None:
+                stack += [e, chunk]
+        elif id(e) in references:
+            stack.append(references[id(e)])
+        elif type(e).__str__ is POVRayElement.__str__:
+            stack += e.povray_parts()[::-1]
+        else:
+            stack.append(str(e))
+    out.write("".join(pieces))
+
+
+class StaticInclude:
+    """ Objects that are the same in every frame of an animation, written once
+    to an include file that the scenes of all frames refer to.
+
+    The file is named after its content, so a changed static part never uses
+    an outdated file. Creating a StaticInclude of the same objects again, in
+    the same process, reuses the file without serializing the objects.
+
+    With an `identifier`, the objects (as a union if there are more) are
+    declared under that name instead of being added to the scene, for use as
+    Object(identifier, ...) with different modifiers in each frame.
+
+    Examples
+    ---------
+
+    >>> dna = StaticInclude('dna', [dna_strand], folder='scenes')
+    >>> scene = Scene(camera, objects=[polymerase], included=[dna])
+
+    """
+
+    def __init__(self, name, objects, folder='.', identifier=None):
+        key = (name, os.path.abspath(folder), tuple(id(e) for e in objects), identifier)
+        if key not in _STATIC_INCLUDES:
+            _STATIC_INCLUDES[key] = (_write_static_include(name, objects, folder, identifier),
+                                     objects)
+        self.filename = _STATIC_INCLUDES[key][0]
+
     def __str__(self):
-        return "%s( %s)"%(self.args[0], " , ".join([str(format_if_necessary(e))
-                                                   for e in self.args[1:]]))
+        return self.filename
+
+
+# (name, folder, object ids, identifier) => (include file, objects); the objects are kept
+# so that their ids are not reused
+_STATIC_INCLUDES = {}
+
+
+def _write_static_include(name, objects, folder, identifier=None):
+    """ Writes the objects to '<folder>/<name>_<hash>.inc', unless it exists """
+    declarations = []
+    references = None
+    if config.DECLARE_REPEATED:
+        # The identifiers are used up by the time a scene declares its own
+        references, declarations = repeated_elements(objects, prefix='VaporyInclude')
+    objects = list(objects)
+    if identifier is not None:
+        objects = [['#declare %s = ' % identifier,
+                    objects[0] if len(objects) == 1 else Union(*objects)]]
+    code = StringIO()
+    write_povray([[e, '\n'] for e in declarations + objects], code, references)
+    code = code.getvalue()
+
+    digest = hashlib.sha1(code.encode('utf-8')).hexdigest()[:12]
+    filename = os.path.abspath(os.path.join(folder, '%s_%s.inc' % (name, digest)))
+    if not os.path.exists(filename):
+        # Other processes (or threads) might be writing the same file
+        temp_file = '%s.%d-%d' % (filename, os.getpid(), threading.get_ident())
+        with open(temp_file, 'w') as f:
+            f.write(code)
+        os.replace(temp_file, filename)
+    return filename
+
+
+# Elements that can be declared once and referenced as 'name { IDENTIFIER }'
+DECLARED_MODIFIERS = {'texture', 'pigment', 'finish', 'normal', 'interior',
+                      'material', 'media'}
+# Objects, referenced as 'object { IDENTIFIER }'. Triangles (only used in
+# meshes) are left out, as are the objects of elements that do not accept a
+# declared object.
+DECLARED_OBJECTS = {'object', 'sphere', 'sphere_sweep', 'superellipsoid', 'sor',
+                    'text', 'torus', 'box', 'cone', 'cylinder', 'height_field',
+                    'isosurface', 'julia_fractal', 'lathe', 'ovus',
+                    'bicubic_patch', 'disc', 'mesh', 'mesh2', 'polygon',
+                    'plane', 'poly', 'cubic', 'quartic', 'polynomial',
+                    'quadric', 'union', 'intersection', 'difference', 'merge',
+                    'blob', 'parametric', 'prism'}
+INLINE_OBJECT_PARENTS = {'blob', 'contained_by', 'mesh', 'mesh2'}
+
+
+def repeated_elements(elements, prefix='VaporyShared'):
+    """ Finds the elements (textures, pigments, objects, ...) that occur more than
+    once in `elements` and their children, either as the same object or as elements
+    with identical POV-Ray code.
+
+    Returns the {id(element): code} references for `write_povray` and the
+    declarations (lists of parts for `write_povray`) of the repeated elements,
+    ordered so that every declaration only uses previous declarations.
+    """
+    keys = {}        # id(element) => key number
+    numbers = {}     # key (code with numbered elements) => key number
+    counts = []
+    first = []
+    names = []
+    inline = set()   # key numbers of objects that can not be referenced
+    inline_ids = set()
+    stack = [(e, None) for e in elements[::-1] if isinstance(e, POVRayElement)]
+    while stack:
+        e, parts = stack.pop()
+        if parts is None and id(e) in keys:
+            counts[keys[id(e)]] += 1
+            if id(e) in inline_ids:
+                inline.add(keys[id(e)])
+            continue
+        if type(e).__str__ is not POVRayElement.__str__:
+            key = ('__str__', str(e))
+            name = None
+        elif parts is None:
+            # Number the children first, then the element itself
+            parts = e.povray_parts()
+            stack.append((e, parts))
+            children = [p for p in parts if isinstance(p, POVRayElement)]
+            if e.transformed_name().lower() in INLINE_OBJECT_PARENTS:
+                inline_ids.update(id(child) for child in children)
+            stack += [(child, None) for child in children[::-1]]
+            continue
+        else:
+            # Generators of code (primitive batches) make a key unique
+            key = tuple(keys[id(p)] if isinstance(p, POVRayElement) else p for p in parts)
+            name = e.transformed_name().lower()
+
+        number = numbers.setdefault(key, len(counts))
+        if number == len(counts):
+            counts.append(0)
+            first.append(e)
+            names.append(name)
+        counts[number] += 1
+        keys[id(e)] = number
+        if id(e) in inline_ids:
+            inline.add(number)
+
+    identifiers = {}
+    declarations = []
+    for number, name in enumerate(names):
+        if counts[number] < 2 or not (name in DECLARED_MODIFIERS or
+                                      (name in DECLARED_OBJECTS and number not in inline)):
+            continue
+        identifier = '%s%d' % (prefix, len(identifiers))
+        identifiers[number] = '%s { %s }' % ('object' if name in DECLARED_OBJECTS else name,
+                                             identifier)
+        declarations.append(['#declare %s = ' % identifier] + first[number].povray_parts())
+
+    references = {element_id: identifiers[number] for element_id, number in keys.items()
+                  if number in identifiers}
+    return references, declarations
 
 # =============================================================================
 # =============================================================================